@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import File, Page
+from .models import File, Page, Job, AudioCache, Upload, EmailOutbox
+from .models import PipelineSpan
 from django import forms
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
@@ -16,10 +17,17 @@ admin.site.index_title = "Admin"
 # Data models
 @admin.register(File)
 class FileAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'lang', 'name', 'current_page', 
-                    'uploaded_at', 'last_modified')
-    list_filter = ('user', 'lang', 'uploaded_at', 'last_modified')
+    list_display = ('id', 'user', 'lang', 'name', 'status', 'current_page', 
+                    'uploaded_at', 'last_modified', 'miss_rate')
+    list_filter = ('user', 'lang', 'status', 'uploaded_at', 'last_modified')
     search_fields = ('user', 'name', 'uploaded_at', 'last_modified')
+    
+    @admin.display(description="Pages read without audio")
+    def miss_rate(self, obj):
+        """ Percentage of pages opened before their audio was ready """
+        if not obj.pages_read:
+            return "-"
+        return f"{obj.pages_read_missing / obj.pages_read:.0%}"
 
 
 @admin.register(Page)
@@ -30,6 +38,49 @@ class PageAdmin(admin.ModelAdmin):
     ordering = ('file', 'page_num')
 
 
+@admin.register(AudioCache)
+class AudioCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'size', 'hits', 'created_at', 'last_used_at')
+    search_fields = ('key',)
+    ordering = ('-last_used_at',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'file', 'page', 'attempts',
+                    'run_after', 'worker', 'updated_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('file__name', 'worker', 'last_error')
+    raw_id_fields = ('file', 'page')
+
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'name', 'status', 'offset', 'size',
+                    'created_at', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('name', 'user__email')
+    raw_id_fields = ('user', 'file')
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'run_after',
+                    'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject', 'last_error')
+
+
+@admin.register(PipelineSpan)
+class PipelineSpanAdmin(admin.ModelAdmin):
+    list_display = ('id', 'stage', 'file', 'page_num', 'seconds', 'failed',
+                    'run_id', 'started_at')
+    list_filter = ('stage', 'failed')
+    search_fields = ('file__name', 'run_id')
+    raw_id_fields = ('file',)
+    ordering = ('-started_at',)
+
+
 # Custom user model setup
 class UserCreationForm(forms.ModelForm):
     """A form for creating new users. Includes all the required
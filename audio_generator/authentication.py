@@ -0,0 +1,103 @@
+import copy
+import threading
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from libs.cache import TTLCache
+from .models import User
+
+# Users logged in by the current request (saved after the response)
+pending_logins = threading.local()
+
+
+def defer_last_login(user: User):
+    """ Save user last login when the current request finishes,
+    after the response is sent
+
+    Args:
+        user (User): user logged in
+    """
+    user.last_login = timezone.now()
+    if not hasattr(pending_logins, 'users'):
+        pending_logins.users = {}
+    pending_logins.users[user.id] = user.last_login
+
+
+@receiver(request_finished)
+def save_last_logins(sender, **kwargs):
+    """ Save last login of the users logged in by the request """
+    users = getattr(pending_logins, 'users', None)
+    if not users:
+        return
+    pending_logins.users = {}
+    for user_id, last_login in users.items():
+        User.objects.filter(id=user_id).update(last_login=last_login)
+
+
+# Users of the authenticated requests, by id (per process: changes made by
+# other processes are seen after AUTH_USER_CACHE_SECONDS at most)
+user_cache = TTLCache(
+    settings.AUTH_USER_CACHE_SIZE,
+    settings.AUTH_USER_CACHE_SECONDS,
+)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """ Remove user from cache when it changes (deactivation, password...) """
+    user_cache.delete(instance.id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWT authentication getting the token user from a process cache,
+    instead of querying it in each request """
+
+    def get_user(self, validated_token):
+        """ Get token user, from cache or database
+
+        Args:
+            validated_token (Token): access token
+
+        Raises:
+            InvalidToken: token without user id
+            AuthenticationFailed: user missing, inactive or password changed
+
+        Returns:
+            User: copy of the cached user (each request can change it)
+        """
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # Query user only if it is not cached
+        user = user_cache.get(user_id)
+        if user is None:
+            user = self.user_model.objects.filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).first()
+            if not user:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(user_id, user)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return copy.copy(user)
@@ -0,0 +1,244 @@
+import threading
+from time import monotonic
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+from libs.bloom import BloomFilter
+
+
+class BlacklistFilter:
+    """ Bloom filter of the blacklisted tokens jti, in front of the
+    blacklist queries: most tokens checked are not blacklisted, and the
+    filter answers "not blacklisted" exactly.
+
+    The filter is synced with the database by blacklist id (new rows only,
+    a primary key range query, whatever the size of the table). Ids skipped
+    by a sync or a load (transactions not committed yet) are checked again
+    during TOKEN_FILTER_GAP_SECONDS.
+
+    Queries run without the lock (held only to read or update the filter),
+    and a full filter is rebuilt in a background thread, the old one still
+    answering meanwhile.
+    """
+
+    def __init__(self, capacity: int = None, error_rate: float = None):
+        """ Setup filter (loaded in the first check)
+
+        Args:
+            capacity (int, optional): tokens in the filter before it is
+                rebuilt. Defaults to settings.TOKEN_FILTER_CAPACITY.
+            error_rate (float, optional): false positive rate.
+                Defaults to settings.TOKEN_FILTER_ERROR_RATE.
+        """
+        self.capacity = capacity or settings.TOKEN_FILTER_CAPACITY
+        self.error_rate = error_rate or settings.TOKEN_FILTER_ERROR_RATE
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        self.gaps = {}
+        self.loading = False
+
+    def load(self) -> tuple:
+        """ Read the tokens blacklisted and not expired yet (no lock held)
+
+        Returns:
+            tuple:
+                BloomFilter: filter with the tokens
+                int: last blacklist id loaded
+                dict: ids missing below the last id (gap id: found at)
+        """
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        last_id = BlacklistedToken.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        tokens = BlacklistedToken.objects.filter(
+            id__lte=last_id,
+            token__expires_at__gt=timezone.now(),
+        ).values_list('token__jti', flat=True)
+        for jti in tokens.iterator(chunk_size=10000):
+            bloom.add(jti)
+
+        # Ids missing below the last id may be transactions not committed
+        # yet (only the latest TOKEN_FILTER_GAP_IDS ids, older ones are
+        # rolled back or pruned)
+        now = monotonic()
+        first_id = max(last_id - settings.TOKEN_FILTER_GAP_IDS, 0)
+        found = set(BlacklistedToken.objects.filter(
+            id__gt=first_id, id__lte=last_id,
+        ).values_list('id', flat=True))
+        gaps = {
+            gap_id: now for gap_id in range(first_id + 1, last_id)
+            if gap_id not in found
+        }
+        return bloom, last_id, gaps
+
+    def rebuild(self):
+        """ Load the filter and replace the current one """
+        try:
+            bloom, last_id, gaps = self.load()
+            with self.lock:
+                self.bloom = bloom
+                self.last_id = last_id
+                self.gaps = gaps
+        finally:
+            with self.lock:
+                self.loading = False
+
+    def rebuild_in_background(self):
+        """ Rebuild filter in a thread (with its own database connection) """
+
+        def run():
+            try:
+                self.rebuild()
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def start_rebuild(self, background: bool = False):
+        """ Rebuild filter, unless other thread is already doing it
+
+        Args:
+            background (bool, optional): rebuild in a thread.
+                Defaults to False.
+        """
+        with self.lock:
+            if self.loading:
+                return
+            self.loading = True
+        if background:
+            self.rebuild_in_background()
+        else:
+            self.rebuild()
+
+    def reset(self):
+        """ Forget loaded tokens (filter loaded again in the next check) """
+        with self.lock:
+            self.bloom = None
+            self.last_id = 0
+            self.gaps = {}
+
+    def sync(self):
+        """ Add tokens blacklisted by any process since the last sync """
+
+        with self.lock:
+            if self.bloom is None:
+                return
+            last_id = self.last_id
+            gap_ids = list(self.gaps)
+
+        query = Q(id__gt=last_id)
+        if gap_ids:
+            query |= Q(id__in=gap_ids)
+        rows = list(
+            BlacklistedToken.objects.filter(query).order_by('id')
+            .values_list('id', 'token__jti')
+        )
+
+        # Other threads may have synced (or rebuilt) meanwhile: adding a
+        # token again does nothing, and only ids above the current last id
+        # open gaps
+        now = monotonic()
+        with self.lock:
+            if self.bloom is None:
+                return
+            for blacklist_id, jti in rows:
+                self.bloom.add(jti)
+                self.gaps.pop(blacklist_id, None)
+                if blacklist_id > self.last_id:
+                    for gap_id in range(self.last_id + 1, blacklist_id):
+                        self.gaps[gap_id] = now
+                    self.last_id = blacklist_id
+
+            # Skipped ids not committed after a while: rolled back
+            self.gaps = {
+                gap_id: found_at for gap_id, found_at in self.gaps.items()
+                if now - found_at < settings.TOKEN_FILTER_GAP_SECONDS
+            }
+
+    def add(self, jti: str):
+        """ Add token blacklisted by this process
+
+        Args:
+            jti (str): token id
+        """
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def __contains__(self, jti: str) -> bool:
+        """ Check token (True while other thread loads the filter the first
+        time: the database is queried) """
+
+        # First check loads the filter, a full filter is rebuilt in background
+        if self.bloom is None:
+            self.start_rebuild()
+        elif len(self.bloom) >= self.capacity:
+            self.start_rebuild(background=True)
+
+        self.sync()
+        with self.lock:
+            return self.bloom is None or jti in self.bloom
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class FilteredRefreshToken(RefreshToken):
+    """ Refresh token checking the blacklist filter before the database """
+
+    def check_blacklist(self):
+        """ Raise TokenError if the token is blacklisted (queried only if
+        the filter can not tell it is not) """
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if jti not in blacklist_filter:
+            return
+        if BlacklistedToken.objects.filter(token__jti=jti).exists():
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self) -> tuple:
+        """ Blacklist token, and add it to the filter
+
+        Returns:
+            tuple:
+                BlacklistedToken: blacklist entry
+                bool: entry created
+        """
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+def prune_tokens(batch: int, before=None):
+    """ Delete expired tokens (and their blacklist entries) by batches,
+    so each delete is a short transaction
+
+    Args:
+        batch (int): tokens deleted at a time
+        before (datetime, optional): expiration limit. Defaults to now.
+
+    Yields:
+        int: tokens deleted in each batch
+    """
+    before = before or timezone.now()
+    while True:
+        ids = list(
+            OutstandingToken.objects
+            .filter(expires_at__lt=before)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch]
+        )
+        if not ids:
+            break
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        yield len(ids)
@@ -0,0 +1,187 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job
+from .tracing import trace_run
+
+logger = logging.getLogger(__name__)
+
+
+def split_pdf_handler(job: Job):
+    """ Split the job file in pages """
+    with trace_run(job.file_id):
+        job.file.split_pdf()
+
+
+class AudioLeased(Exception):
+    """ Page audio generated by other process (job retried later) """
+    pass
+
+
+def generate_audio_handler(job: Job):
+    """ Generate the audio of the job page (retried later if other
+    process has it, done if the audio exists) """
+    
+    page = job.page
+    if not page.claim_audio():
+        page.refresh_from_db()
+        if page.path_audio:
+            return
+        raise AudioLeased(f"page {page} leased until {page.audio_lease_until}")
+    
+    # Release the page on errors, for the retry of this job
+    try:
+        with trace_run(page.file_id, page.page_num):
+            page.generate_audio()
+    except Exception:
+        page.release_audio()
+        raise
+
+
+HANDLERS = {
+    Job.SPLIT_PDF: split_pdf_handler,
+    Job.GENERATE_AUDIO: generate_audio_handler,
+}
+
+
+def claim_jobs(worker: str, limit: int) -> list:
+    """ Lock and lease pending jobs (or running jobs with expired lease,
+    marked dead if they are out of attempts) so no other worker process
+    can take them
+
+    Args:
+        worker (str): worker name, saved in the jobs
+        limit (int): max number of jobs to claim
+
+    Returns:
+        list: Job objects claimed
+    """
+
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.JOBS_LEASE_SECONDS)
+    with transaction.atomic():
+        jobs = list(
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=Job.PENDING, run_after__lte=now) |
+                Q(status=Job.RUNNING, lease_until__lt=now)
+            )
+            .order_by('run_after', 'id')[:limit]
+        )
+
+        # Expired leases of jobs out of attempts: the job killed the worker
+        # (out of memory, crash) before saving any result
+        dead = [
+            job for job in jobs
+            if job.status == Job.RUNNING and job.attempts >= job.max_attempts
+        ]
+        if dead:
+            Job.objects.filter(id__in=[job.id for job in dead]).update(
+                status=Job.DEAD,
+                lease_until=None,
+                last_error="lease expired: worker stopped while running the job",
+            )
+            for job in dead:
+                logger.warning(
+                    "job %s dead, lease expired (attempt %d)", job, job.attempts
+                )
+
+        ids = [job.id for job in jobs if job not in dead]
+        Job.objects.filter(id__in=ids).update(
+            status=Job.RUNNING,
+            lease_until=lease_until,
+            worker=worker,
+            attempts=F('attempts') + 1,
+        )
+
+    return list(
+        Job.objects
+        .filter(id__in=ids)
+        .select_related('file', 'page')
+        .order_by('run_after', 'id')
+    )
+
+
+def claimed_by(job: Job) -> Q:
+    """ Filter of a job still leased by the claim that returned it (the
+    lease can expire and the job can be claimed again by other worker)
+
+    Args:
+        job (Job): claimed job
+
+    Returns:
+        Q: job filter
+    """
+    return Q(id=job.id, worker=job.worker, attempts=job.attempts)
+
+
+def extend_leases(jobs: list):
+    """ Renew the lease of jobs still in progress (only jobs not claimed
+    again by other worker)
+
+    Args:
+        jobs (list): claimed Job objects to renew
+    """
+
+    if not jobs:
+        return
+    claims = Q()
+    for job in jobs:
+        claims |= claimed_by(job)
+    lease_until = timezone.now() + timedelta(seconds=settings.JOBS_LEASE_SECONDS)
+    Job.objects.filter(claims, status=Job.RUNNING).update(
+        lease_until=lease_until
+    )
+
+
+def run_job(job: Job) -> bool:
+    """ Run a claimed job, and save the result:
+    done, pending (retry with backoff) or dead (too many attempts)
+
+    Args:
+        job (Job): claimed job
+
+    Returns:
+        bool: True if the job finished successfully
+    """
+
+    try:
+        HANDLERS[job.kind](job)
+    except Exception:
+        logger.exception("job %s failed (attempt %d)", job, job.attempts)
+        error = traceback.format_exc()
+
+        if job.attempts >= job.max_attempts:
+            status = Job.DEAD
+            run_after = job.run_after
+        else:
+            status = Job.PENDING
+            delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            run_after = timezone.now() + timedelta(seconds=delay)
+        success = False
+        result = {
+            "status": status,
+            "run_after": run_after,
+            "lease_until": None,
+            "last_error": error,
+        }
+    else:
+        success = True
+        result = {
+            "status": Job.DONE,
+            "lease_until": None,
+            "last_error": '',
+        }
+
+    # Result not saved if the lease expired and other worker has the job
+    if not Job.objects.filter(claimed_by(job)).update(**result):
+        logger.warning("job %s lease lost, result not saved", job)
+    return success
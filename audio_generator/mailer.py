@@ -0,0 +1,90 @@
+import logging
+import smtplib
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def claim_emails(limit: int) -> list:
+    """ Lock and lease pending emails (delaying their run_after, so other
+    senders skip them, and a crashed sender releases them)
+
+    Args:
+        limit (int): max number of emails to claim
+
+    Returns:
+        list: EmailOutbox objects claimed
+    """
+
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.EMAIL_LEASE_SECONDS)
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.PENDING, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        EmailOutbox.objects.filter(id__in=ids).update(
+            run_after=lease_until,
+            attempts=F('attempts') + 1,
+        )
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_emails(connection, emails: list) -> int:
+    """ Send claimed emails over an open connection, and save the result:
+    sent, pending (retry with backoff) or dead (too many attempts). Any
+    error of an email is saved in it, the next emails are still sent
+
+    Args:
+        connection (BaseEmailBackend): open email connection
+        emails (list): EmailOutbox objects claimed
+
+    Returns:
+        int: emails sent
+    """
+
+    sent = 0
+    for email in emails:
+        try:
+            connection.send_messages([email.get_message(connection)])
+        except Exception as error:
+            logger.exception(
+                "email %s failed (attempt %d)", email.id, email.attempts
+            )
+
+            if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                status = EmailOutbox.DEAD
+                run_after = timezone.now()
+            else:
+                status = EmailOutbox.PENDING
+                delay = settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1)
+                run_after = timezone.now() + timedelta(seconds=delay)
+            EmailOutbox.objects.filter(id=email.id).update(
+                status=status,
+                run_after=run_after,
+                last_error=repr(error),
+            )
+
+            # Reconnect for the next emails after connection errors, unless
+            # the server only rejected this message (smtp errors are
+            # OSError too)
+            rejected = (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)
+            if isinstance(error, OSError) and not isinstance(error, rejected):
+                connection.close()
+                connection.open()
+        else:
+            EmailOutbox.objects.filter(id=email.id).update(
+                status=EmailOutbox.SENT,
+                sent_at=timezone.now(),
+                last_error='',
+            )
+            sent += 1
+    return sent
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from audio_generator.models import Page
+from audio_generator.tracing import trace_run
+
+
+class Command(BaseCommand):
+    help = "Extract and save the text of pages splitted before text was saved"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=200,
+            help="Pages updated at a time",
+        )
+
+    def handle(self, *args, **options):
+
+        pages = Page.objects.filter(text_compressed__isnull=True).exclude(path_pdf='')
+        self.stdout.write(f"pages without text: {pages.count()}")
+
+        last_id = 0
+        updated = 0
+        errors = 0
+        while True:
+            batch = list(
+                pages
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'path_pdf', 'file_id', 'page_num')[:options['batch']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            # Extract text of each page (spans of the batch saved together)
+            pages_text = []
+            with trace_run(None):
+                for page in batch:
+                    try:
+                        page.extract_text()
+                    except Exception as error:
+                        errors += 1
+                        self.stderr.write(f"error in page {page.id}: {error}")
+                        continue
+                    pages_text.append(page)
+
+            Page.objects.bulk_update(pages_text, ['text_compressed'])
+            updated += len(pages_text)
+            self.stdout.write(f"pages updated: {updated}")
+
+        self.stdout.write(f"done: {updated} pages updated, {errors} errors")
@@ -0,0 +1,39 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from audio_generator.models import Upload
+
+
+class Command(BaseCommand):
+    help = "Abort uploads without new chunks for a while (removing their chunks)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=settings.UPLOAD_EXPIRE_HOURS,
+            help="Hours since the last chunk to abort an upload",
+        )
+
+    def handle(self, *args, **options):
+
+        # Abandoned uploads: no chunk received since the limit
+        updated_before = timezone.now() - timedelta(hours=options['hours'])
+        uploads = Upload.objects.filter(
+            status=Upload.UPLOADING,
+            updated_at__lt=updated_before,
+        )
+
+        aborted = 0
+        errors = 0
+        for upload in uploads.iterator():
+            try:
+                upload.abort()
+            except Exception as error:
+                errors += 1
+                self.stderr.write(f"error in upload {upload.id}: {error}")
+                continue
+            aborted += 1
+
+        self.stdout.write(f"done: {aborted} uploads aborted, {errors} errors")
@@ -0,0 +1,36 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from audio_generator.models import Page
+from audio_generator.pipeline import get_lang_engine
+
+
+class Command(BaseCommand):
+    help = "Delete streaming chunks of pages completed a while ago"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=settings.STREAM_CHUNKS_KEEP_HOURS,
+            help="Hours the chunks are kept after the page is completed",
+        )
+
+    def handle(self, *args, **options):
+
+        # Players still playing the chunks finished long ago
+        completed_before = timezone.now() - timedelta(hours=options['hours'])
+        pages = (
+            Page.objects
+            .exclude(path_audio='')
+            .filter(audio_chunks__gt=0, audio_completed_at__lt=completed_before)
+            .select_related('file')
+        )
+
+        deleted = 0
+        for page in pages.iterator():
+            page.delete_audio_chunks(get_lang_engine(page.file.lang).extension)
+            deleted += 1
+
+        self.stdout.write(f"done: chunks of {deleted} pages deleted")
@@ -0,0 +1,42 @@
+from time import sleep
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+from audio_generator.models import PipelineSpan
+
+
+class Command(BaseCommand):
+    help = "Delete pipeline spans older than the retention days, by batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.TRACE_RETENTION_DAYS,
+            help="Days of spans to keep",
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=5000,
+            help="Spans deleted at a time",
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help="Seconds between batches (less load on the database)",
+        )
+
+    def handle(self, *args, **options):
+
+        before = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        for batch_deleted in PipelineSpan.prune(before, options['batch']):
+            deleted += batch_deleted
+            self.stdout.write(f"spans deleted: {deleted}")
+            if options['pause']:
+                sleep(options['pause'])
+
+        self.stdout.write(f"done: {deleted} old spans deleted")
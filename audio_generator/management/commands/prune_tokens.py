@@ -0,0 +1,33 @@
+from time import sleep
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from audio_generator.blacklist import prune_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired refresh tokens and their blacklist entries, by batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=settings.TOKEN_PRUNE_BATCH,
+            help="Tokens deleted at a time",
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help="Seconds between batches (less load on the database)",
+        )
+
+    def handle(self, *args, **options):
+
+        deleted = 0
+        for batch_deleted in prune_tokens(options['batch']):
+            deleted += batch_deleted
+            self.stdout.write(f"tokens deleted: {deleted}")
+            if options['pause']:
+                sleep(options['pause'])
+
+        self.stdout.write(f"done: {deleted} expired tokens deleted")
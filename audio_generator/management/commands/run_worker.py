@@ -0,0 +1,81 @@
+import os
+import signal
+import socket
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.core.management.base import BaseCommand
+from audio_generator.jobs import claim_jobs, extend_leases, run_job
+from misojo.db_pool.base import pool_stats
+
+
+class Command(BaseCommand):
+    help = "Process background jobs (pdf splits and audio generation)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.JOBS_CONCURRENCY,
+            help="Max number of jobs running at the same time",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Stop when there are no more jobs to run",
+        )
+
+    def handle(self, *args, **options):
+
+        concurrency = options['concurrency']
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+
+        # Finish running jobs before exit
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.stdout.write(f"worker {worker} started ({concurrency} threads)")
+
+        running = {}
+        last_renew = monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not self.stopping:
+
+                # Forget finished jobs
+                for job_id, (job, future) in list(running.items()):
+                    if future.done():
+                        del running[job_id]
+
+                # Renew leases of long jobs (splits of big files)
+                if monotonic() - last_renew > settings.JOBS_LEASE_SECONDS / 3:
+                    extend_leases([job for job, _ in running.values()])
+                    last_renew = monotonic()
+
+                # Claim only the jobs we can run now (backpressure)
+                jobs = claim_jobs(worker, concurrency - len(running))
+                connection.close()
+                for job in jobs:
+                    running[job.id] = (job, executor.submit(self.run, job))
+
+                if not jobs:
+                    if options['once'] and not running:
+                        break
+                    sleep(settings.JOBS_POLL_INTERVAL)
+
+        self.stdout.write(f"worker {worker} stopped (db connections pool: "
+                          f"{pool_stats()})")
+
+    def run(self, job):
+        """ Run job in worker thread and release its db connection """
+        try:
+            self.stdout.write(f"running job {job}")
+            run_job(job)
+        finally:
+            connection.close()
+
+    def stop(self, signum, frame):
+        """ Stop claiming new jobs """
+        self.stdout.write("stopping worker, waiting running jobs...")
+        self.stopping = True
@@ -0,0 +1,73 @@
+import signal
+from time import sleep
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from audio_generator.mailer import claim_emails, send_emails
+
+
+class Command(BaseCommand):
+    help = "Send queued emails by batches, over a single smtp connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=settings.EMAIL_BATCH_SIZE,
+            help="Max number of emails claimed at a time",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Stop when there are no more emails to send",
+        )
+
+    def handle(self, *args, **options):
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # Connection kept open while there are emails to send
+        email_connection = get_connection()
+        connected = False
+        total = 0
+        while not self.stopping:
+            emails = claim_emails(options['batch'])
+            if not emails:
+
+                # Idle: close connection (servers drop idle clients)
+                if connected:
+                    email_connection.close()
+                    connected = False
+                if options['once']:
+                    break
+                sleep(settings.EMAIL_POLL_INTERVAL)
+                continue
+
+            try:
+                if not connected:
+                    email_connection.open()
+                    connected = True
+                sent = send_emails(email_connection, emails)
+            except OSError as error:
+                # Server down: claimed emails are retried when their lease ends
+                self.stderr.write(f"email server error: {error!r}")
+                email_connection.close()
+                connected = False
+                if options['once']:
+                    break
+                sleep(settings.EMAIL_POLL_INTERVAL)
+                continue
+
+            total += sent
+            self.stdout.write(f"{sent}/{len(emails)} emails sent")
+
+        if connected:
+            email_connection.close()
+        self.stdout.write(f"email sender stopped ({total} emails sent)")
+
+    def stop(self, signum, frame):
+        """ Stop after the current batch """
+        self.stdout.write("stopping email sender...")
+        self.stopping = True
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from audio_generator.pipeline import storage_cache
+
+
+class Command(BaseCommand):
+    help = "Show usage of the local disk cache of storage files"
+
+    def handle(self, *args, **options):
+
+        if not storage_cache:
+            self.stdout.write("storage cache disabled (STORAGE_CACHE_DIR)")
+            return
+
+        stats = storage_cache.stats()
+        self.stdout.write(f"folder: {storage_cache.folder}")
+        self.stdout.write(f"files: {stats['files']}")
+        self.stdout.write(
+            f"size: {stats['bytes'] / 1024 ** 2:.1f} MB "
+            f"of {storage_cache.max_bytes / 1024 ** 2:.1f} MB"
+        )
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, "
+            f"hit rate: {stats['hit_rate']:.1%}"
+        )
@@ -0,0 +1,154 @@
+import os
+import hmac
+import random
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from libs.metrics import MetricsRegistry
+from misojo.db_pool.base import pool_stats
+
+# Histogram buckets of the sampled database usage and of the response sizes
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+DESCRIPTIONS = {
+    "misojo_requests_total": "Requests by view, method and status",
+    "misojo_request_seconds": "Request latency (until the response is returned)",
+    "misojo_response_bytes": "Response size (not streamed responses)",
+    "misojo_request_db_queries": "Database queries by request (sampled)",
+    "misojo_request_db_seconds": "Database time by request (sampled)",
+    "misojo_db_pool_connections": "Database pool connections by state",
+    "misojo_db_pool_waiting": "Threads waiting for a database connection",
+    "misojo_db_pool_checkout_seconds_max": "Max wait for a database connection",
+}
+
+# Metrics of this process, exported with the ones of the other processes
+registry = MetricsRegistry(settings.METRICS_DIR, settings.METRICS_FLUSH_SECONDS)
+
+
+def collect_pool_stats(registry: MetricsRegistry):
+    """ Save database pool gauges of this process
+
+    Args:
+        registry (MetricsRegistry): process registry
+    """
+    pid = str(os.getpid())
+    for database, stats in pool_stats().items():
+        labels = (("database", database), ("pid", pid))
+        for state in ("in_use", "idle"):
+            registry.set_gauge(
+                "misojo_db_pool_connections", stats[state], labels + (("state", state),)
+            )
+        registry.set_gauge("misojo_db_pool_waiting", stats["waiting"], labels)
+        registry.set_gauge(
+            "misojo_db_pool_checkout_seconds_max", stats["checkout_seconds_max"], labels
+        )
+
+
+registry.collectors.append(collect_pool_stats)
+
+
+class QueryTimer:
+    """ Database execute wrapper counting queries and their time """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += perf_counter() - start
+
+
+def record_request(request, response, seconds: float, query_timer: QueryTimer = None):
+    """ Save metrics of a request
+
+    Args:
+        request (HttpRequest): request served
+        response (HttpResponse): response returned
+        seconds (float): request latency
+        query_timer (QueryTimer, optional): database usage of the request
+            (if it was sampled). Defaults to None.
+    """
+    match = request.resolver_match
+    view = match.view_name if match else "unmatched"
+    labels = (("view", view), ("method", request.method))
+
+    registry.inc(
+        "misojo_requests_total",
+        labels + (("status", str(response.status_code)),)
+    )
+    registry.observe("misojo_request_seconds", seconds, labels)
+    if not response.streaming:
+        registry.observe(
+            "misojo_response_bytes", len(response.content), labels, BYTES_BUCKETS
+        )
+    if query_timer:
+        registry.observe(
+            "misojo_request_db_queries", query_timer.queries, labels, QUERIES_BUCKETS
+        )
+        registry.observe("misojo_request_db_seconds", query_timer.seconds, labels)
+    registry.flush()
+
+
+class MetricsMiddleware:
+    """ Record latency, size and database usage of the requests (database
+    usage only of a sample of the sync requests: METRICS_SAMPLE_RATE) """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        start = perf_counter()
+        if random.random() < settings.METRICS_SAMPLE_RATE:
+            query_timer = QueryTimer()
+            with connection.execute_wrapper(query_timer):
+                response = self.get_response(request)
+        else:
+            query_timer = None
+            response = self.get_response(request)
+        record_request(request, response, perf_counter() - start, query_timer)
+        return response
+
+    async def __acall__(self, request):
+        # Queries of async views run in other threads (not counted)
+        start = perf_counter()
+        response = await self.get_response(request)
+        record_request(request, response, perf_counter() - start)
+        return response
+
+
+def metrics(request):
+    """ Metrics of all the processes of the host, in prometheus text format
+    (requires "Authorization: Bearer METRICS_TOKEN", optional in dev) """
+
+    token = settings.METRICS_TOKEN
+    if not token and settings.ENV != "dev":
+        return HttpResponse(
+            "metrics token not set\n", status=403, content_type="text/plain"
+        )
+    if token and not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(),
+        f"Bearer {token}".encode()
+    ):
+        return HttpResponse("unauthorized\n", status=401, content_type="text/plain")
+
+    return HttpResponse(
+        registry.render(DESCRIPTIONS),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0015_page_audio_lease_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioCache',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('path', models.FileField(max_length=500, upload_to='audio_cache/')),
+                ('size', models.IntegerField(default=0)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
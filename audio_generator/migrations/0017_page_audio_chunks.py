@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0016_audiocache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='audio_chunks',
+            field=models.IntegerField(default=0),
+        ),
+    ]
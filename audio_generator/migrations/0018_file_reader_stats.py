@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0017_page_audio_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='pages_read',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='pages_read_missing',
+            field=models.IntegerField(default=0),
+        ),
+    ]
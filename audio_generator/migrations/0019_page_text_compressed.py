@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0018_file_reader_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='text_compressed',
+            field=models.BinaryField(null=True),
+        ),
+    ]
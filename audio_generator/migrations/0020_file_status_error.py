@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+
+def set_ready_status(apps, schema_editor):
+    """ Files already splitted are ready """
+    File = apps.get_model('audio_generator', 'File')
+    File.objects.filter(pages_generated=True).update(status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0019_page_text_compressed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('ready', 'Ready'), ('error', 'Error')], default='processing', max_length=10),
+        ),
+        migrations.RunPython(set_ready_status, migrations.RunPython.noop),
+    ]
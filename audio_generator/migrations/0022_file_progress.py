@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:28
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_progress(apps, schema_editor):
+    """ Progress of files already splitted and voiced """
+    File = apps.get_model('audio_generator', 'File')
+    Page = apps.get_model('audio_generator', 'Page')
+    pages_audio = (
+        Page.objects
+        .filter(file=models.OuterRef('pk'))
+        .exclude(path_audio='')
+        .values('file')
+        .annotate(count=models.Count('id'))
+        .values('count')
+    )
+    File.objects.filter(pages_generated=True).update(
+        pages_split=models.F('pages_num'),
+        pages_audio=Coalesce(models.Subquery(pages_audio), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0021_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='pages_audio',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='pages_split',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0023_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineSpan',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('stage', models.CharField(choices=[('split', 'Split pdf page'), ('save_pdf', 'Save page pdf in storage'), ('download', 'Download pdf from storage'), ('extract_text', 'Extract page text'), ('tts', 'Text to speech'), ('publish_chunks', 'Save audio chunks in storage (streaming)'), ('upload', 'Save audio in storage')], max_length=20)),
+                ('run_id', models.CharField(blank=True, db_index=True, max_length=16)),
+                ('page_num', models.IntegerField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('seconds', models.FloatField()),
+                ('failed', models.BooleanField(default=False)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spans', to='audio_generator.file')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stage', 'started_at'], name='audio_gener_stage_60cf91_idx'), models.Index(fields=['started_at'], name='audio_gener_started_631836_idx')],
+            },
+        ),
+    ]
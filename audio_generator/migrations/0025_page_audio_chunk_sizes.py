@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0024_pipelinespan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='audio_chunk_sizes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='audio_completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_generator', '0025_page_audio_chunk_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='audio_attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
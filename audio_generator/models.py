@@ -1,19 +1,39 @@
 import os
-import requests
-from time import sleep
-from threading import Thread
-from django.db import models
+import math
+import uuid
+import zlib
+import logging
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from time import monotonic
+from datetime import timedelta
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 from django.conf import settings
 from django.core.files import File as django_file
+from django.core.files.base import ContentFile
 from django.template.loader import render_to_string
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.mail import EmailMultiAlternatives
-from libs.audio import generate_audio as gtts_generate_audio
-from libs.pdf import get_pdf_text, split_pdf as split_pdf_lib
-from misojo.settings import MEDIA_ROOT, TEMP_FOLDER
+from libs.audio import TTSEngine, split_sentences
+from libs.audio import generate_audio as tts_generate_audio
+from libs.pdf import get_pdf_text, split_pdf as split_pdf_lib, PdfParseError
+from libs.storage import open_local, start_upload
+from libs.storage import write_chunk as write_upload_chunk
+from libs.storage import complete_upload, abort_upload
+from libs.sandbox import SandboxPool, SandboxError
+from .pipeline import AudioPipeline, rate_limiter, storage_cache
+from .pipeline import get_lang_engine, get_text_extractor
+from .scheduler import prioritize_pages
+from .tracing import pipeline_span, span_enter, get_run_id
+from .tracing import SpanTimer
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+logger = logging.getLogger(__name__)
+
 
 class UserManager(BaseUserManager):
     """ Custom user model manager for create new users"""
@@ -36,24 +56,22 @@ class UserManager(BaseUserManager):
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
-        user.save(using=self._db)
         
-        # Send activation email
-        activation_link = f"{settings.HOST}/activate/{user.id}"
-        text_content = f"Activation link: {activation_link}"
-        html_template_path = "audio_generator/activate.html"
-        html_content = render_to_string(html_template_path, {
-            "activation_link": activation_link,
-        })
-        
-        msg = EmailMultiAlternatives(
-            "Activate your Misojo account",
-            text_content,
-            settings.EMAIL_HOST_USER,
-            [email],
-        )
-        msg.attach_alternative(html_content, "text/html")
-        msg.send()
+        # Save user and queue activation email together
+        # (sent by "manage.py send_emails")
+        with transaction.atomic(using=self._db):
+            user.save(using=self._db)
+            
+            activation_link = f"{settings.HOST}/activate/{user.id}"
+            html_template_path = "audio_generator/activate.html"
+            EmailOutbox.objects.using(self._db).create(
+                to=email,
+                subject="Activate your Misojo account",
+                text_content=f"Activation link: {activation_link}",
+                html_content=render_to_string(html_template_path, {
+                    "activation_link": activation_link,
+                }),
+            )
         
         return user
     
@@ -125,6 +143,61 @@ class User(AbstractUser):
         return self.is_admin
     
 
+class EmailOutbox(models.Model):
+    """ Email queued in the same transaction as the data it notifies,
+    and sent in background by "manage.py send_emails" """
+    
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    ]
+    
+    id = models.AutoField(primary_key=True)
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    text_content = models.TextField()
+    html_content = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def get_message(self, connection=None) -> EmailMultiAlternatives:
+        """ Build email message
+        
+        Args:
+            connection (BaseEmailBackend, optional): connection to send
+                the message. Defaults to None (new connection).
+        
+        Returns:
+            EmailMultiAlternatives: message with text and html content
+        """
+        message = EmailMultiAlternatives(
+            self.subject,
+            self.text_content,
+            settings.EMAIL_HOST_USER,
+            [self.to],
+            connection=connection,
+        )
+        if self.html_content:
+            message.attach_alternative(self.html_content, "text/html")
+        return message
+    
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+
 class File(models.Model):
     """ Text file uploaded to convert to audio """
     
@@ -133,6 +206,15 @@ class File(models.Model):
         ('en', 'English'),
     ]
     
+    PROCESSING = 'processing'
+    READY = 'ready'
+    ERROR = 'error'
+    STATUSES = [
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (ERROR, 'Error'),
+    ]
+    
     def user_upload_to(instance, filename) -> str:
         """ Get path to save file
         
@@ -152,43 +234,173 @@ class File(models.Model):
     pages_num = models.IntegerField(default=0)
     lang = models.CharField(max_length=2, choices=LANGS, default='en')
     pages_generated = models.BooleanField(default=False)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    pages_read = models.IntegerField(default=0)
+    pages_read_missing = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PROCESSING)
+    error = models.TextField(blank=True)
+    pages_split = models.IntegerField(default=0)
+    pages_audio = models.IntegerField(default=0)
     
     def split_pdf(self):
-        """ Split pdf file and create pages instances """
+        """ Split pdf file and create pages instances. Files that can not
+        be parsed within the sandbox limits are quarantined (error status),
+        other errors (like the file removed from the cache) are raised,
+        so the job is retried """
+        
+        # Skip files already splitted (job retried after success) or quarantined
+        if self.pages_generated or self.status == File.ERROR:
+            return
         
-        # Split pdf file
-        username = self.user.email
-        output_path = os.path.join(TEMP_FOLDER, username, self.name)
-        os.makedirs(output_path, exist_ok=True)
-        self.pages_num = split_pdf_lib(self.path.url, output_path)
+        # Split pdf file in sandboxed processes, saving each page
+        # directly in storage (one split and one save span by file)
+        pages = []
+        progress_at = monotonic()
+        split_timer = SpanTimer(PipelineSpan.SPLIT, self.id)
+        save_timer = SpanTimer(PipelineSpan.SAVE_PDF, self.id)
+        sandbox = SandboxPool(
+            workers=settings.PDF_SPLIT_WORKERS,
+            cpu_seconds=settings.PDF_SANDBOX_CPU_SECONDS,
+            memory_bytes=settings.PDF_SANDBOX_MEMORY_MB * 1024 * 1024,
+            timeout=settings.PDF_SANDBOX_TIMEOUT,
+            task_errors=(PdfParseError,),
+        )
+        try:
+            with sandbox, span_enter(open_local(
+                self.path.storage,
+                self.path.name,
+                settings.TEMP_FOLDER,
+                cache=storage_cache
+            ), PipelineSpan.DOWNLOAD, self.id) as pdf_file:
+                
+                # Split time: wait for the sandboxed processes
+                split_pages = split_pdf_lib(
+                    pdf_file,
+                    get_text_extractor(),
+                    pool=sandbox,
+                    pages_per_task=settings.PDF_PAGES_PER_TASK
+                )
+                while True:
+                    with split_timer:
+                        page = next(split_pages, None)
+                    if page is None:
+                        break
+                    page_num, page_content, text = page
+                    page_obj = Page(file=self, page_num=page_num)
+                    page_obj.text = text
+                    with save_timer:
+                        page_obj.path_pdf.save(
+                            f"{page_num}.pdf",
+                            ContentFile(page_content),
+                            save=False
+                        )
+                    pages.append(page_obj)
+                    
+                    # Publish progress (at most once per second)
+                    if monotonic() - progress_at >= 1:
+                        File.objects.filter(id=self.id).update(pages_split=page_num)
+                        progress_at = monotonic()
+        except SandboxError as error:
+            self.quarantine(str(error), pages)
+            return
+        finally:
+            split_timer.record()
+            save_timer.record()
         
         # Save pages instances
-        pdf_pages = os.listdir(output_path)
-        for page_pdf in pdf_pages:
-            page_path = os.path.join(output_path, page_pdf)
-            page_num = int(page_pdf.split('.')[0])
-            
-            print(f"creating page {page_num} for file {self.name}")
-            
-            # Base instance
-            page_obj = Page.objects.create(
-                file=self,
-                page_num=page_num,
-            )
-            
-            # Add file
-            with open(page_path, 'rb') as track_file:
-                file = django_file(track_file)
-                page_obj.path_pdf.save(page_pdf, file, save=True)
-            page_obj.save()
-            
-            sleep(2)
+        Page.objects.bulk_create(pages, batch_size=500)
+        logger.info(
+            "pages created file=%s run=%s pages=%d",
+            self.id, get_run_id(), len(pages)
+        )
             
         # Update pages generated status
+        self.pages_num = len(pages)
+        self.pages_split = len(pages)
         self.pages_generated = True
+        self.status = File.READY
         self.save()
-            
-        print(f"pages created for file {self.name}")
+        
+    def get_progress(self) -> dict:
+        """ Get split and audio generation progress
+        
+        Returns:
+            dict:
+                status (str): file status (one of File.STATUSES)
+                pages_num (int): total pages (0 until the file is splitted)
+                pages_split (int): pages splitted
+                pages_audio (int): pages with audio generated
+                done (bool): True if all the pages have audio, or the
+                    file was quarantined
+        """
+        return {
+            "status": self.status,
+            "pages_num": self.pages_num,
+            "pages_split": self.pages_split,
+            "pages_audio": self.pages_audio,
+            "done": self.status == File.ERROR or (
+                self.status == File.READY and self.pages_audio >= self.pages_num
+            ),
+        }
+    
+    def quarantine(self, error: str, pages: list = None):
+        """ Save error status of a file that can not be processed
+        
+        Args:
+            error (str): error description
+            pages (list, optional): Page objects not saved yet, to remove
+                their files from storage. Defaults to None.
+        """
+        
+        logger.warning(
+            "file quarantined file=%s run=%s error=%s",
+            self.id, get_run_id(), error
+        )
+        for page in pages or []:
+            page.path_pdf.delete(save=False)
+        
+        self.status = File.ERROR
+        self.error = error
+        self.save()
+        
+    def generate_audio(self) -> dict:
+        """ Generate audio of all pending pages, in parallel (pages leased
+        by other processes, like the cron or the job worker, are skipped)
+        
+        Returns:
+            dict: stats of the audio pipeline
+        """
+        pages = self.tracks.filter(path_audio='').select_related('file__user')
+        claimed = [page for page in pages.order_by('page_num') if page.claim_audio()]
+        return AudioPipeline().run(claimed)
+    
+    def read_page(self, page_num: int) -> bool:
+        """ Save reader position, and if the page audio was ready
+        
+        Args:
+            page_num (int): page opened by the reader
+        
+        Returns:
+            bool: True if the page audio was ready
+        """
+        
+        page = self.tracks.filter(page_num=page_num).first()
+        audio_ready = bool(page and page.path_audio)
+        File.objects.filter(id=self.id).update(
+            current_page=page_num,
+            last_read_at=timezone.now(),
+            pages_read=models.F('pages_read') + 1,
+            pages_read_missing=(
+                models.F('pages_read_missing') + (0 if audio_ready else 1)
+            ),
+        )
+        self.current_page = page_num
+        
+        # Generate now the page the reader is waiting for
+        if page and not audio_ready:
+            page.request_audio()
+        
+        return audio_ready
                  
     def __str__(self):
         return self.name
@@ -198,8 +410,8 @@ class File(models.Model):
 @receiver(post_save, sender=File)
 def file_updated(sender, instance, created, **kwargs):
     if created:
-        # Split pdf in background
-        Thread(target=instance.split_pdf).start()
+        # Queue split job (processed by "manage.py run_worker")
+        Job.enqueue(Job.SPLIT_PDF, file=instance)
         
 
 class Page(models.Model):
@@ -218,52 +430,809 @@ class Page(models.Model):
     path_audio = models.FileField(upload_to=user_upload_to, max_length=500)
     path_pdf = models.FileField(upload_to=user_upload_to, max_length=500)
     page_num = models.IntegerField()
+    audio_lease_until = models.DateTimeField(null=True, blank=True)
+    audio_attempts = models.IntegerField(default=0)
+    audio_chunks = models.IntegerField(default=0)
+    audio_chunk_sizes = models.JSONField(default=list, blank=True)
+    audio_completed_at = models.DateTimeField(null=True, blank=True)
+    text_compressed = models.BinaryField(null=True, editable=False)
+    
+    @property
+    def text(self) -> str:
+        """ Get page text (None if not extracted yet)
+        
+        Returns:
+            str: text from the page pdf
+        """
+        if self.text_compressed is None:
+            return None
+        return zlib.decompress(self.text_compressed).decode()
+    
+    @text.setter
+    def text(self, value: str):
+        """ Save page text compressed
+        
+        Args:
+            value (str): text from the page pdf
+        """
+        self.text_compressed = zlib.compress(value.encode())
+    
+    def extract_text(self) -> str:
+        """ Get text from page pdf file, and save it in the page
+        
+        Returns:
+            str: text from the page pdf
+        """
+        
+        # Read pdf (downloaded to a temp file in remote storages)
+        with span_enter(open_local(
+            self.path_pdf.storage,
+            self.path_pdf.name,
+            settings.TEMP_FOLDER,
+            cache=storage_cache
+        ), PipelineSpan.DOWNLOAD, self.file_id, self.page_num) as pdf_file:
+            with pipeline_span(
+                PipelineSpan.EXTRACT_TEXT, self.file_id, self.page_num
+            ):
+                self.text = get_pdf_text(pdf_file, get_text_extractor())
+        return self.text
+    
+    @classmethod
+    def claim_pending_audio(cls, limit: int) -> list:
+        """ Lock and lease pages without audio, so other processes
+        skip them while the audio is generated. Pages ahead of
+        active readers go first, pages failed TTS_MAX_ATTEMPTS times
+        are not claimed anymore.
+        
+        Args:
+            limit (int): max number of pages to claim
+        
+        Returns:
+            list: Page objects claimed (with file and user loaded)
+        """
+        
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=settings.TTS_LEASE_SECONDS)
+        with transaction.atomic():
+            pages = (
+                cls.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(path_audio='')
+                .filter(audio_attempts__lt=settings.TTS_MAX_ATTEMPTS)
+                .filter(
+                    models.Q(audio_lease_until__isnull=True) |
+                    models.Q(audio_lease_until__lt=now)
+                )
+            )
+            pages = prioritize_pages(pages)
+            ids = list(pages.values_list('id', flat=True)[:limit])
+            cls.objects.filter(id__in=ids).update(
+                audio_lease_until=lease_until,
+                audio_attempts=models.F('audio_attempts') + 1,
+            )
+        
+        pages = cls.objects.filter(id__in=ids).select_related('file__user')
+        pages = {page.id: page for page in pages}
+        return [pages[page_id] for page_id in ids]
+    
+    def claim_audio(self) -> bool:
+        """ Lease page to generate its audio, if no other process has it
+        
+        Returns:
+            bool: True if the page was claimed
+        """
+        now = timezone.now()
+        lease_until = now + timedelta(seconds=settings.TTS_LEASE_SECONDS)
+        claimed = Page.objects.filter(
+            models.Q(audio_lease_until__isnull=True) |
+            models.Q(audio_lease_until__lt=now),
+            id=self.id,
+            path_audio='',
+        ).update(
+            audio_lease_until=lease_until,
+            audio_attempts=models.F('audio_attempts') + 1,
+        )
+        return claimed == 1
+    
+    def release_audio(self):
+        """ Remove the lease of a page whose generation failed, so it can
+        be generated again without waiting for the lease to expire """
+        Page.objects.filter(id=self.id, path_audio='').update(
+            audio_lease_until=None
+        )
+        self.audio_lease_until = None
+    
+    def request_audio(self) -> bool:
+        """ Queue audio generation if the page is not generated
+        or being generated
+        
+        Returns:
+            bool: True if a job was queued
+        """
+        if self.path_audio:
+            return False
+        if self.audio_lease_until and self.audio_lease_until > timezone.now():
+            return False
+        if self.jobs.filter(status__in=[Job.PENDING, Job.RUNNING]).exists():
+            return False
+        Job.enqueue(Job.GENERATE_AUDIO, page=self)
+        return True
+    
+    def chunk_name(self, index: int, extension: str = "mp3") -> str:
+        """ Get storage name of an audio chunk of the page
+        
+        Args:
+            index (int): chunk number (starting at 1)
+            extension (str, optional): audio extension. Defaults to "mp3".
+        
+        Returns:
+            str: storage name
+        """
+        return f"audio_chunks/{self.id}/{index}.{extension}"
+    
+    def generate_audio_chunks(self, text: str, engine: TTSEngine,
+                              file_path: str) -> str:
+        """ Generate page audio sentence by sentence, saving each chunk
+        in storage, so it can be streamed before the page is finished
+        
+        Args:
+            text (str): page text
+            engine (TTSEngine): streamable engine
+            file_path (str): path to save the full audio
+        
+        Returns:
+            str: path to the full audio (all chunks joined)
+        """
+        
+        storage = self.path_audio.storage
+        Page.objects.filter(id=self.id).update(audio_chunks=0, audio_chunk_sizes=[])
+        self.audio_chunk_sizes = []
+        
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        
+        # Time of all the chunks, as a single span of the page by stage
+        tts_timer = SpanTimer(PipelineSpan.TTS, self.file_id, self.page_num)
+        publish_timer = SpanTimer(
+            PipelineSpan.PUBLISH_CHUNKS, self.file_id, self.page_num
+        )
+        try:
+            with open(file_path, 'wb') as audio_file:
+                chunks = split_sentences(text) or [""]
+                for index, chunk_text in enumerate(chunks, start=1):
+                    with tts_timer:
+                        chunk_path = tts_generate_audio(
+                            chunk_text,
+                            self.file.lang,
+                            f"{file_path}.{index}",
+                            rate_limiter=rate_limiter,
+                            engine=engine
+                        )
+                    with open(chunk_path, 'rb') as chunk_file:
+                        chunk_content = chunk_file.read()
+                    os.remove(chunk_path)
+                    audio_file.write(chunk_content)
+                    
+                    # Publish chunk
+                    chunk_name = self.chunk_name(index, engine.extension)
+                    with publish_timer:
+                        storage.delete(chunk_name)
+                        storage.save(chunk_name, ContentFile(chunk_content))
+                    self.audio_chunk_sizes.append(len(chunk_content))
+                    Page.objects.filter(id=self.id).update(
+                        audio_chunks=index,
+                        audio_chunk_sizes=self.audio_chunk_sizes
+                    )
+                    self.audio_chunks = index
+        finally:
+            tts_timer.record()
+            publish_timer.record()
+        
+        return file_path
+    
+    def delete_audio_chunks(self, extension: str = "mp3"):
+        """ Remove audio chunks from storage (page audio completed a while
+        ago: new playlists use the full audio) """
+        
+        chunks = self.audio_chunks
+        Page.objects.filter(id=self.id).update(audio_chunks=0, audio_chunk_sizes=[])
+        self.audio_chunks = 0
+        self.audio_chunk_sizes = []
+        
+        storage = self.path_audio.storage
+        for index in range(1, chunks + 1):
+            storage.delete(self.chunk_name(index, extension))
     
     def generate_audio(self):
         """ Create specific track for a single page
         """
     
-        print(f"downloading pdf for file {self} in page {self.page_num}")
+        # Get text saved when the file was splitted (extract it in old pages)
+        text = self.text
+        if text is None:
+            logger.info(
+                "getting text from pdf file=%s page=%s run=%s",
+                self.file_id, self.page_num, get_run_id()
+            )
+            text = self.extract_text()
+        
+        # Reuse audio of pages with the same text
+        engine = get_lang_engine(self.file.lang)
+        cache_key = AudioCache.make_key(text, self.file.lang, engine)
+        cache_entry = AudioCache.lookup(cache_key)
+        
+        # Create track (in a temp folder only used by this call)
+        generated = not cache_entry
+        if generated:
+            logger.info(
+                "creating audio file=%s page=%s run=%s",
+                self.file_id, self.page_num, get_run_id()
+            )
+            os.makedirs(settings.TEMP_FOLDER, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=settings.TEMP_FOLDER) as folder:
+                file_path = os.path.join(
+                    folder,
+                    f"{self.page_num}.{engine.extension}"
+                )
+                if engine.streamable:
+                    audio_path = self.generate_audio_chunks(text, engine, file_path)
+                else:
+                    with pipeline_span(
+                        PipelineSpan.TTS, self.file_id, self.page_num
+                    ):
+                        audio_path = tts_generate_audio(
+                            text,
+                            self.file.lang,
+                            file_path,
+                            rate_limiter=rate_limiter,
+                            engine=engine
+                        )
+                with pipeline_span(PipelineSpan.UPLOAD, self.file_id, self.page_num):
+                    cache_entry = AudioCache.store(
+                        cache_key,
+                        audio_path,
+                        engine.extension
+                    )
         
-        # Download aws files
-        url = self.path_pdf.url
-        if url.startswith('https://misojo.s3.amazonaws.com/'):
-            response = requests.get(url)
-            file_folder = os.path.join(
-                MEDIA_ROOT,
-                "files",
-                self.file.user.email,
+        # Save track (counted in the file progress only once)
+        first_audio = Page.objects.filter(id=self.id, path_audio='').update(
+            path_audio=cache_entry.path.name
+        )
+        self.path_audio.name = cache_entry.path.name
+        self.audio_completed_at = timezone.now()
+        self.save()
+        if first_audio:
+            File.objects.filter(id=self.file_id).update(
+                pages_audio=models.F('pages_audio') + 1
             )
-            os.makedirs(file_folder, exist_ok=True)
-            pdf_name = f"{self.file.name}.pdf"
-            pdf_path = os.path.join(file_folder, pdf_name)
-            with open(pdf_path, 'wb') as file:
-                file.write(response.content)
-        else:
-            pdf_path = self.path_pdf.path
-        
-        print(f"getting text from pdf for file {self.file} in page {self.page_num}")
-        
-        # Get text from pdf and validate if its generated
-        text = get_pdf_text(pdf_path)
-        
-        # Create and save track
-        print(f"creating audio for file {self.file} in page {self.page_num}")
-        audio_name = f"{self.page_num}.mp3"
-        file_path = os.path.join(
-            TEMP_FOLDER,
-            "pages",
-            self.file.user.email,
-            self.file.name,
-            audio_name
+        
+        # Make room in the cache once the page uses its new audio
+        if generated:
+            AudioCache.evict(settings.AUDIO_CACHE_MAX_BYTES, keep=cache_entry.id)
+        logger.info(
+            "audio created file=%s page=%s run=%s",
+            self.file_id, self.page_num, get_run_id()
         )
-        audio_path = gtts_generate_audio(text, self.file.lang, file_path)
-        with open(audio_path, 'rb') as track_file:
-            file = django_file(track_file)
-            self.path_audio.save(audio_name, file, save=True)
+    
+    def __str__(self):
+        return f"{self.file}/{self.page_num}"
+
+
+class AudioCache(models.Model):
+    """ Audio generated from a text, reused by pages with the same text """
+    
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=64, unique=True)
+    path = models.FileField(upload_to='audio_cache/', max_length=500)
+    size = models.IntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    # Lookups done by this process
+    process_stats = {"hits": 0, "misses": 0}
+    stats_lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(text: str, lang: str, engine: TTSEngine) -> str:
+        """ Get cache key of the audio of a text
+        
+        Args:
+            text (str): page text
+            lang (str): language code
+            engine (TTSEngine): engine used to generate the audio
+        
+        Returns:
+            str: sha256 of normalized text and audio parameters
+        """
+        text = unicodedata.normalize("NFC", text or "")
+        text = " ".join(text.split())
+        params = "\0".join([text, lang, engine.name, engine.voice(lang)])
+        return hashlib.sha256(params.encode()).hexdigest()
+    
+    @classmethod
+    def lookup(cls, key: str) -> object:
+        """ Get cached audio and mark it as used
+        
+        Args:
+            key (str): cache key
+        
+        Returns:
+            object: AudioCache object or None
+        """
+        entry = cls.objects.filter(key=key).first()
+        with cls.stats_lock:
+            cls.process_stats["hits" if entry else "misses"] += 1
+        if entry:
+            cls.objects.filter(id=entry.id).update(
+                hits=models.F('hits') + 1,
+                last_used_at=timezone.now(),
+            )
+        return entry
+    
+    @classmethod
+    def store(cls, key: str, audio_path: str, extension: str) -> object:
+        """ Save new audio in cache (the entry of other process is returned
+        if it saved the same audio first)
+        
+        Args:
+            key (str): cache key
+            audio_path (str): path of the generated audio file
+            extension (str): audio file extension
+        
+        Returns:
+            object: AudioCache object
+        """
+        
+        # Audio saved by other process while this one was generating it
+        entry = cls.objects.filter(key=key).first()
+        if entry:
+            return entry
+        
+        # Unique file name by call: storages overwriting files (s3) can not
+        # replace the file of other process saving the same key
+        entry = cls(key=key, size=os.path.getsize(audio_path))
+        with open(audio_path, 'rb') as audio_file:
+            entry.path.save(
+                f"{key[:2]}/{key}-{uuid.uuid4().hex[:8]}.{extension}",
+                django_file(audio_file),
+                save=False
+            )
+        try:
+            with transaction.atomic():
+                entry.save()
+        except IntegrityError:
+            # Same audio saved by other process at the same time
+            # (the file removed is only used by this call)
+            entry.path.delete(save=False)
+            return cls.objects.get(key=key)
+        return entry
+    
+    @classmethod
+    def evict(cls, max_bytes: int, keep: int = None, min_age_seconds: int = None):
+        """ Remove least recently used entries until cache fits in max_bytes.
+        Audio files still used by pages are kept in storage. Entries used
+        recently are kept too: pages that just got them (lookup or store)
+        may not have saved their audio path yet.
+        
+        Args:
+            max_bytes (int): max total size of the cache
+            keep (int, optional): id of an entry never removed (like the
+                one just stored). Defaults to None.
+            min_age_seconds (int, optional): seconds since last use before
+                an entry can be removed.
+                Defaults to settings.AUDIO_CACHE_MIN_AGE_SECONDS.
+        """
+        total = cls.objects.aggregate(total=models.Sum('size'))['total'] or 0
+        if total <= max_bytes:
+            return
+        
+        if min_age_seconds is None:
+            min_age_seconds = settings.AUDIO_CACHE_MIN_AGE_SECONDS
+        used_after = timezone.now() - timedelta(seconds=min_age_seconds)
+        entries = cls.objects.filter(last_used_at__lte=used_after).exclude(id=keep)
+        for entry in entries.order_by('last_used_at', 'id').iterator():
+            if total <= max_bytes:
+                break
+            total -= entry.size
+            entry.delete()
+            if not Page.objects.filter(path_audio=entry.path.name).exists():
+                entry.path.delete(save=False)
+    
+    @classmethod
+    def stats(cls) -> dict:
+        """ Get cache usage
+        
+        Returns:
+            dict:
+                hits (int): lookups found, in all processes
+                generated (int): audios generated and still in cache,
+                    in all processes
+                hit_rate (float): hits / (hits + generated)
+                entries (int): audios in cache
+                bytes (int): total size of the cache
+                process_hits (int): lookups found by this process
+                process_misses (int): lookups not found by this process
+        """
+        data = cls.objects.aggregate(
+            hits=models.Sum('hits'),
+            entries=models.Count('id'),
+            bytes=models.Sum('size'),
+        )
+        hits = data['hits'] or 0
+        lookups = hits + data['entries']
+        return {
+            "hits": hits,
+            "generated": data['entries'],
+            "hit_rate": hits / lookups if lookups else 0,
+            "entries": data['entries'],
+            "bytes": data['bytes'] or 0,
+            "process_hits": cls.process_stats["hits"],
+            "process_misses": cls.process_stats["misses"],
+        }
+    
+    def __str__(self):
+        return self.key
+
+
+class Job(models.Model):
+    """ Background task stored in database and processed by run_worker """
+    
+    SPLIT_PDF = 'split_pdf'
+    GENERATE_AUDIO = 'generate_audio'
+    KINDS = [
+        (SPLIT_PDF, 'Split pdf'),
+        (GENERATE_AUDIO, 'Generate audio'),
+    ]
+    
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    ]
+    
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    file = models.ForeignKey(
+        File, on_delete=models.CASCADE, related_name='jobs',
+        null=True, blank=True
+    )
+    page = models.ForeignKey(
+        Page, on_delete=models.CASCADE, related_name='jobs',
+        null=True, blank=True
+    )
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    lease_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    @classmethod
+    def enqueue(cls, kind: str, file: File = None, page: Page = None,
+                delay: int = 0) -> object:
+        """ Create a new pending job
+        
+        Args:
+            kind (str): job kind (one of Job.KINDS)
+            file (File, optional): file to process. Defaults to None.
+            page (Page, optional): page to process. Defaults to None.
+            delay (int, optional): seconds to wait before running.
+                Defaults to 0.
+        
+        Returns:
+            object: Job object
+        """
+        return cls.objects.create(
+            kind=kind,
+            file=file,
+            page=page,
+            max_attempts=settings.JOBS_MAX_ATTEMPTS,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+    
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+class Upload(models.Model):
+    """ Pdf file uploaded by chunks, written directly in storage
+    (s3 multipart upload or local file), and resumable from its offset """
+    
+    UPLOADING = 'uploading'
+    COMPLETED = 'completed'
+    ABORTED = 'aborted'
+    STATUSES = [
+        (UPLOADING, 'Uploading'),
+        (COMPLETED, 'Completed'),
+        (ABORTED, 'Aborted'),
+    ]
+    
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    name = models.CharField(max_length=255)
+    lang = models.CharField(max_length=2, choices=File.LANGS, default='en')
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    offset = models.BigIntegerField(default=0)
+    path = models.CharField(max_length=500)
+    storage_upload_id = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=UPLOADING)
+    file = models.OneToOneField(
+        File, on_delete=models.SET_NULL, related_name='upload',
+        null=True, blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @property
+    def storage(self):
+        """ Storage of the uploaded files """
+        return File._meta.get_field('path').storage
+    
+    @classmethod
+    def start(cls, user: User, name: str, lang: str, size: int) -> object:
+        """ Create upload and its file in storage
+        
+        Args:
+            user (User): file owner
+            name (str): file name (with extension)
+            lang (str): file language (one of File.LANGS)
+            size (int): file size in bytes
+        
+        Returns:
+            object: Upload object
+        """
+        
+        file_path = File._meta.get_field('path')
+        path = file_path.generate_filename(File(user=user), name)
+        path = file_path.storage.get_available_name(path, max_length=500)
+        
+        upload = cls(
+            user=user,
+            name=name,
+            lang=lang,
+            size=size,
+            chunk_size=settings.UPLOAD_CHUNK_SIZE,
+            path=path,
+        )
+        upload.storage_upload_id = start_upload(upload.storage, path)
+        upload.save()
+        return upload
+    
+    def write_chunk(self, offset: int, chunk_file, chunk_size: int) -> bool:
+        """ Save the chunk at the current offset
+        
+        Args:
+            offset (int): chunk position sent by the client
+            chunk_file (file): chunk content (chunk_size bytes, or less
+                for the last chunk)
+            chunk_size (int): chunk size in bytes
+        
+        Returns:
+            bool: False if the offset is not the current one (chunk skipped)
+        """
+        
+        if self.status != Upload.UPLOADING or offset != self.offset:
+            return False
+        
+        write_upload_chunk(
+            self.storage,
+            self.path,
+            self.storage_upload_id,
+            offset // self.chunk_size + 1,
+            offset,
+            chunk_file
+        )
+        
+        # Move offset only if other request did not save the same chunk
+        updated = Upload.objects.filter(
+            id=self.id,
+            offset=offset,
+            status=Upload.UPLOADING
+        ).update(offset=offset + chunk_size, updated_at=timezone.now())
+        if updated:
+            self.offset = offset + chunk_size
+        return bool(updated)
+    
+    def complete(self) -> File:
+        """ Join the chunks and create the file (split job queued)
+        
+        Returns:
+            File: file created (None if the upload is missing chunks
+                or was aborted)
+        """
+        
+        with transaction.atomic():
+            upload = Upload.objects.select_for_update().get(id=self.id)
+            if upload.status == Upload.COMPLETED:
+                return upload.file
+            if upload.status != Upload.UPLOADING or upload.offset != upload.size:
+                return None
             
-        print(f"audio created for file {self.file} in page {self.page_num}")
+            complete_upload(self.storage, self.path, self.storage_upload_id)
+            self.file = File.objects.create(
+                user=self.user,
+                name=os.path.splitext(self.name)[0],
+                lang=self.lang,
+                path=self.path,
+            )
+            self.offset = upload.offset
+            self.status = Upload.COMPLETED
+            self.save()
+        return self.file
+    
+    def abort(self):
+        """ Cancel upload, removing the chunks saved """
+        
+        if self.status != Upload.UPLOADING:
+            return
+        abort_upload(self.storage, self.path, self.storage_upload_id)
+        self.status = Upload.ABORTED
         self.save()
     
     def __str__(self):
-        return f"{self.file}/{self.page_num}"
\ No newline at end of file
+        return f"{self.name} ({self.offset}/{self.size})"
+
+
+class PipelineSpan(models.Model):
+    """ Time of a stage of the pdf to audio pipeline, for a file or a page
+    (saved by audio_generator.tracing) """
+    
+    SPLIT = 'split'
+    SAVE_PDF = 'save_pdf'
+    DOWNLOAD = 'download'
+    EXTRACT_TEXT = 'extract_text'
+    TTS = 'tts'
+    PUBLISH_CHUNKS = 'publish_chunks'
+    UPLOAD = 'upload'
+    STAGES = [
+        (SPLIT, 'Split pdf page'),
+        (SAVE_PDF, 'Save page pdf in storage'),
+        (DOWNLOAD, 'Download pdf from storage'),
+        (EXTRACT_TEXT, 'Extract page text'),
+        (TTS, 'Text to speech'),
+        (PUBLISH_CHUNKS, 'Save audio chunks in storage (streaming)'),
+        (UPLOAD, 'Save audio in storage'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    stage = models.CharField(max_length=20, choices=STAGES)
+    run_id = models.CharField(max_length=16, blank=True, db_index=True)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='spans')
+    page_num = models.IntegerField(null=True, blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    seconds = models.FloatField()
+    failed = models.BooleanField(default=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['stage', 'started_at']),
+            models.Index(fields=['started_at']),
+        ]
+    
+    @classmethod
+    def stage_stats(cls, since) -> list:
+        """ Get p50 and p95 time of each stage (nearest rank)
+        
+        Args:
+            since (datetime): only spans started after this time
+        
+        Returns:
+            list: dicts by stage (stages without spans are skipped)
+                stage (str): stage name
+                count (int): spans
+                failed (int): spans with errors
+                total_seconds (float): time of all the spans
+                p50 (float): median seconds
+                p95 (float): 95th percentile seconds
+        """
+        
+        spans = cls.objects.filter(started_at__gte=since)
+        totals = spans.values('stage').annotate(
+            count=models.Count('id'),
+            failed=models.Count('id', filter=models.Q(failed=True)),
+            total_seconds=models.Sum('seconds'),
+        )
+        totals = {row['stage']: row for row in totals}
+        
+        stats = []
+        for stage, _ in cls.STAGES:
+            if stage not in totals:
+                continue
+            row = totals[stage]
+            times = spans.filter(stage=stage).order_by('seconds')
+            times = times.values_list('seconds', flat=True)
+            stats.append({
+                "stage": stage,
+                "count": row['count'],
+                "failed": row['failed'],
+                "total_seconds": row['total_seconds'],
+                "p50": times[max(math.ceil(row['count'] * 0.5), 1) - 1],
+                "p95": times[max(math.ceil(row['count'] * 0.95), 1) - 1],
+            })
+        return stats
+    
+    @classmethod
+    def slowest_files(cls, since, limit: int = 10) -> list:
+        """ Get files with the most pipeline time
+        
+        Args:
+            since (datetime): only spans started after this time
+            limit (int, optional): max files. Defaults to 10.
+        
+        Returns:
+            list: dicts by file, slowest first
+                file_id (int): file id
+                name (str): file name
+                pages_num (int): pages of the file
+                total_seconds (float): time of all the spans of the file
+                seconds_per_page (float): total_seconds / pages_num
+                slowest_stage (str): stage with the most time
+        """
+        
+        spans = cls.objects.filter(started_at__gte=since)
+        rows = list(
+            spans.values('file_id', 'file__name', 'file__pages_num')
+            .annotate(total_seconds=models.Sum('seconds'))
+            .order_by('-total_seconds')[:limit]
+        )
+        
+        # Stage with the most time of each file
+        stages = (
+            spans.filter(file_id__in=[row['file_id'] for row in rows])
+            .values('file_id', 'stage')
+            .annotate(total_seconds=models.Sum('seconds'))
+            .order_by('total_seconds')
+        )
+        slowest_stage = {row['file_id']: row['stage'] for row in stages}
+        
+        return [
+            {
+                "file_id": row['file_id'],
+                "name": row['file__name'],
+                "pages_num": row['file__pages_num'],
+                "total_seconds": row['total_seconds'],
+                "seconds_per_page": (
+                    row['total_seconds'] / row['file__pages_num']
+                    if row['file__pages_num'] else None
+                ),
+                "slowest_stage": slowest_stage.get(row['file_id']),
+            }
+            for row in rows
+        ]
+    
+    @classmethod
+    def prune(cls, before, batch: int = 5000):
+        """ Delete old spans, by batches
+        
+        Args:
+            before (datetime): delete spans started before this time
+            batch (int, optional): spans deleted at a time. Defaults to 5000.
+        
+        Yields:
+            int: spans deleted in each batch
+        """
+        while True:
+            ids = list(
+                cls.objects.filter(started_at__lt=before)
+                .values_list('id', flat=True)[:batch]
+            )
+            if not ids:
+                return
+            yield cls.objects.filter(id__in=ids).delete()[0]
+    
+    def __str__(self):
+        return f"{self.stage} {self.file_id}/{self.page_num} ({self.seconds:.3f}s)"
@@ -0,0 +1,43 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class JsonCursorPagination(CursorPagination):
+    """ Cursor pagination (no count query, stable with new rows)
+    with the json response format of the api """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    message = ""
+
+    def get_paginated_response(self, data: list) -> Response:
+        """ Wrap page results in the api response format
+
+        Args:
+            data (list): serialized rows of the page
+
+        Returns:
+            Response: results and links to next and previous pages
+        """
+        return Response({
+            'status': 'success',
+            'message': self.message,
+            'data': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+        })
+
+
+class FilePagination(JsonCursorPagination):
+    """ User library, most recent uploads first """
+    ordering = '-id'
+    message = 'API.FILE.LISTED'
+
+
+class PagePagination(JsonCursorPagination):
+    """ Pages of a file, in reading order """
+    ordering = 'page_num'
+    message = 'API.PAGE.LISTED'
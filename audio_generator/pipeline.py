@@ -0,0 +1,140 @@
+import logging
+import threading
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from libs.audio import TokenBucket, TTSEngine, get_engine
+from libs.pdf import TextExtractor, get_extractor
+from libs.storage import DiskCache
+from .tracing import trace_run
+
+logger = logging.getLogger(__name__)
+
+# Requests to the tts service, shared by all the threads of the process
+rate_limiter = TokenBucket(settings.TTS_RATE, settings.TTS_BURST)
+
+# Tts and pdf text engine instances by name
+engines = {}
+extractors = {}
+
+# Remote storage files cached in local disk, shared by all the processes
+storage_cache = None
+if settings.STORAGE_CACHE_DIR:
+    storage_cache = DiskCache(
+        settings.STORAGE_CACHE_DIR,
+        settings.STORAGE_CACHE_MAX_BYTES
+    )
+
+
+def get_lang_engine(lang: str) -> TTSEngine:
+    """ Get the tts engine configured for a language
+
+    Args:
+        lang (str): language code (one of File.LANGS)
+
+    Returns:
+        TTSEngine: engine instance
+    """
+    name = settings.TTS_LANG_ENGINES.get(lang, settings.TTS_ENGINE)
+    if name not in engines:
+        engines[name] = get_engine(name)
+    return engines[name]
+
+
+def get_text_extractor() -> TextExtractor:
+    """ Get the pdf text extraction engine from settings
+
+    Returns:
+        TextExtractor: engine instance
+    """
+    name = settings.PDF_TEXT_ENGINE
+    if name not in extractors:
+        extractors[name] = get_extractor(name)
+    return extractors[name]
+
+
+class AudioPipeline:
+    """ Generate the audio of many pages at the same time """
+
+    def __init__(self, workers: int = None, lang_limits: dict = None,
+                 close_connections: bool = True):
+        """ Setup pool size and limits
+
+        Args:
+            workers (int, optional): max pages generated at the same time.
+                Defaults to settings.TTS_WORKERS.
+            lang_limits (dict, optional): max pages generated at the same
+                time by language. Defaults to settings.TTS_LANG_CONCURRENCY.
+            close_connections (bool, optional): close db connection of
+                the threads after each page. Defaults to True.
+        """
+        self.workers = workers or settings.TTS_WORKERS
+        lang_limits = lang_limits or settings.TTS_LANG_CONCURRENCY
+        self.lang_locks = {
+            lang: threading.BoundedSemaphore(limit)
+            for lang, limit in lang_limits.items()
+        }
+        self.close_connections = close_connections
+
+    def generate_page(self, page) -> bool:
+        """ Generate audio of a single page, respecting language limit
+
+        Args:
+            page (Page): page to generate
+
+        Returns:
+            bool: True if the audio was generated
+        """
+
+        lang_lock = self.lang_locks.get(page.file.lang)
+        try:
+            with trace_run(page.file_id, page.page_num):
+                if lang_lock:
+                    with lang_lock:
+                        page.generate_audio()
+                else:
+                    page.generate_audio()
+            return True
+        except Exception:
+            logger.exception(
+                "error generating audio file=%s page=%s",
+                page.file_id, page.page_num
+            )
+            page.release_audio()
+            return False
+        finally:
+            if self.close_connections:
+                connection.close()
+
+    def run(self, pages: list) -> dict:
+        """ Generate audio of the pages in the pool
+
+        Args:
+            pages (list): Page objects (with file loaded)
+
+        Returns:
+            dict: stats of the run
+                pages (int): pages generated
+                errors (int): pages with errors
+                seconds (float): total time
+                pages_per_second (float): throughput
+        """
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.generate_page, pages))
+        seconds = perf_counter() - start
+
+        generated = results.count(True)
+        stats = {
+            "pages": generated,
+            "errors": len(results) - generated,
+            "seconds": seconds,
+            "pages_per_second": generated / seconds if seconds else 0,
+        }
+        logger.info(
+            "audio pipeline: %d pages, %d errors, %.2f pages/s",
+            stats['pages'], stats['errors'], stats['pages_per_second']
+        )
+        return stats
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from .models import File
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FIELDS = [
+    'id', 'user_id', 'status', 'pages_num', 'pages_split', 'pages_audio'
+]
+
+
+def get_progress_many(file_ids: list) -> dict:
+    """ Get progress of many files with a single query
+
+    Args:
+        file_ids (list): files ids
+
+    Returns:
+        dict: progress (see File.get_progress) by file id
+    """
+    files = File.objects.filter(id__in=file_ids).only(*PROGRESS_FIELDS)
+    return {file.id: file.get_progress() for file in files}
+
+
+def get_cached_progress(file_id: int) -> tuple:
+    """ Get progress of a file, shared by all the requests of the
+    process for PROGRESS_CACHE_SECONDS
+
+    Args:
+        file_id (int): file id
+
+    Returns:
+        tuple:
+            int: file owner id (None if the file does not exist)
+            dict: progress (see File.get_progress)
+    """
+    key = f"file-progress:{file_id}"
+    cached = cache.get(key)
+    if cached is None:
+        file = File.objects.filter(id=file_id).only(*PROGRESS_FIELDS).first()
+        cached = (file.user_id, file.get_progress()) if file else (None, None)
+        cache.set(key, cached, settings.PROGRESS_CACHE_SECONDS)
+    return cached
+
+
+class ProgressPoller:
+    """ Single polling loop for all the progress streams of the process:
+    one query per tick for all the files watched, whatever the number of
+    clients, and events sent only when the progress changes """
+
+    def __init__(self, interval: float = None):
+        """ Setup poller (the loop starts with the first subscriber)
+
+        Args:
+            interval (float, optional): seconds between queries.
+                Defaults to settings.PROGRESS_POLL_SECONDS.
+        """
+        self.interval = interval
+        self.subscribers = {}
+        self.progress = {}
+        self.loop = None
+        self.task = None
+
+    def subscribe(self, file_id: int) -> asyncio.Queue:
+        """ Watch progress of a file
+
+        Args:
+            file_id (int): file id
+
+        Returns:
+            asyncio.Queue: progress changes of the file
+        """
+
+        # Subscribers of other event loops can not be notified (tests)
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.subscribers = {}
+            self.progress = {}
+            self.task = None
+
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(file_id, set()).add(queue)
+        if file_id in self.progress:
+            queue.put_nowait(self.progress[file_id])
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+        return queue
+
+    def unsubscribe(self, file_id: int, queue: asyncio.Queue):
+        """ Stop watching progress of a file
+
+        Args:
+            file_id (int): file id
+            queue (asyncio.Queue): queue returned by subscribe
+        """
+        queues = self.subscribers.get(file_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(file_id, None)
+            self.progress.pop(file_id, None)
+
+    async def run(self):
+        """ Query progress of the watched files while there are subscribers
+        (errors logged, polling goes on in the next tick) """
+        while self.subscribers:
+            try:
+                progress = await sync_to_async(get_progress_many)(
+                    list(self.subscribers)
+                )
+                for file_id, file_progress in progress.items():
+                    if self.progress.get(file_id) == file_progress:
+                        continue
+                    self.progress[file_id] = file_progress
+                    for queue in self.subscribers.get(file_id, ()):
+                        queue.put_nowait(file_progress)
+            except Exception:
+                logger.exception("progress poll failed")
+            await asyncio.sleep(self.interval or settings.PROGRESS_POLL_SECONDS)
+
+
+poller = ProgressPoller()
@@ -0,0 +1,62 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, QuerySet, Sum, Value, When
+from django.utils import timezone
+
+
+def prioritize_pages(pages: QuerySet) -> QuerySet:
+    """ Sort pending pages: first the pages just ahead of active readers
+    (closest to their current page), then the rest by id
+
+    Args:
+        pages (QuerySet): Page queryset
+
+    Returns:
+        QuerySet: Page queryset sorted by priority
+    """
+
+    window = settings.PREFETCH_WINDOW
+    active_since = timezone.now() - timedelta(
+        minutes=settings.READER_ACTIVE_MINUTES
+    )
+    return (
+        pages
+        .annotate(read_distance=F('page_num') - F('file__current_page'))
+        .annotate(priority=Case(
+            When(
+                file__last_read_at__gte=active_since,
+                read_distance__gte=0,
+                read_distance__lte=window,
+                then=F('read_distance'),
+            ),
+            default=Value(window + 1),
+            output_field=IntegerField(),
+        ))
+        .order_by('priority', 'id')
+    )
+
+
+def reader_stats(files: QuerySet) -> dict:
+    """ Get how often readers reach pages without audio
+
+    Args:
+        files (QuerySet): File queryset
+
+    Returns:
+        dict:
+            pages_read (int): pages opened by readers
+            pages_missing (int): pages opened before their audio was ready
+            miss_rate (float): pages_missing / pages_read
+    """
+
+    data = files.aggregate(
+        pages_read=Sum('pages_read'),
+        pages_missing=Sum('pages_read_missing'),
+    )
+    pages_read = data['pages_read'] or 0
+    pages_missing = data['pages_missing'] or 0
+    return {
+        "pages_read": pages_read,
+        "pages_missing": pages_missing,
+        "miss_rate": pages_missing / pages_read if pages_read else 0,
+    }
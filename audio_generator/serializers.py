@@ -1,4 +1,7 @@
-from .models import User
+from django.conf import settings
+from .models import User, File, Page, Upload
+from .authentication import defer_last_login
+from .blacklist import FilteredRefreshToken
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import (
     TokenObtainPairSerializer,
@@ -70,14 +73,18 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return token
 
     def validate(self, attrs):
-        """ Custom validation: credentials, activation and valid response """
+        """ Custom validation: credentials, activation and valid response
+        (password hashed only once, last login saved after the response) """
 
         # Get and validate email and password fields
         email = attrs.get('email', '')
         password = attrs.get('password', '')
         
-        # Check if user exists
+        # Check if user exists (hash the password anyway, so missing
+        # users take the same time as wrong passwords)
         user = User.objects.filter(email=email).first()
+        if not user:
+            User().set_password(password)
         if not user or not user.check_password(password):
             
             raise serializers.ValidationError({
@@ -91,23 +98,28 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
                 "activation": "API.TOKEN.INACTIVE"
             }, code='user_not_active')
 
-        # Get tokens
-        data = super().validate(attrs)
-        
-        # Add user id to data
-        data['user_id'] = user.id
+        # Get tokens of the user already authenticated
+        refresh = self.get_token(user)
+        defer_last_login(user)
 
         # Json response
         return {
             "status": "success",
             "message": "API.TOKEN.GENERATED",
-            "data": data
+            "data": {
+                "refresh": str(refresh),
+                "access": str(refresh.access_token),
+                "user_id": user.id,
+            }
         }
 
 
 class CustomTokenRefreshSerializer(TokenRefreshSerializer):
     """ Custom token refresh validation and response """
     
+    # Blacklist checked in memory first
+    token_class = FilteredRefreshToken
+    
     def validate(self, attrs):
         """ Custom confirmation or error response """
         
@@ -123,4 +135,76 @@ class CustomTokenRefreshSerializer(TokenRefreshSerializer):
                 "status": "success",
                 "message": "Token refreshed successfully",
                 "data": data
-            }
\ No newline at end of file
+            }
+
+
+class FileSerializer(serializers.ModelSerializer):
+    """ File of the user library (pages_ready annotated by the view) """
+    
+    pages_ready = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = File
+        fields = [
+            'id', 'name', 'lang', 'status', 'pages_num', 'pages_ready',
+            'current_page', 'uploaded_at', 'last_read_at'
+        ]
+        read_only_fields = fields
+
+
+class PageSerializer(serializers.ModelSerializer):
+    """ Page of a file, with urls of its pdf and audio """
+    
+    lang = serializers.CharField(source='file.lang', read_only=True)
+    pdf_url = serializers.SerializerMethodField()
+    audio_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Page
+        fields = ['id', 'file', 'lang', 'page_num', 'pdf_url', 'audio_url']
+        read_only_fields = fields
+    
+    def get_file_url(self, field_file) -> str:
+        """ Get absolute url of a page file
+        
+        Args:
+            field_file (FieldFile): page file
+        
+        Returns:
+            str: file url, or None if the file is missing
+        """
+        if not field_file:
+            return None
+        url = field_file.url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+    
+    def get_pdf_url(self, page: Page) -> str:
+        return self.get_file_url(page.path_pdf)
+    
+    def get_audio_url(self, page: Page) -> str:
+        return self.get_file_url(page.path_audio)
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    """ Resumable upload: create with name, lang and size """
+    
+    class Meta:
+        model = Upload
+        fields = [
+            'id', 'name', 'lang', 'size', 'chunk_size', 'offset', 'status', 'file'
+        ]
+        read_only_fields = ['id', 'chunk_size', 'offset', 'status', 'file']
+    
+    def validate_name(self, value: str) -> str:
+        if not value.lower().endswith(".pdf"):
+            raise serializers.ValidationError("API.UPLOAD.INVALID_NAME")
+        return value
+    
+    def validate_size(self, value: int) -> int:
+        if value < 1 or value > settings.UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError("API.UPLOAD.INVALID_SIZE")
+        return value
+    
+    def create(self, validated_data):
+        return Upload.start(user=self.context['request'].user, **validated_data)
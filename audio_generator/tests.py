@@ -1,7 +1,48 @@
+import io
+import os
+import asyncio
+import hashlib
+import shutil
+import tempfile
+import threading
+import socketserver
+from time import sleep, monotonic
+from datetime import timedelta
+import PyPDF2
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
 from . import models
+from . import jobs
+from . import metrics
+from .pipeline import AudioPipeline, get_lang_engine
+from .progress import ProgressPoller, get_progress_many
+from .authentication import user_cache
+from .blacklist import BlacklistFilter, blacklist_filter, prune_tokens
+from libs.audio import TokenBucket, EspeakEngine, GTTSEngine, generate_audio
+from libs.audio import split_sentences
+from libs.storage import DiskCache, open_local
+from libs.pdf import PypdfExtractor, PdfParseError, count_pages, split_pdf
+from libs.sandbox import SandboxPool, SandboxError
+from libs.cache import TTLCache
+from libs.bloom import BloomFilter
+from libs.pool import ConnectionPool, PoolTimeout
+from libs.metrics import MetricsRegistry
+from django.core.files.storage import FileSystemStorage, InMemoryStorage
+from unittest.mock import MagicMock, patch
+from asgiref.sync import sync_to_async
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
 from rest_framework.test import APITestCase
 
 
@@ -49,7 +90,10 @@ class TestUser (APITestCase):
         self.assertFalse(user.is_active)
         self.assertFalse(user.is_admin)
         
-        # Validate email sent
+        # Validate email queued, and sent by the sender command
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(models.EmailOutbox.objects.filter(to=user.email).count(), 1)
+        call_command("send_emails", once=True, stdout=io.StringIO())
         self.assertEqual(len(mail.outbox), 1)
         
     def test_register_missing_data(self):
@@ -156,6 +200,185 @@ class TestUser (APITestCase):
         )
         
     
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    """ Minimal smtp server session: accepts all messages, except the
+    ones to the server rejected addresses """
+    
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+    
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stub")
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode()
+            if not line:
+                break
+            command = line.strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 stub")
+            elif command.startswith("RCPT TO:"):
+                address = line.strip()[8:].strip("<> ")
+                if address in self.server.rejected:
+                    self.reply("550 rejected")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 send data")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                self.server.messages.append((recipients, data))
+                recipients = []
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                break
+            else:
+                self.reply("250 OK")
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """ Local smtp server for tests, counting connections and messages """
+    
+    daemon_threads = True
+    
+    def __init__(self, rejected: list = None):
+        super().__init__(("127.0.0.1", 0), SMTPStubHandler)
+        self.rejected = rejected or []
+        self.connections = 0
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+    
+    def settings(self) -> override_settings:
+        """ Settings to send emails to this server """
+        return override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.server_address[1],
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_SSL=False,
+        )
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestEmailOutbox(APITestCase):
+    """ Test emails queued with the data and sent in background """
+    
+    def setUp(self):
+        """ Start local smtp server """
+        self.smtp = SMTPStub(rejected=["rejected@gmail.com"])
+        
+    def tearDown(self):
+        """ Stop local smtp server """
+        self.smtp.stop()
+        
+    def create_user(self, email: str) -> models.User:
+        """ Register user (activation email queued) """
+        return models.User.objects.create_user(
+            email=email,
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+    
+    def test_register_mail_server_down(self):
+        """ Register user while the mail server is not available
+            Expected: user created, email queued
+        """
+        
+        with override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=1,
+        ):
+            response = self.client.post(reverse('users-list'), {
+                "first_name": "sample",
+                "last_name": "sample",
+                "password": "12345678",
+                "email": "sample@gmail.com"
+            })
+        self.assertEqual(response.status_code, 201)
+        email = models.EmailOutbox.objects.get(to="sample@gmail.com")
+        self.assertEqual(email.status, models.EmailOutbox.PENDING)
+        self.assertIn("/activate/", email.text_content)
+        
+    def test_send_batch(self):
+        """ Send queued emails
+            Expected: all sent over a single smtp connection
+        """
+        
+        for index in range(3):
+            self.create_user(f"user{index}@gmail.com")
+        
+        with self.smtp.settings():
+            call_command("send_emails", once=True, stdout=io.StringIO())
+        
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(
+            models.EmailOutbox.objects.filter(status=models.EmailOutbox.SENT).count(),
+            3
+        )
+        
+    @override_settings(EMAIL_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        """ Send emails, one of them rejected by the server
+            Expected: others sent, rejected one retried later, then dead
+        """
+        
+        self.create_user("user@gmail.com")
+        self.create_user("rejected@gmail.com")
+        
+        with self.smtp.settings():
+            call_command("send_emails", once=True, stdout=io.StringIO())
+        
+            email = models.EmailOutbox.objects.get(to="rejected@gmail.com")
+            self.assertEqual(email.status, models.EmailOutbox.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertGreater(email.run_after, timezone.now())
+            self.assertEqual(len(self.smtp.messages), 1)
+            
+            # Retry now
+            models.EmailOutbox.objects.filter(id=email.id).update(
+                run_after=timezone.now()
+            )
+            call_command("send_emails", once=True, stdout=io.StringIO())
+        
+        email.refresh_from_db()
+        self.assertEqual(email.status, models.EmailOutbox.DEAD)
+        self.assertEqual(email.attempts, 2)
+        self.assertIn("rejected", email.last_error)
+    
+    def test_message_error(self):
+        """ Send emails, one of them fails to build its message
+            Expected: error saved in the email, others sent
+        """
+        
+        self.create_user("broken@gmail.com")
+        self.create_user("user@gmail.com")
+        get_message = models.EmailOutbox.get_message
+        
+        def fake_get_message(email, connection):
+            if email.to == "broken@gmail.com":
+                raise ValueError("bad template")
+            return get_message(email, connection)
+        
+        with self.smtp.settings(), self.assertLogs("audio_generator.mailer", "ERROR"), \
+                patch.object(models.EmailOutbox, "get_message", fake_get_message):
+            call_command("send_emails", once=True, stdout=io.StringIO())
+        
+        email = models.EmailOutbox.objects.get(to="broken@gmail.com")
+        self.assertEqual(email.status, models.EmailOutbox.PENDING)
+        self.assertIn("bad template", email.last_error)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assertEqual(self.smtp.connections, 1)
+    
+    
 class TestToken(APITestCase):
     """ Test get JWT token """
     
@@ -240,6 +463,35 @@ class TestToken(APITestCase):
         self.assertEqual(response.data['status'], 'error')
         self.assertEqual(response.data['message'], 'API.TOKEN.INACTIVE')
 
+    def test_hashed_once(self):
+        """ Generate token counting password hashes
+            Expected: password hashed once, for valid and invalid users
+        """
+
+        hasher = "django.contrib.auth.hashers.PBKDF2PasswordHasher.encode"
+        cases = [
+            (self.data, 200),
+            ({**self.data, "password": "invalid password"}, 400),
+            ({**self.data, "email": "missing@gmail.com"}, 400),
+        ]
+        for data, status_code in cases:
+            with patch(hasher, autospec=True,
+                       side_effect=PBKDF2PasswordHasher.encode) as encode:
+                response = self.client.post(self.url, data)
+            self.assertEqual(response.status_code, status_code)
+            self.assertEqual(encode.call_count, 1)
+
+    def test_last_login(self):
+        """ Generate token and check user last login
+            Expected: last login saved once the request finished
+        """
+
+        self.assertIsNone(self.user.last_login)
+        response = self.client.post(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
 
 class TestTokenRefresh(APITestCase):
     """ Test refresh JWT token """
@@ -262,6 +514,10 @@ class TestTokenRefresh(APITestCase):
         )
         user.is_active = True
         user.save()
+        self.user = user
+        
+        # Blacklist ids of other tests can be reused (rolled back)
+        blacklist_filter.reset()
         
     def test_refreshed(self):
         """ Try to refresh token with valid refresh token
@@ -321,6 +577,140 @@ class TestTokenRefresh(APITestCase):
         self.assertIn('refresh', response.data['message'])
         self.assertIn('is required', response.data['message'])
         self.assertNotIn('access', response.data["data"])
+
+    def test_blacklisted_by_other_process(self):
+        """ Blacklist token in database after the filter is loaded
+            Expected 401: token found by the next sync
+        """
+        
+        refresh = RefreshToken.for_user(self.user)
+        self.assertNotIn(refresh['jti'], blacklist_filter)
+        
+        # Blacklisted without the filter (as other process)
+        RefreshToken(str(refresh)).blacklist()
+        response = self.client.post(self.url, {"refresh": str(refresh)})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['message'], "Token is blacklisted")
+    
+    def test_filter_gaps(self):
+        """ Blacklist tokens with ids committed out of order
+            Expected: skipped ids checked again until found
+        """
+        
+        tokens = [RefreshToken.for_user(self.user) for _ in range(3)]
+        outstanding = {
+            token.jti: token for token in OutstandingToken.objects.all()
+        }
+        first = BlacklistedToken.objects.create(
+            token=outstanding[tokens[0]['jti']]
+        )
+        token_filter = BlacklistFilter(capacity=100, error_rate=0.001)
+        self.assertIn(tokens[0]['jti'], token_filter)
+        
+        # Ids rolled back by other tests can be gaps of the load
+        loaded_gaps = set(token_filter.gaps)
+        
+        # Id first + 1 skipped (its transaction is not committed yet)
+        BlacklistedToken.objects.create(
+            id=first.id + 2, token=outstanding[tokens[2]['jti']]
+        )
+        self.assertIn(tokens[2]['jti'], token_filter)
+        self.assertNotIn(tokens[1]['jti'], token_filter)
+        self.assertEqual(set(token_filter.gaps) - loaded_gaps, {first.id + 1})
+        
+        # Skipped id committed
+        BlacklistedToken.objects.create(
+            id=first.id + 1, token=outstanding[tokens[1]['jti']]
+        )
+        self.assertIn(tokens[1]['jti'], token_filter)
+        self.assertEqual(set(token_filter.gaps), loaded_gaps)
+    
+    def test_filter_load_gaps(self):
+        """ Load filter with an id below the last one not committed yet
+            Expected: missing id recorded as gap, token found once committed
+        """
+        
+        tokens = [RefreshToken.for_user(self.user) for _ in range(3)]
+        outstanding = {
+            token.jti: token for token in OutstandingToken.objects.all()
+        }
+        first = BlacklistedToken.objects.create(
+            token=outstanding[tokens[0]['jti']]
+        )
+        BlacklistedToken.objects.create(
+            id=first.id + 2, token=outstanding[tokens[2]['jti']]
+        )
+        token_filter = BlacklistFilter(capacity=100, error_rate=0.001)
+        self.assertIn(tokens[2]['jti'], token_filter)
+        self.assertNotIn(tokens[1]['jti'], token_filter)
+        
+        # Other gaps: ids rolled back by other tests, below the first id
+        self.assertIn(first.id + 1, token_filter.gaps)
+        self.assertTrue(all(
+            gap_id < first.id for gap_id in token_filter.gaps if gap_id != first.id + 1
+        ))
+        
+        # Missing id committed after the load
+        BlacklistedToken.objects.create(
+            id=first.id + 1, token=outstanding[tokens[1]['jti']]
+        )
+        self.assertIn(tokens[1]['jti'], token_filter)
+        self.assertNotIn(first.id + 1, token_filter.gaps)
+    
+    def test_filter_rebuild_background(self):
+        """ Check tokens with a full filter
+            Expected: rebuilt once in background, old filter still answering
+        """
+        
+        tokens = [RefreshToken.for_user(self.user) for _ in range(2)]
+        RefreshToken(str(tokens[0])).blacklist()
+        token_filter = BlacklistFilter(capacity=1, error_rate=0.001)
+        with patch.object(token_filter, 'rebuild_in_background') as rebuild:
+            self.assertIn(tokens[0]['jti'], token_filter)
+            rebuild.assert_not_called()
+            
+            # Full filter: one rebuild started, checks go on
+            RefreshToken(str(tokens[1])).blacklist()
+            self.assertIn(tokens[1]['jti'], token_filter)
+            self.assertIn(tokens[0]['jti'], token_filter)
+            rebuild.assert_called_once()
+        
+        # Rebuild done
+        token_filter.rebuild()
+        self.assertFalse(token_filter.loading)
+        self.assertIn(tokens[1]['jti'], token_filter)
+    
+    def test_prune(self):
+        """ Prune tokens by batches
+            Expected: only expired tokens deleted, with their blacklist entries
+        """
+        
+        tokens = [RefreshToken.for_user(self.user) for _ in range(4)]
+        for token in tokens[:2]:
+            RefreshToken(str(token)).blacklist()
+        OutstandingToken.objects.filter(
+            jti__in=[token['jti'] for token in tokens[:3]]
+        ).update(expires_at=timezone.now() - timedelta(minutes=1))
+        
+        self.assertEqual(list(prune_tokens(batch=2)), [2, 1])
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(BlacklistedToken.objects.count(), 0)
+        
+        out = io.StringIO()
+        call_command("prune_tokens", stdout=out)
+        self.assertIn("0 expired tokens deleted", out.getvalue())
+    
+    def test_bloom_filter(self):
+        """ Add items to a bloom filter
+            Expected: items added found, few false positives
+        """
+        
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for index in range(1000):
+            bloom.add(f"in-{index}")
+        self.assertTrue(all(f"in-{index}" in bloom for index in range(1000)))
+        false_positives = sum(f"out-{index}" in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
                        
         
 class TestValidateToken(APITestCase):
@@ -406,4 +796,2119 @@ class TestValidateToken(APITestCase):
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['status'], 'success')
-        self.assertEqual(response.data['message'], 'Token is valid')
\ No newline at end of file
+        self.assertEqual(response.data['message'], 'Token is valid')
+
+    def test_valid_no_queries(self):
+        """ Validate token counting queries
+            Expected: answered from the token claims, without queries
+        """
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestCachedUser(APITestCase):
+    """ Test users of authenticated requests cached by process """
+
+    def setUp(self):
+        """ Create active user and get token """
+
+        user_cache.clear()
+        self.client = APIClient()
+        self.url = reverse('users-list')
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.user.is_active = True
+        self.user.save()
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_cached(self):
+        """ Get user data twice
+            Expected: user queried only in the first request
+        """
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'][0]['email'], self.user.email)
+
+    def test_invalidated(self):
+        """ Change user after it is cached
+            Expected: changes seen by the next request
+        """
+
+        self.client.get(self.url)
+
+        # Updated name
+        self.user.first_name = 'updated'
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['data'][0]['first_name'], 'updated')
+
+        # Deactivated user
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+        # Deleted user
+        self.user.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_ttl_cache(self):
+        """ Save items in a small cache
+            Expected: least recently used and expired items removed
+        """
+
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+        cache = TTLCache(max_size=2, ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class TestJobs(APITestCase):
+    """ Test background jobs queue """
+    
+    def setUp(self):
+        """ Create user and file (with its split job) """
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File.objects.create(
+            user=self.user,
+            path="files/sample.pdf",
+            name="sample",
+        )
+        
+    def test_enqueued_on_create(self):
+        """ Create file
+            Expected: split job pending, no work done in request process
+        """
+        
+        jobs_found = models.Job.objects.filter(file=self.file)
+        self.assertEqual(jobs_found.count(), 1)
+        self.assertEqual(jobs_found.first().kind, models.Job.SPLIT_PDF)
+        self.assertEqual(jobs_found.first().status, models.Job.PENDING)
+        
+    def test_claim_and_done(self):
+        """ Claim and run job successfully
+            Expected: job leased by worker, then done
+        """
+        
+        claimed = jobs.claim_jobs("worker-1", 10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].status, models.Job.RUNNING)
+        self.assertEqual(claimed[0].worker, "worker-1")
+        self.assertEqual(claimed[0].attempts, 1)
+        
+        # Leased jobs are not claimed twice
+        self.assertEqual(jobs.claim_jobs("worker-2", 10), [])
+        
+        with patch.object(models.File, 'split_pdf') as split_pdf:
+            self.assertTrue(jobs.run_job(claimed[0]))
+            split_pdf.assert_called_once()
+        
+        job = models.Job.objects.get(id=claimed[0].id)
+        self.assertEqual(job.status, models.Job.DONE)
+        self.assertIsNone(job.lease_until)
+        
+    def test_retry_and_dead(self):
+        """ Run a job that always fails
+            Expected: job retried with backoff, then dead lettered
+        """
+        
+        models.Job.objects.update(max_attempts=2)
+        
+        with patch.object(models.File, 'split_pdf', side_effect=Exception):
+            
+            # First attempt: back to pending, delayed
+            job = jobs.claim_jobs("worker-1", 1)[0]
+            self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            self.assertEqual(job.status, models.Job.PENDING)
+            self.assertIn("Exception", job.last_error)
+            self.assertEqual(jobs.claim_jobs("worker-1", 1), [])
+            
+            # Second attempt: dead
+            models.Job.objects.update(run_after=job.created_at)
+            job = jobs.claim_jobs("worker-1", 1)[0]
+            self.assertFalse(jobs.run_job(job))
+            job.refresh_from_db()
+            self.assertEqual(job.status, models.Job.DEAD)
+            self.assertEqual(jobs.claim_jobs("worker-1", 1), [])
+    
+    def test_lease_lost(self):
+        """ Run a job whose lease expired, claimed again by other worker
+            Expected: old worker neither extends the lease nor saves its
+            result
+        """
+        
+        old_job = jobs.claim_jobs("worker-1", 1)[0]
+        models.Job.objects.update(lease_until=timezone.now() - timedelta(seconds=1))
+        new_job = jobs.claim_jobs("worker-2", 1)[0]
+        lease_until = models.Job.objects.get(id=new_job.id).lease_until
+        
+        jobs.extend_leases([old_job])
+        with patch.object(models.File, 'split_pdf'):
+            self.assertTrue(jobs.run_job(old_job))
+        job = models.Job.objects.get(id=new_job.id)
+        self.assertEqual(job.status, models.Job.RUNNING)
+        self.assertEqual(job.worker, "worker-2")
+        self.assertEqual(job.lease_until, lease_until)
+        
+        jobs.extend_leases([new_job])
+        self.assertGreater(models.Job.objects.get(id=new_job.id).lease_until, lease_until)
+        with patch.object(models.File, 'split_pdf'):
+            self.assertTrue(jobs.run_job(new_job))
+        self.assertEqual(models.Job.objects.get(id=new_job.id).status, models.Job.DONE)
+    
+    def test_lease_expired_dead(self):
+        """ Claim a job whose lease expired in every attempt (the job
+            kills the worker)
+            Expected: claimed until the max attempts, then dead
+        """
+        
+        models.Job.objects.update(max_attempts=2)
+        for worker in ("worker-1", "worker-2"):
+            self.assertEqual(len(jobs.claim_jobs(worker, 1)), 1)
+            models.Job.objects.update(lease_until=timezone.now() - timedelta(seconds=1))
+        
+        with self.assertLogs("audio_generator.jobs", "WARNING"):
+            self.assertEqual(jobs.claim_jobs("worker-3", 1), [])
+        job = models.Job.objects.get()
+        self.assertEqual(job.status, models.Job.DEAD)
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNone(job.lease_until)
+        self.assertIn("lease expired", job.last_error)
+    
+    def test_audio_lease(self):
+        """ Run audio jobs: failed, page leased by other process, page
+            with audio
+            Expected: lease released on errors, job retried while other
+            process has the page, done when the audio exists
+        """
+        
+        models.Job.objects.all().delete()
+        page = models.Page.objects.create(file=self.file, page_num=1)
+        models.Job.enqueue(models.Job.GENERATE_AUDIO, page=page)
+        
+        # Failed generation: page free for the retry
+        with patch.object(models.Page, 'generate_audio', side_effect=OSError):
+            job = jobs.claim_jobs("worker-1", 1)[0]
+            self.assertFalse(jobs.run_job(job))
+        page.refresh_from_db()
+        self.assertIsNone(page.audio_lease_until)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.PENDING)
+        
+        # Page leased by other process: retried
+        page.claim_audio()
+        models.Job.objects.update(run_after=timezone.now())
+        job = jobs.claim_jobs("worker-1", 1)[0]
+        self.assertFalse(jobs.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.PENDING)
+        self.assertIn("AudioLeased", job.last_error)
+        
+        # Audio generated by the other process: done
+        models.Page.objects.filter(id=page.id).update(path_audio="audio.mp3")
+        models.Job.objects.update(run_after=timezone.now())
+        job = jobs.claim_jobs("worker-1", 1)[0]
+        self.assertTrue(jobs.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.DONE)
+
+
+def make_pdf(pages_num: int, text: bool = False) -> bytes:
+    """ Create a blank pdf file in memory
+    
+    Args:
+        pages_num (int): number of pages
+        text (bool, optional): write "page <num>" in each page.
+            Defaults to False.
+    
+    Returns:
+        bytes: pdf content
+    """
+    pdf_writer = PyPDF2.PdfWriter()
+    for page_num in range(1, pages_num + 1):
+        page = pdf_writer.add_blank_page(612, 792)
+        if not text:
+            continue
+        font = DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        })
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+        })
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td (page {page_num}) Tj ET".encode())
+        page[NameObject('/Contents')] = pdf_writer._add_object(content)
+    pdf_buffer = io.BytesIO()
+    pdf_writer.write(pdf_buffer)
+    return pdf_buffer.getvalue()
+
+
+class TestSplitPdf(APITestCase):
+    """ Test split pdf files in pages """
+    
+    def setUp(self):
+        """ Use temp media folder and upload a pdf file """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+        )
+        self.settings_override.enable()
+        
+        user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File(user=user, name="sample")
+        self.file.path.save("sample.pdf", ContentFile(make_pdf(5)), save=True)
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def test_split(self):
+        """ Split pdf file
+            Expected: pages created in order, with single page pdf files
+        """
+        
+        self.file.split_pdf()
+        
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.pages_generated)
+        self.assertEqual(self.file.pages_num, 5)
+        
+        pages = models.Page.objects.filter(file=self.file).order_by('page_num')
+        self.assertEqual(
+            list(pages.values_list('page_num', flat=True)),
+            [1, 2, 3, 4, 5]
+        )
+        for page in pages:
+            with page.path_pdf.open('rb') as page_file:
+                self.assertEqual(len(PyPDF2.PdfReader(page_file).pages), 1)
+                
+    def test_split_text(self):
+        """ Split pdf file
+            Expected: text of each page saved, and used to generate audio
+        """
+        
+        self.file.split_pdf()
+        page = models.Page.objects.filter(file=self.file).first()
+        self.assertEqual(page.text, "")
+        
+        page.text = "sample text"
+        page.save()
+        page.refresh_from_db()
+        self.assertEqual(page.text, "sample text")
+        
+        def fake_generate_audio(text, lang, file_path, **kwargs):
+            with open(file_path, "wb") as audio_file:
+                audio_file.write(b"audio")
+            return file_path
+        
+        with patch("audio_generator.models.get_pdf_text") as get_pdf_text, \
+                patch("audio_generator.models.tts_generate_audio") as generate:
+            generate.side_effect = fake_generate_audio
+            page.generate_audio()
+        get_pdf_text.assert_not_called()
+        self.assertEqual(generate.call_args.args[0], "sample text")
+        
+    def test_backfill_text(self):
+        """ Run backfill command in pages without text
+            Expected: text extracted and saved, extract spans of each page
+            with one run by batch
+        """
+        
+        self.file.split_pdf()
+        models.Page.objects.update(text_compressed=None)
+        models.PipelineSpan.objects.all().delete()
+        
+        call_command("backfill_page_text", batch=2, stdout=io.StringIO())
+        
+        pages = models.Page.objects.filter(text_compressed__isnull=True)
+        self.assertFalse(pages.exists())
+        spans = models.PipelineSpan.objects.filter(stage='extract_text', file=self.file)
+        self.assertEqual(
+            sorted(spans.values_list('page_num', flat=True)), [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(len(set(spans.values_list('run_id', flat=True))), 3)
+        
+    @override_settings(PDF_TEXT_ENGINE="pypdf")
+    def test_split_text_engine(self):
+        """ Split pdf file with other text engine
+            Expected: engine from settings used for all pages
+        """
+        
+        self.file.path.save("text.pdf", ContentFile(make_pdf(5, text=True)), save=True)
+        with patch("audio_generator.models.split_pdf_lib", wraps=split_pdf) as split:
+            self.file.split_pdf()
+        
+        self.assertIsInstance(split.call_args.args[1], PypdfExtractor)
+        self.assertEqual(models.Page.objects.filter(file=self.file).count(), 5)
+        
+        # Text extracted by the engine (in the sandbox processes)
+        pages = models.Page.objects.filter(file=self.file).order_by('page_num')
+        self.assertEqual(
+            [page.text for page in pages],
+            [f"page {page_num}" for page_num in range(1, 6)]
+        )
+        
+    def test_split_once(self):
+        """ Split pdf file twice (job retried)
+            Expected: pages created only once
+        """
+        
+        self.file.split_pdf()
+        self.file.split_pdf()
+        self.assertEqual(models.Page.objects.filter(file=self.file).count(), 5)
+
+    def test_split_workers(self):
+        """ Split pdf file by ranges in worker processes
+            Expected: same pages, in order, as splitting in a single process
+        """
+
+        with open(self.file.path.path, 'rb') as pdf_file, \
+                SandboxPool(workers=4) as pool:
+            pages_serial = list(split_pdf(pdf_file))
+            pdf_file.seek(0)
+            pages_workers = list(split_pdf(pdf_file, pool=pool, pages_per_task=2))
+            
+            # Only the processes needed by the 5 pages started
+            self.assertEqual(len(pool.processes), 3)
+
+        self.assertEqual(
+            [page_num for page_num, _, _ in pages_workers],
+            [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(pages_workers, pages_serial)
+
+    def test_split_quarantine(self):
+        """ Split a file that is not a valid pdf
+            Expected: file quarantined with error status, no pages, no retries
+        """
+        
+        bad_file = models.File(user=self.file.user, name="bad")
+        bad_file.path.save("bad.pdf", ContentFile(b"%PDF-1.4 broken"), save=True)
+        models.Job.objects.filter(file=bad_file).update(attempts=1)
+        job = models.Job.objects.get(file=bad_file)
+        self.assertTrue(jobs.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.Job.DONE)
+        
+        bad_file.refresh_from_db()
+        self.assertEqual(bad_file.status, models.File.ERROR)
+        self.assertNotEqual(bad_file.error, "")
+        self.assertFalse(bad_file.pages_generated)
+        self.assertFalse(models.Page.objects.filter(file=bad_file).exists())
+        
+        # Valid files still splitted after it
+        self.file.split_pdf()
+        self.assertEqual(self.file.status, models.File.READY)
+        
+    def test_split_missing_file(self):
+        """ Split a file removed while the processes open it
+            Expected: error raised (job retried), file not quarantined
+        """
+        
+        with SandboxPool(task_errors=(PdfParseError,)) as pool:
+            with self.assertRaises(FileNotFoundError):
+                pool.run(count_pages, os.path.join(self.media_root, "missing.pdf"))
+        
+        with patch(
+            "audio_generator.models.split_pdf_lib",
+            side_effect=FileNotFoundError("cached file evicted")
+        ):
+            with self.assertRaises(FileNotFoundError):
+                self.file.split_pdf()
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.status, models.File.PROCESSING)
+
+
+class TestSandbox(APITestCase):
+    """ Test limits of the processes parsing untrusted files """
+    
+    def test_result(self):
+        """ Run a task in the sandbox
+            Expected: task result returned
+        """
+        with SandboxPool() as pool:
+            self.assertEqual(pool.run(sum, [1, 2, 3]), 6)
+    
+    def test_error(self):
+        """ Run a task that raises an error
+            Expected: SandboxError raised
+        """
+        with SandboxPool() as pool:
+            with self.assertRaises(SandboxError):
+                pool.run(int, "not a number")
+    
+    def test_memory_limit(self):
+        """ Run a task that uses more memory than allowed
+            Expected: SandboxError raised, and the pool still usable
+        """
+        with SandboxPool(memory_bytes=512 * 1024 * 1024) as pool:
+            with self.assertRaisesRegex(SandboxError, "Memory"):
+                pool.run(bytearray, 4 * 1024 * 1024 * 1024)
+            self.assertEqual(pool.run(sum, [1, 2]), 3)
+    
+    def test_cpu_limit(self):
+        """ Run a task that uses more cpu time than allowed
+            Expected: process killed, SandboxError raised without waiting
+            the timeout, and the pool still usable
+        """
+        with SandboxPool(cpu_seconds=1, timeout=60) as pool:
+            start = monotonic()
+            with self.assertRaisesRegex(SandboxError, "killed"):
+                pool.run(sum, range(10 ** 12))
+            self.assertLess(monotonic() - start, 30)
+            self.assertEqual(pool.run(sum, [1, 2]), 3)
+    
+    def test_timeout(self):
+        """ Run a task that takes more time than allowed
+            Expected: SandboxError raised
+        """
+        with SandboxPool(timeout=0.5) as pool:
+            with self.assertRaisesRegex(SandboxError, "Timeout"):
+                pool.run(sleep, 10)
+
+
+class TestAudioPipeline(APITestCase):
+    """ Test parallel audio generation and tts rate limit """
+    
+    def test_token_bucket(self):
+        """ Take more tokens than the bucket capacity
+            Expected: burst allowed, then wait according to rate
+        """
+        
+        clock = [0.0]
+        waits = []
+        
+        def wait(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+        
+        bucket = TokenBucket(2, 3, clock=lambda: clock[0], wait=wait)
+        for _ in range(5):
+            bucket.acquire()
+        
+        # 3 tokens from burst, then 2 tokens waiting 0.5 seconds each
+        self.assertEqual(waits, [0.5, 0.5])
+        
+    def test_lang_limits(self):
+        """ Generate pages of two languages with a limit for one of them
+            Expected: all pages generated, limit never exceeded
+        """
+        
+        running = {"es": 0, "en": 0}
+        max_running = {"es": 0, "en": 0}
+        lock = threading.Lock()
+        
+        class FakePage:
+            def __init__(self, lang):
+                self.file = type("FakeFile", (), {"lang": lang})
+                self.file_id = None
+                self.page_num = None
+                
+            def generate_audio(self):
+                lang = self.file.lang
+                with lock:
+                    running[lang] += 1
+                    max_running[lang] = max(max_running[lang], running[lang])
+                sleep(0.02)
+                with lock:
+                    running[lang] -= 1
+        
+        pages = [FakePage("es") for _ in range(6)]
+        pages += [FakePage("en") for _ in range(6)]
+        pipeline = AudioPipeline(
+            workers=6,
+            lang_limits={"es": 1},
+            close_connections=False
+        )
+        stats = pipeline.run(pages)
+        
+        self.assertEqual(stats["pages"], 12)
+        self.assertEqual(stats["errors"], 0)
+        self.assertGreater(stats["pages_per_second"], 0)
+        self.assertEqual(max_running["es"], 1)
+        self.assertGreater(max_running["en"], 1)
+
+
+class TestClaimPages(APITestCase):
+    """ Test claim pages pending audio (batch cron) """
+    
+    def setUp(self):
+        """ Create file with pages without audio """
+        
+        user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File.objects.create(
+            user=user,
+            path="files/sample.pdf",
+            name="sample",
+        )
+        models.Page.objects.bulk_create([
+            models.Page(file=self.file, page_num=page_num)
+            for page_num in range(1, 6)
+        ])
+        
+    def test_claim_batches(self):
+        """ Claim pages in batches
+            Expected: each page claimed only once
+        """
+        
+        first = models.Page.claim_pending_audio(3)
+        second = models.Page.claim_pending_audio(3)
+        third = models.Page.claim_pending_audio(3)
+        
+        self.assertEqual([page.page_num for page in first], [1, 2, 3])
+        self.assertEqual([page.page_num for page in second], [4, 5])
+        self.assertEqual(third, [])
+        
+    def test_claim_expired_lease(self):
+        """ Claim pages with expired lease (process died)
+            Expected: pages claimed again
+        """
+        
+        models.Page.claim_pending_audio(5)
+        models.Page.objects.update(audio_lease_until=self.file.uploaded_at)
+        self.assertEqual(len(models.Page.claim_pending_audio(5)), 5)
+    
+    @override_settings(TTS_MAX_ATTEMPTS=2)
+    def test_claim_max_attempts(self):
+        """ Claim pages whose generation always fails
+            Expected: pages not claimed after TTS_MAX_ATTEMPTS claims
+        """
+        
+        for _ in range(2):
+            pages = models.Page.claim_pending_audio(5)
+            self.assertEqual(len(pages), 5)
+            for page in pages:
+                page.release_audio()
+        
+        self.assertEqual(models.Page.claim_pending_audio(5), [])
+        self.assertEqual(
+            set(models.Page.objects.values_list('audio_attempts', flat=True)), {2}
+        )
+    
+    def test_file_generate_audio(self):
+        """ Generate audio of a file while the cron voices some pages
+            Expected: only pages not leased generated, and leased
+        """
+        
+        models.Page.claim_pending_audio(2)
+        with patch.object(AudioPipeline, 'run', return_value={}) as run:
+            self.file.generate_audio()
+        
+        pages = run.call_args.args[0]
+        self.assertEqual([page.page_num for page in pages], [3, 4, 5])
+        self.assertFalse(
+            models.Page.objects.filter(audio_lease_until__isnull=True).exists()
+        )
+
+
+class TestTTSEngines(APITestCase):
+    """ Test tts engine selection by language """
+    
+    @override_settings(TTS_ENGINE="gtts", TTS_LANG_ENGINES={"es": "espeak"})
+    def test_lang_engine(self):
+        """ Get engine for languages with and without custom engine
+            Expected: custom engine or default engine
+        """
+        self.assertIsInstance(get_lang_engine("es"), EspeakEngine)
+        self.assertIsInstance(get_lang_engine("en"), GTTSEngine)
+    
+    def test_local_engine(self):
+        """ Generate audio with local engine and rate limiter
+            Expected: espeak-ng called without using the rate limiter
+        """
+        
+        rate_limiter = TokenBucket(1, 1)
+        with tempfile.TemporaryDirectory() as folder, \
+                patch("libs.audio.subprocess.run") as run:
+            file_path = f"{folder}/1.wav"
+            generate_audio(
+                "sample text\n",
+                "es",
+                file_path,
+                rate_limiter=rate_limiter,
+                engine=EspeakEngine()
+            )
+        
+        command = run.call_args.args[0]
+        self.assertEqual(command[0], "espeak-ng")
+        self.assertIn(file_path, command)
+        self.assertEqual(run.call_args.kwargs["input"], b"sample text")
+        self.assertEqual(rate_limiter.tokens, 1)
+
+
+class TestAudioCache(APITestCase):
+    """ Test reuse audio of pages with the same text """
+    
+    def setUp(self):
+        """ Use temp media folder and split a pdf file with blank pages """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+        )
+        self.settings_override.enable()
+        
+        user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File(user=user, name="sample")
+        self.file.path.save("sample.pdf", ContentFile(make_pdf(3)), save=True)
+        self.file.split_pdf()
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def fake_generate_audio(self, text, lang, file_path, **kwargs):
+        """ Save fake audio file instead of calling tts engine """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as audio_file:
+            audio_file.write(b"audio" * 100)
+        return file_path
+        
+    def test_reuse_audio(self):
+        """ Generate audio of pages with the same text (blank)
+            Expected: audio generated once, and reused by all pages
+        """
+        
+        with patch(
+            "audio_generator.models.tts_generate_audio",
+            side_effect=self.fake_generate_audio
+        ) as generate_audio:
+            for page in self.file.tracks.all():
+                page.generate_audio()
+        
+        self.assertEqual(generate_audio.call_count, 1)
+        paths = set(self.file.tracks.values_list('path_audio', flat=True))
+        self.assertEqual(len(paths), 1)
+        
+        stats = models.AudioCache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["generated"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+        
+    def test_evict(self):
+        """ Fill cache over its max size
+            Expected: least recently used entries removed,
+            files in use by pages kept
+        """
+        
+        audio_path = self.fake_generate_audio("", "en", f"{self.media_root}/a.mp3")
+        first = models.AudioCache.store("a" * 64, audio_path, "mp3")
+        second = models.AudioCache.store("b" * 64, audio_path, "mp3")
+        models.Page.objects.filter(page_num=1).update(path_audio=second.path.name)
+        models.AudioCache.store("c" * 64, audio_path, "mp3")
+        last = models.AudioCache.store("d" * 64, audio_path, "mp3")
+        
+        # Entries used recently are kept
+        models.AudioCache.evict(1000, keep=last.id)
+        self.assertEqual(models.AudioCache.objects.count(), 4)
+        
+        models.AudioCache.evict(1000, keep=last.id, min_age_seconds=0)
+        keys = models.AudioCache.objects.values_list('key', flat=True)
+        self.assertEqual(sorted(keys), ["c" * 64, "d" * 64])
+        self.assertFalse(first.path.storage.exists(first.path.name))
+        self.assertTrue(second.path.storage.exists(second.path.name))
+        
+    def test_evict_large_entry(self):
+        """ Store an entry larger than the cache
+            Expected: the entry just stored is kept
+        """
+        
+        audio_path = self.fake_generate_audio("", "en", f"{self.media_root}/a.mp3")
+        entry = models.AudioCache.store("a" * 64, audio_path, "mp3")
+        models.AudioCache.evict(10, keep=entry.id, min_age_seconds=0)
+        self.assertTrue(models.AudioCache.objects.filter(id=entry.id).exists())
+        self.assertTrue(entry.path.storage.exists(entry.path.name))
+        
+    def test_store_race(self):
+        """ Store the same key in two processes (the second one loses the
+            insert race)
+            Expected: file of the saved entry kept, duplicate file removed
+        """
+        
+        audio_path = self.fake_generate_audio("", "en", f"{self.media_root}/a.mp3")
+        first = models.AudioCache.store("a" * 64, audio_path, "mp3")
+        
+        # Key not found before the insert: other process saved it meanwhile
+        saved_names = []
+        save = models.AudioCache.save
+        
+        def track_save(entry, *args, **kwargs):
+            saved_names.append(entry.path.name)
+            return save(entry, *args, **kwargs)
+        
+        with patch.object(models.AudioCache.objects, "filter") as filter_mock, \
+                patch.object(models.AudioCache, "save", track_save):
+            filter_mock.return_value.first.return_value = None
+            entry = models.AudioCache.store("a" * 64, audio_path, "mp3")
+        
+        self.assertEqual(entry.id, first.id)
+        self.assertTrue(first.path.storage.exists(first.path.name))
+        self.assertNotEqual(saved_names[0], first.path.name)
+        self.assertFalse(first.path.storage.exists(saved_names[0]))
+
+
+class TestAudioStream(APITestCase):
+    """ Test generate audio by sentences and stream it """
+    
+    def setUp(self):
+        """ Use temp media folder and create file with a page """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+            STREAM_TIMEOUT=0,
+            STREAM_POLL_SECONDS=0,
+        )
+        self.settings_override.enable()
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File(user=self.user, name="sample")
+        self.file.path.save("sample.pdf", ContentFile(make_pdf(1)), save=True)
+        self.file.split_pdf()
+        self.page = self.file.tracks.get()
+        self.user.is_active = True
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        
+        # Async views (stream) authenticate the token without rest framework
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def fake_generate_audio(self, text, lang, file_path, **kwargs):
+        """ Save the text as audio file instead of calling tts engine """
+        with open(file_path, "wb") as audio_file:
+            audio_file.write(f"<{text}>".encode())
+        return file_path
+    
+    def test_split_sentences(self):
+        """ Split text with short max length
+            Expected: complete sentences, joined while they fit
+        """
+        text = "First one. Second one!\nThird? Fourth sentence is long."
+        self.assertEqual(
+            split_sentences(text, max_chars=25),
+            ["First one. Second one!", "Third?", "Fourth sentence is long."]
+        )
+        
+    def test_generate_chunks(self):
+        """ Generate page audio with a streamable engine, and prune chunks
+            Expected: full audio is all chunks joined, chunks kept until
+            the page was completed a while ago
+        """
+        
+        with patch(
+            "audio_generator.models.get_pdf_text",
+            return_value="One. Two."
+        ), patch(
+            "audio_generator.models.split_sentences",
+            return_value=["One.", "Two."]
+        ), patch(
+            "audio_generator.models.tts_generate_audio",
+            side_effect=self.fake_generate_audio
+        ):
+            self.page.generate_audio()
+        
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.audio_chunks, 2)
+        self.assertEqual(self.page.audio_chunk_sizes, [6, 6])
+        with self.page.path_audio.open('rb') as audio_file:
+            self.assertEqual(audio_file.read(), b"<One.><Two.>")
+        storage = self.page.path_audio.storage
+        self.assertTrue(storage.exists(self.page.chunk_name(1)))
+        
+        call_command('prune_audio_chunks', stdout=io.StringIO())
+        self.assertTrue(storage.exists(self.page.chunk_name(1)))
+        
+        call_command('prune_audio_chunks', hours=-1, stdout=io.StringIO())
+        self.page.refresh_from_db()
+        self.assertEqual(self.page.audio_chunks, 0)
+        self.assertFalse(storage.exists(self.page.chunk_name(1)))
+        
+    def test_playlist_completed(self):
+        """ Get playlist of a page completed with chunks, and after the
+            chunks are removed
+            Expected: same chunk segments plus the end list (sizes from
+            the page, not from storage), then the full audio
+        """
+        
+        storage = self.page.path_audio.storage
+        storage.save(self.page.chunk_name(1), ContentFile(b"<One.>"))
+        storage.save(self.page.chunk_name(2), ContentFile(b"<Two.>"))
+        models.Page.objects.filter(id=self.page.id).update(
+            audio_chunks=2,
+            audio_chunk_sizes=[6, 6],
+            path_audio=storage.save("full.mp3", ContentFile(b"<One.><Two.>")),
+        )
+        
+        url = reverse('page_playlist', args=[self.page.id])
+        with patch.object(FileSystemStorage, "size", side_effect=AssertionError):
+            playlist = self.client.get(url).content.decode()
+        self.assertEqual(playlist.count("audio_chunks/"), 2)
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:0", playlist)
+        self.assertIn("#EXT-X-ENDLIST", playlist)
+        
+        self.page.refresh_from_db()
+        self.page.delete_audio_chunks()
+        playlist = self.client.get(url).content.decode()
+        self.assertNotIn("audio_chunks/", playlist)
+        self.assertIn("full.mp3", playlist)
+        self.assertIn("#EXT-X-ENDLIST", playlist)
+        
+    @override_settings(TTS_ENGINE="espeak", TTS_LANG_ENGINES={})
+    def test_playlist_not_streamable(self):
+        """ Get playlist of a page with an engine without constant bitrate
+            Expected: 404, and no generation job queued
+        """
+        
+        url = reverse('page_playlist', args=[self.page.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.page.jobs.exists())
+        
+    def test_stream_partial(self):
+        """ Stream page with only some chunks generated
+            Expected: chunks sent, generation job queued
+        """
+        
+        storage = self.page.path_audio.storage
+        storage.save(self.page.chunk_name(1), ContentFile(b"<One.>"))
+        storage.save(self.page.chunk_name(2), ContentFile(b"<Two.>"))
+        models.Page.objects.filter(id=self.page.id).update(audio_chunks=2)
+        
+        response = self.client.get(reverse('page_audio_stream', args=[self.page.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"<One.><Two.>")
+        self.assertTrue(
+            models.Job.objects.filter(page=self.page, kind=models.Job.GENERATE_AUDIO)
+        )
+        
+        response = self.client.get(reverse('page_playlist', args=[self.page.id]))
+        playlist = response.content.decode()
+        self.assertIn("audio_chunks/", playlist)
+        self.assertNotIn("#EXT-X-ENDLIST", playlist)
+        
+    async def test_stream_async(self):
+        """ Stream page with some chunks generated, served with asgi
+            Expected: chunks sent by the async generator
+        """
+        
+        def save_chunks():
+            storage = self.page.path_audio.storage
+            storage.save(self.page.chunk_name(1), ContentFile(b"<One.>"))
+            storage.save(self.page.chunk_name(2), ContentFile(b"<Two.>"))
+            models.Page.objects.filter(id=self.page.id).update(audio_chunks=2)
+        
+        await sync_to_async(save_chunks)()
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(
+            reverse('page_audio_stream', args=[self.page.id]), {"token": token}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.streaming_content, '__anext__'))
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, b"<One.><Two.>")
+        
+    def test_stream_other_user(self):
+        """ Stream page of other user
+            Expected 404: error response
+        """
+        
+        other_user = models.User.objects.create_user(
+            email="other@gmail.com",
+            first_name='other',
+            last_name='other',
+            password='12345678'
+        )
+        other_user.is_active = True
+        other_user.save()
+        token = AccessToken.for_user(other_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(reverse('page_audio_stream', args=[self.page.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['message'], 'API.PAGE.NOT_FOUND')
+
+
+class TestPrefetch(APITestCase):
+    """ Test voice pages ahead of active readers first """
+    
+    def setUp(self):
+        """ Create two files with pages without audio """
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.files = []
+        for name in ["first", "second"]:
+            file = models.File.objects.create(
+                user=self.user,
+                path=f"files/{name}.pdf",
+                name=name,
+                pages_num=20,
+            )
+            models.Page.objects.bulk_create([
+                models.Page(file=file, page_num=page_num)
+                for page_num in range(1, 21)
+            ])
+            self.files.append(file)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('file_current_page', args=[self.files[1].id])
+            
+    @override_settings(PREFETCH_WINDOW=2)
+    def test_claim_ahead_of_reader(self):
+        """ Read page 10 of second file
+            Expected: pages 10 to 12 of second file claimed first
+        """
+        
+        self.client.post(self.url, {"page": 10})
+        pages = models.Page.claim_pending_audio(5)
+        
+        self.assertEqual(
+            [(page.file.name, page.page_num) for page in pages],
+            [
+                ("second", 10),
+                ("second", 11),
+                ("second", 12),
+                ("first", 1),
+                ("first", 2)
+            ]
+        )
+        
+    def test_read_page_missing(self):
+        """ Read pages with and without audio
+            Expected: miss counted, missing page audio queued
+        """
+        
+        self.files[1].tracks.filter(page_num=1).update(path_audio="a.mp3")
+        
+        response = self.client.post(self.url, {"page": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['data']['audio_ready'])
+        
+        response = self.client.post(self.url, {"page": 2})
+        self.assertFalse(response.data['data']['audio_ready'])
+        
+        file = models.File.objects.get(id=self.files[1].id)
+        self.assertEqual(file.current_page, 2)
+        self.assertEqual(file.pages_read, 2)
+        self.assertEqual(file.pages_read_missing, 1)
+        self.assertTrue(models.Job.objects.filter(page__page_num=2).exists())
+        
+    def test_read_invalid_page(self):
+        """ Read page out of the file
+            Expected 400: error response
+        """
+        
+        response = self.client.post(self.url, {"page": 21})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'API.FILE.INVALID_PAGE')
+
+
+class TestLibraryApi(APITestCase):
+    """ Test files and pages listings of the user library """
+    
+    def setUp(self):
+        """ Create user and authenticate """
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+    def create_files(self, files_num: int, pages_num: int = 3) -> list:
+        """ Create files with pages, the first page with audio
+        
+        Args:
+            files_num (int): files to create
+            pages_num (int, optional): pages of each file. Defaults to 3.
+        
+        Returns:
+            list: File objects
+        """
+        files = []
+        for index in range(files_num):
+            file = models.File.objects.create(
+                user=self.user,
+                path=f"files/{index}.pdf",
+                name=f"file {index}",
+                pages_num=pages_num,
+            )
+            models.Page.objects.bulk_create([
+                models.Page(
+                    file=file,
+                    page_num=page_num,
+                    path_pdf=f"pages/{index}/{page_num}.pdf",
+                    path_audio=f"pages/{index}/{page_num}.mp3" if page_num == 1 else "",
+                )
+                for page_num in range(1, pages_num + 1)
+            ])
+            files.append(file)
+        return files
+    
+    def test_list_files(self):
+        """ List files of the user
+            Expected: most recent first, with pages ready, paginated
+        """
+        
+        files = self.create_files(3)
+        other_user = models.User.objects.create_user(
+            email="other@gmail.com",
+            first_name='other',
+            last_name='other',
+            password='12345678'
+        )
+        models.File.objects.create(user=other_user, path="files/other.pdf", name="other")
+        
+        response = self.client.get(reverse('files-list'), {"page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'API.FILE.LISTED')
+        results = response.data['data']['results']
+        self.assertEqual([row['id'] for row in results], [files[2].id, files[1].id])
+        self.assertEqual(results[0]['pages_ready'], 1)
+        self.assertEqual(results[0]['pages_num'], 3)
+        
+        # Next page
+        response = self.client.get(response.data['data']['next'])
+        results = response.data['data']['results']
+        self.assertEqual([row['id'] for row in results], [files[0].id])
+        self.assertIsNone(response.data['data']['next'])
+        
+    def test_list_files_queries(self):
+        """ List libraries of different sizes
+            Expected: same number of queries
+        """
+        
+        self.create_files(2)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('files-list'))
+        
+        self.create_files(30, pages_num=5)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('files-list'))
+        self.assertEqual(len(response.data['data']['results']), 20)
+        
+    def test_retrieve_file(self):
+        """ Get a file of the user, and a file of other user
+            Expected: file data, and not found error
+        """
+        
+        file = self.create_files(1)[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('files-detail', args=[file.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['name'], file.name)
+        
+        response = self.client.get(reverse('files-detail', args=[file.id + 1]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'API.FILE.NOT_FOUND')
+        
+    def test_list_pages(self):
+        """ List pages of files of different sizes
+            Expected: pages in order, with urls, same number of queries
+        """
+        
+        small_file, big_file = self.create_files(1)[0], self.create_files(1, 60)[0]
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('files-pages', args=[small_file.id]))
+        results = response.data['data']['results']
+        self.assertEqual([row['page_num'] for row in results], [1, 2, 3])
+        self.assertTrue(results[0]['audio_url'].endswith("1.mp3"))
+        self.assertIsNone(results[1]['audio_url'])
+        self.assertEqual(results[0]['lang'], small_file.lang)
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('files-pages', args=[big_file.id]))
+        self.assertEqual(len(response.data['data']['results']), 20)
+        self.assertIsNotNone(response.data['data']['next'])
+        
+    def test_retrieve_page(self):
+        """ Get a page of the user, and a page of other user
+            Expected: page data in a single query, and not found error
+        """
+        
+        page = self.create_files(1)[0].tracks.get(page_num=2)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('pages-detail', args=[page.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['page_num'], 2)
+        
+        page.file.user = models.User.objects.create_user(
+            email="other@gmail.com",
+            first_name='other',
+            last_name='other',
+            password='12345678'
+        )
+        page.file.save()
+        response = self.client.get(reverse('pages-detail', args=[page.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'API.PAGE.NOT_FOUND')
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=1000)
+class TestUpload(APITestCase):
+    """ Test resumable uploads by chunks """
+    
+    def setUp(self):
+        """ Use temp media folder, authenticate user and start an upload """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+        )
+        self.settings_override.enable()
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.client.force_authenticate(user=self.user)
+        
+        self.content = make_pdf(20)
+        response = self.client.post(reverse('uploads-list'), {
+            "name": "book.pdf",
+            "lang": "es",
+            "size": len(self.content),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.data['data']['id']
+        self.chunk_url = reverse('uploads-chunk', args=[self.upload_id])
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def send_chunk(self, offset: int, content: bytes = None, checksum: str = None):
+        """ Send chunk of the pdf file
+        
+        Args:
+            offset (int): chunk position
+            content (bytes, optional): chunk content. Defaults to the
+                file content at the offset.
+            checksum (str, optional): chunk sha256. Defaults to the
+                content checksum.
+        
+        Returns:
+            Response: api response
+        """
+        if content is None:
+            content = self.content[offset:offset + 1000]
+        return self.client.put(
+            self.chunk_url,
+            content,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+            HTTP_UPLOAD_CHECKSUM=checksum or hashlib.sha256(content).hexdigest(),
+        )
+        
+    def test_upload(self):
+        """ Send all chunks and complete
+            Expected: file created with the same content, split job queued
+        """
+        
+        for offset in range(0, len(self.content), 1000):
+            response = self.send_chunk(offset)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['offset'], len(self.content))
+        
+        response = self.client.post(reverse('uploads-complete', args=[self.upload_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'API.UPLOAD.COMPLETED')
+        
+        file = models.File.objects.get(id=response.data['data']['file'])
+        self.assertEqual((file.name, file.lang), ("book", "es"))
+        with file.path.open('rb') as pdf_file:
+            self.assertEqual(pdf_file.read(), self.content)
+        self.assertTrue(
+            models.Job.objects.filter(file=file, kind=models.Job.SPLIT_PDF).exists()
+        )
+        
+    def test_resume(self):
+        """ Send a chunk twice (response lost), and a chunk with bad checksum
+            Expected: errors with the offset to resume, file not corrupted
+        """
+        
+        self.send_chunk(0)
+        response = self.send_chunk(0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['data']['offset'], 1000)
+        
+        response = self.send_chunk(1000, checksum="0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'API.UPLOAD.INVALID_CHECKSUM')
+        
+        response = self.send_chunk(1000, content=b"short")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'API.UPLOAD.INVALID_CHUNK')
+        
+        # Complete fails until all chunks are saved
+        response = self.client.post(reverse('uploads-complete', args=[self.upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'API.UPLOAD.INCOMPLETE')
+        
+        response = self.client.get(reverse('uploads-detail', args=[self.upload_id]))
+        for offset in range(response.data['data']['offset'], len(self.content), 1000):
+            self.send_chunk(offset)
+        response = self.client.post(reverse('uploads-complete', args=[self.upload_id]))
+        self.assertEqual(response.status_code, 200)
+        
+        file = models.File.objects.get(id=response.data['data']['file'])
+        with file.path.open('rb') as pdf_file:
+            self.assertEqual(pdf_file.read(), self.content)
+        
+    def test_abort(self):
+        """ Abort upload
+            Expected: chunks removed, no more chunks accepted
+        """
+        
+        self.send_chunk(0)
+        upload = models.Upload.objects.get(id=self.upload_id)
+        self.assertTrue(upload.storage.exists(upload.path))
+        
+        response = self.client.delete(reverse('uploads-detail', args=[self.upload_id]))
+        self.assertEqual(response.data['data']['status'], models.Upload.ABORTED)
+        self.assertFalse(upload.storage.exists(upload.path))
+        
+        response = self.send_chunk(1000)
+        self.assertEqual(response.status_code, 409)
+    
+    def test_expire(self):
+        """ Expire uploads without new chunks for a while
+            Expected: abandoned upload aborted with its chunks removed,
+            recent upload kept
+        """
+        
+        self.send_chunk(0)
+        abandoned = models.Upload.objects.get(id=self.upload_id)
+        recent = models.Upload.start(self.user, "other.pdf", "en", 100)
+        models.Upload.objects.filter(id=abandoned.id).update(
+            updated_at=timezone.now() - timedelta(hours=25)
+        )
+        
+        call_command("expire_uploads", hours=24, stdout=io.StringIO())
+        
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, models.Upload.ABORTED)
+        self.assertFalse(abandoned.storage.exists(abandoned.path))
+        recent.refresh_from_db()
+        self.assertEqual(recent.status, models.Upload.UPLOADING)
+        
+    def test_s3_multipart(self):
+        """ Upload chunks to a s3 storage
+            Expected: chunks sent as parts of a multipart upload, joined
+            when completed
+        """
+        
+        storage = FileSystemStorage(location=self.media_root)
+        storage.bucket_name = "bucket"
+        storage.location = ""
+        storage.bucket = MagicMock()
+        s3_object = storage.bucket.Object.return_value
+        s3_object.initiate_multipart_upload.return_value.id = "s3-id"
+        multipart_upload = s3_object.MultipartUpload.return_value
+        multipart_upload.parts.all.return_value = [
+            MagicMock(part_number=1, e_tag="a"),
+            MagicMock(part_number=2, e_tag="b"),
+        ]
+        
+        with patch.object(models.Upload, "storage", storage):
+            upload = models.Upload.start(self.user, "s3.pdf", "en", 1500)
+            self.assertEqual(upload.storage_upload_id, "s3-id")
+            upload.write_chunk(0, io.BytesIO(b"a" * 1000), 1000)
+            upload.write_chunk(1000, io.BytesIO(b"b" * 500), 500)
+            upload.complete()
+        
+        storage.bucket.Object.assert_called_with(upload.path)
+        s3_object.MultipartUpload.assert_called_with("s3-id")
+        self.assertEqual(
+            [part.args[0] for part in multipart_upload.Part.call_args_list],
+            [1, 2]
+        )
+        multipart_upload.complete.assert_called_once_with(MultipartUpload={
+            "Parts": [
+                {"PartNumber": 1, "ETag": "a"},
+                {"PartNumber": 2, "ETag": "b"},
+            ]
+        })
+        self.assertEqual(upload.status, models.Upload.COMPLETED)
+
+
+@override_settings(PROGRESS_POLL_SECONDS=0.01, PROGRESS_KEEPALIVE_SECONDS=1)
+class TestProgress(APITestCase):
+    """ Test split and audio progress: polling and server sent events """
+    
+    def setUp(self):
+        """ Use temp media folder and upload a pdf file """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+        )
+        self.settings_override.enable()
+        cache.clear()
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File(user=self.user, name="sample")
+        self.user.is_active = True
+        self.user.save()
+        self.file.path.save("sample.pdf", ContentFile(make_pdf(2)), save=True)
+        token = AccessToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.url = reverse('file_progress', args=[self.file.id])
+        self.stream_url = reverse('file_progress_stream', args=[self.file.id])
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def generate_audio(self):
+        """ Generate audio of the pages without calling tts engine """
+        
+        def fake_generate_audio(text, lang, file_path, **kwargs):
+            with open(file_path, "wb") as audio_file:
+                audio_file.write(b"audio")
+            return file_path
+        
+        with patch("audio_generator.models.tts_generate_audio") as generate, \
+                patch.object(GTTSEngine, "streamable", False):
+            generate.side_effect = fake_generate_audio
+            for page in self.file.tracks.all():
+                page.generate_audio()
+                
+    def test_progress(self):
+        """ Split file and generate audio of its pages
+            Expected: progress counted by page
+        """
+        
+        self.assertEqual(self.file.get_progress()["status"], models.File.PROCESSING)
+        self.file.split_pdf()
+        self.file.refresh_from_db()
+        self.assertEqual(
+            self.file.get_progress(),
+            {
+                "status": models.File.READY,
+                "pages_num": 2,
+                "pages_split": 2,
+                "pages_audio": 0,
+                "done": False,
+            }
+        )
+        
+        self.generate_audio()
+        self.generate_audio()
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.pages_audio, 2)
+        self.assertTrue(self.file.get_progress()["done"])
+        
+    def test_polling(self):
+        """ Get progress many times, and progress of other user file
+            Expected: progress read from cache after first request,
+            not found error for other users
+        """
+        
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], models.File.PROCESSING)
+        self.assertIn("max-age", response['Cache-Control'])
+        
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        
+        other_user = models.User.objects.create_user(
+            email="other@gmail.com",
+            first_name='other',
+            last_name='other',
+            password='12345678'
+        )
+        other_user.is_active = True
+        other_user.save()
+        token = AccessToken.for_user(other_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        
+    def test_stream_auth(self):
+        """ Open progress stream without token, and with invalid token
+            Expected: 401 errors
+        """
+        
+        self.client.credentials()
+        response = self.client.get(self.stream_url)
+        self.assertEqual(response.status_code, 401)
+        
+        response = self.client.get(self.stream_url, {"token": "invalid"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['status'], 'error')
+        
+    @override_settings(PROGRESS_POLL_SECONDS=0, PROGRESS_CACHE_SECONDS=0)
+    def test_stream_sync(self):
+        """ Open progress stream with wsgi while the file is splitted
+            Expected: sync events sent one by one, each change sent live
+        """
+        
+        response = self.client.get(self.stream_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.streaming_content, '__anext__'))
+        
+        events = iter(response.streaming_content)
+        self.assertIn(b'"status": "processing"', next(events))
+        self.file.split_pdf()
+        self.assertIn(b'"status": "ready"', next(events))
+        
+    async def test_stream(self):
+        """ Open progress stream while the file is splitted and voiced
+            Expected: events with each change, stream closed when done
+        """
+        
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(self.stream_url, {"token": token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "text/event-stream")
+        
+        events = aiter(response.streaming_content)
+        first_event = await anext(events)
+        self.assertIn(b'"status": "processing"', first_event)
+        
+        await sync_to_async(self.file.split_pdf)()
+        self.assertIn(b'"status": "ready"', await anext(events))
+        
+        await sync_to_async(self.generate_audio)()
+        last_event = b""
+        async for event in events:
+            last_event = event
+        self.assertIn(b'"done": true', last_event)
+        
+    async def test_poller_shared(self):
+        """ Watch the same files from many clients
+            Expected: a single query by tick for all the clients
+        """
+        
+        poller = ProgressPoller()
+        file_ids = [self.file.id, self.file.id + 1000]
+        with patch(
+            "audio_generator.progress.get_progress_many",
+            wraps=get_progress_many
+        ) as get_progress:
+            queues = [poller.subscribe(file_ids[index % 2]) for index in range(500)]
+            progress = await asyncio.wait_for(queues[0].get(), 1)
+            self.assertEqual(progress["status"], models.File.PROCESSING)
+            get_progress.assert_called_once()
+            self.assertEqual(set(get_progress.call_args.args[0]), set(file_ids))
+            
+            for index, queue in enumerate(queues):
+                poller.unsubscribe(file_ids[index % 2], queue)
+            await poller.task
+        self.assertEqual(poller.subscribers, {})
+    
+    async def test_poller_error(self):
+        """ Watch a file while the progress query fails once
+            Expected: error logged, progress sent by the next tick
+        """
+        
+        poller = ProgressPoller(interval=0.01)
+        with patch(
+            "audio_generator.progress.get_progress_many",
+            side_effect=[OSError("database unavailable"), {self.file.id: {"done": True}}]
+        ), self.assertLogs("audio_generator.progress", "ERROR"):
+            queue = poller.subscribe(self.file.id)
+            progress = await asyncio.wait_for(queue.get(), 1)
+        self.assertEqual(progress, {"done": True})
+        self.assertFalse(poller.task.done())
+        
+        poller.unsubscribe(self.file.id, queue)
+        await poller.task
+
+
+class TestOpenLocal(APITestCase):
+    """ Test read storage files from local disk """
+    
+    def test_remote_storage(self):
+        """ Open file of a storage without local paths
+            Expected: content read from a temp file removed after use
+        """
+        
+        storage = InMemoryStorage()
+        storage.save("sample.pdf", ContentFile(b"pdf content" * 1000))
+        
+        with tempfile.TemporaryDirectory() as temp_folder:
+            with open_local(storage, "sample.pdf", temp_folder) as local_file:
+                self.assertEqual(local_file.read(), b"pdf content" * 1000)
+            self.assertEqual(os.listdir(temp_folder), [])
+            
+    def test_local_storage(self):
+        """ Open file of a local storage
+            Expected: original file opened, no copy
+        """
+        
+        with tempfile.TemporaryDirectory() as media_root:
+            storage = FileSystemStorage(location=media_root)
+            name = storage.save("sample.pdf", ContentFile(b"pdf content"))
+            with open_local(storage, name) as local_file:
+                self.assertEqual(local_file.name, storage.path(name))
+
+
+class TestDiskCache(APITestCase):
+    """ Test local disk cache of remote storage files """
+    
+    def setUp(self):
+        """ Create remote storage with a file and empty cache """
+        
+        self.storage = InMemoryStorage()
+        self.storage.save("first.pdf", ContentFile(b"1" * 100))
+        self.storage.save("second.pdf", ContentFile(b"2" * 100))
+        self.folder = tempfile.mkdtemp()
+        self.cache = DiskCache(self.folder, 150)
+        
+    def tearDown(self):
+        """ Remove cache folder """
+        shutil.rmtree(self.folder)
+        
+    def read(self, name: str) -> bytes:
+        """ Read storage file through the cache """
+        with open_local(self.storage, name, cache=self.cache) as local_file:
+            return local_file.read()
+        
+    def test_hit_miss(self):
+        """ Read the same file twice, then after it changes
+            Expected: miss, hit, miss (new version)
+        """
+        
+        self.assertEqual(self.read("first.pdf"), b"1" * 100)
+        self.assertEqual(self.read("first.pdf"), b"1" * 100)
+        
+        self.storage.delete("first.pdf")
+        self.storage.save("first.pdf", ContentFile(b"3" * 120))
+        self.assertEqual(self.read("first.pdf"), b"3" * 120)
+        
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        
+    def test_evict(self):
+        """ Read files bigger than cache size
+            Expected: least recently used file removed
+        """
+        
+        self.read("first.pdf")
+        self.read("second.pdf")
+        
+        stats = self.cache.stats()
+        self.assertEqual(stats["files"], 1)
+        self.assertEqual(stats["bytes"], 100)
+        self.assertEqual(self.read("second.pdf"), b"2" * 100)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+    
+    def test_evicted_while_opened(self):
+        """ Read cached file evicted by other process right after it is opened
+            Expected: content read from the open file
+        """
+        
+        self.read("first.pdf")
+        with patch("libs.storage.os.utime", side_effect=FileNotFoundError):
+            self.assertEqual(self.read("first.pdf"), b"1" * 100)
+
+
+class TestConnectionPool(APITestCase):
+    """ Test pool of reusable connections (fake connections) """
+    
+    class FakeConnection:
+        """ Connection that can be broken """
+        
+        def __init__(self):
+            self.broken = False
+            self.closed = False
+        
+        def check(self):
+            if self.broken:
+                raise OSError("connection lost")
+        
+        def close(self):
+            self.closed = True
+    
+    def make_pool(self, **kwargs) -> ConnectionPool:
+        """ Create pool of fake connections """
+        return ConnectionPool(
+            self.FakeConnection,
+            check=lambda connection: connection.check(),
+            **kwargs
+        )
+    
+    def test_reuse(self):
+        """ Acquire and release connections
+            Expected: released connection reused, gauges updated
+        """
+        
+        pool = self.make_pool(max_size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()["in_use"], 2)
+        
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        stats = pool.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["checkouts"], 3)
+        
+        # Broken connection closed, its place freed
+        pool.release(second, broken=True)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.stats()["size"], 1)
+        
+    def test_wait(self):
+        """ Acquire connection from a full pool
+            Expected: wait until a connection is released, else timeout
+        """
+        
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        connection = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        
+        pool.timeout = 5
+        releaser = threading.Timer(0.1, pool.release, args=[connection])
+        releaser.start()
+        self.assertIs(pool.acquire(), connection)
+        releaser.join()
+        stats = pool.stats()
+        self.assertEqual(stats["waiting"], 0)
+        self.assertGreater(stats["checkout_seconds_max"], 0.05)
+        
+    def test_health_check(self):
+        """ Acquire connection broken while it was idle
+            Expected: replaced by a new connection
+        """
+        
+        pool = self.make_pool(max_size=1, health_check_seconds=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.broken = True
+        
+        new_connection = pool.acquire()
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()["size"], 1)
+        self.assertEqual(pool.stats()["discarded"], 1)
+        
+    def test_release_reset(self):
+        """ Close a pooled postgres connection with an open transaction
+            Expected: rollback, session reset in autocommit mode, then
+            returned to the pool
+        """
+        
+        from misojo.db_pool.base import DatabaseWrapper
+        
+        connection = MagicMock(closed=0)
+        connection.info.transaction_status = 2
+        wrapper = MagicMock(connection=connection)
+        wrapper.Database.Error = Exception
+        
+        DatabaseWrapper._close(wrapper)
+        
+        connection.rollback.assert_called_once()
+        self.assertTrue(connection.autocommit)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once_with("DISCARD ALL")
+        wrapper.pool.release.assert_called_once_with(connection, broken=False)
+        
+        # Reset failed: connection closed
+        cursor.execute.side_effect = Exception("connection lost")
+        wrapper.pool.reset_mock()
+        DatabaseWrapper._close(wrapper)
+        wrapper.pool.release.assert_called_once_with(connection, broken=True)
+        
+    def test_stats_view(self):
+        """ Get pool gauges as normal user and as admin
+            Expected: 403 for users, gauges of the process for admins
+        """
+        
+        user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.client.force_authenticate(user=user)
+        url = reverse('db_pool_stats')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        
+        user.is_admin = True
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['pid'], os.getpid())
+
+
+class TestMetrics(APITestCase):
+    """ Test request metrics and their export """
+    
+    def setUp(self):
+        """ Use temp folder for the metrics files """
+        
+        self.folder = tempfile.mkdtemp()
+        self.default_folder = metrics.registry.folder
+        metrics.registry.folder = self.folder
+        metrics.registry.reset()
+        
+    def tearDown(self):
+        """ Restore metrics folder """
+        metrics.registry.folder = self.default_folder
+        metrics.registry.reset()
+        shutil.rmtree(self.folder)
+        
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_middleware(self):
+        """ Send requests with all requests sampled
+            Expected: latency, size and queries recorded by view
+        """
+        
+        self.client.post(reverse('validate_token'))
+        self.client.post(reverse('token_obtain_pair'), {
+            "email": "missing@gmail.com",
+            "password": "12345678",
+        })
+        
+        counters = metrics.registry.counters
+        labels = (("view", "validate_token"), ("method", "POST"), ("status", "401"))
+        self.assertEqual(counters[("misojo_requests_total", labels)], 1)
+        
+        labels = (("view", "token_obtain_pair"), ("method", "POST"))
+        histograms = metrics.registry.histograms
+        self.assertEqual(histograms[("misojo_request_seconds", labels)]["count"], 1)
+        self.assertGreater(histograms[("misojo_response_bytes", labels)]["sum"], 0)
+        queries = histograms[("misojo_request_db_queries", labels)]
+        self.assertGreaterEqual(queries["sum"], 1)
+        
+    def test_processes(self):
+        """ Save metrics of two processes, one of them finished
+            Expected: counters and histograms summed, gauges of live
+            processes only, finished process merged in the aggregate file
+        """
+        
+        registry = MetricsRegistry(self.folder)
+        registry.inc("jobs_total", (("kind", "split"),), 2)
+        registry.observe("job_seconds", 0.2)
+        registry.set_gauge("jobs_running", 1)
+        registry.flush(force=True)
+        
+        # Finished process
+        finished_pid = 2 ** 22 + 1
+        with open(os.path.join(self.folder, f"metrics-{finished_pid}.json"), "w") as file:
+            file.write(
+                '{"pid": %d, "counters": [["jobs_total", [["kind", "split"]], 3]], '
+                '"histograms": [], "gauges": [["jobs_running", [], 5]]}' % finished_pid
+            )
+        
+        totals = registry.collect()
+        self.assertEqual(totals["counters"][("jobs_total", (("kind", "split"),))], 5)
+        self.assertEqual(totals["gauges"][("jobs_running", ())], 1)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.folder) if name.endswith(".json")),
+            sorted([registry.AGGREGATE_FILE, registry.file_name])
+        )
+        
+        # Merged only once
+        totals = registry.collect()
+        self.assertEqual(totals["counters"][("jobs_total", (("kind", "split"),))], 5)
+        
+        text = registry.render({"jobs_total": "Jobs run"})
+        self.assertIn("# HELP jobs_total Jobs run", text)
+        self.assertIn('jobs_total{kind="split"} 5', text)
+        self.assertIn('job_seconds_bucket{le="0.25"} 1', text)
+        self.assertIn('job_seconds_bucket{le="+Inf"} 1', text)
+        
+    def test_endpoint(self):
+        """ Get metrics with and without token
+            Expected: prometheus text, 401 without the token if it is set
+        """
+        
+        self.client.get(reverse('get_routes'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE misojo_request_seconds histogram", response.content)
+        self.assertIn(b'view="get_routes"', response.content)
+        
+        with override_settings(METRICS_TOKEN="secret", ENV="prod"):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION="Bearer other"
+            )
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION="Bearer secret"
+            )
+            self.assertEqual(response.status_code, 200)
+        
+        # Token required outside dev
+        with override_settings(METRICS_TOKEN="", ENV="prod"):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+    
+    def test_process_files(self):
+        """ Save metrics of two registries of the same pid (like a pid
+            reused by a new process)
+            Expected: one file by registry, counters of both exported
+        """
+        
+        registries = [MetricsRegistry(self.folder) for _ in range(2)]
+        for registry in registries:
+            registry.inc("jobs_total")
+            registry.flush(force=True)
+        
+        self.assertNotEqual(registries[0].file_name, registries[1].file_name)
+        totals = registries[0].collect()
+        self.assertEqual(totals["counters"][("jobs_total", ())], 2)
+
+
+class TestPipelineTracing(APITestCase):
+    """ Test spans of the pdf to audio pipeline stages """
+    
+    def setUp(self):
+        """ Use temp media folder and upload a pdf file """
+        
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            TEMP_FOLDER=self.media_root,
+        )
+        self.settings_override.enable()
+        
+        self.user = models.User.objects.create_user(
+            email="sample@gmail.com",
+            first_name='sample',
+            last_name='sample',
+            password='12345678'
+        )
+        self.file = models.File(user=self.user, name="sample")
+        self.file.path.save("sample.pdf", ContentFile(make_pdf(3)), save=True)
+        
+    def tearDown(self):
+        """ Remove temp media folder """
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        
+    def fake_generate_audio(self, text, lang, file_path, **kwargs):
+        """ Save fake audio file instead of calling tts engine """
+        with open(file_path, "wb") as audio_file:
+            audio_file.write(b"audio" * 100)
+        return file_path
+    
+    def test_split_spans(self):
+        """ Split pdf file in a job
+            Expected: download, split and save spans of the file (not one
+            by page), all with the same run id
+        """
+        
+        job = models.Job.objects.get(file=self.file)
+        self.assertTrue(jobs.run_job(job))
+        
+        spans = models.PipelineSpan.objects.filter(file=self.file)
+        for stage in ('download', 'split', 'save_pdf'):
+            self.assertEqual(
+                list(spans.filter(stage=stage).values_list('page_num', flat=True)),
+                [None]
+            )
+        self.assertFalse(spans.filter(failed=True).exists())
+        run_ids = set(spans.values_list('run_id', flat=True))
+        self.assertEqual(len(run_ids), 1)
+        self.assertEqual(len(run_ids.pop()), 16)
+        
+    def test_audio_spans(self):
+        """ Generate audio of two pages in jobs, the second with an error
+            Expected: text, tts and upload spans of the page, one run by
+            page, failed tts span saved
+        """
+        
+        self.file.split_pdf()
+        models.PipelineSpan.objects.all().delete()
+        pages = list(self.file.tracks.order_by('page_num'))
+        
+        # Text of the first page extracted again, second page fails
+        pages[0].text_compressed = None
+        pages[0].save()
+        pages[1].text = "other text"
+        pages[1].save()
+        calls = []
+        
+        def fake_generate_audio(text, lang, file_path, **kwargs):
+            calls.append(file_path)
+            if len(calls) == 2:
+                raise OSError("tts service unavailable")
+            return self.fake_generate_audio(text, lang, file_path)
+        
+        with patch(
+            "audio_generator.models.tts_generate_audio",
+            side_effect=fake_generate_audio
+        ), patch("audio_generator.models.get_lang_engine", return_value=GTTSEngine()):
+            for page in pages[:2]:
+                job = models.Job.enqueue(models.Job.GENERATE_AUDIO, page=page)
+                models.Job.objects.filter(id=job.id).update(attempts=1)
+                job.refresh_from_db()
+                jobs.run_job(job)
+        
+        spans = models.PipelineSpan.objects.filter(file=self.file)
+        first = spans.filter(page_num=1)
+        self.assertEqual(
+            sorted(first.values_list('stage', flat=True)),
+            ['download', 'extract_text', 'publish_chunks', 'tts', 'upload']
+        )
+        self.assertEqual(first.values('run_id').distinct().count(), 1)
+        
+        second = spans.filter(page_num=2)
+        self.assertTrue(second.get(stage='tts').failed)
+        self.assertFalse(second.filter(stage__in=['publish_chunks', 'upload']).exists())
+        self.assertNotEqual(first.first().run_id, second.first().run_id)
+        
+    def test_stats_view(self):
+        """ Get pipeline stats as normal user and as admin
+            Expected: 403 for users, p50/p95 by stage and slowest files
+            for admins
+        """
+        
+        # Spans of two files, the second file slower
+        slow_file = models.File.objects.create(
+            user=self.user, name="slow", pages_num=2
+        )
+        models.File.objects.filter(id=self.file.id).update(pages_num=3)
+        models.PipelineSpan.objects.bulk_create(
+            [
+                models.PipelineSpan(
+                    stage='tts', file=self.file, page_num=index, seconds=index
+                )
+                for index in range(1, 21)
+            ] + [
+                models.PipelineSpan(stage='tts', file=slow_file, page_num=1, seconds=300),
+                models.PipelineSpan(stage='upload', file=slow_file, page_num=1, seconds=1),
+                models.PipelineSpan(
+                    stage='upload', file=slow_file, page_num=1, seconds=50,
+                    started_at=timezone.now() - timedelta(days=30)
+                ),
+            ]
+        )
+        
+        self.client.force_authenticate(user=self.user)
+        url = reverse('pipeline_stats')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        
+        self.user.is_admin = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        
+        stages = {stage['stage']: stage for stage in data['stages']}
+        self.assertEqual(list(stages), ['tts', 'upload'])
+        self.assertEqual(stages['tts']['count'], 21)
+        self.assertEqual(stages['tts']['p50'], 11)
+        self.assertEqual(stages['tts']['p95'], 20)
+        self.assertEqual(stages['upload']['count'], 1)
+        self.assertEqual(stages['upload']['p95'], 1)
+        
+        slowest = data['slowest_files']
+        self.assertEqual([row['file_id'] for row in slowest], [slow_file.id, self.file.id])
+        self.assertEqual(slowest[0]['total_seconds'], 301)
+        self.assertEqual(slowest[0]['seconds_per_page'], 150.5)
+        self.assertEqual(slowest[0]['slowest_stage'], 'tts')
+        self.assertEqual(slowest[1]['total_seconds'], 210)
+        
+        # Invalid or out of range params
+        for params in (
+            {'days': 'x'}, {'days': 0}, {'days': 10 ** 9},
+            {'limit': -1}, {'limit': 101},
+        ):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['message'], 'API.STATUS.INVALID_PARAMS')
+        
+    def test_prune(self):
+        """ Prune old spans
+            Expected: only spans older than the retention days deleted
+        """
+        
+        models.PipelineSpan.objects.bulk_create([
+            models.PipelineSpan(
+                stage='tts', file=self.file, seconds=1,
+                started_at=timezone.now() - timedelta(days=days)
+            )
+            for days in (1, 40, 50)
+        ])
+        call_command('prune_spans', days=30, batch=1, stdout=io.StringIO())
+        self.assertEqual(models.PipelineSpan.objects.count(), 1)
@@ -0,0 +1,183 @@
+import uuid
+import logging
+import contextvars
+from datetime import timedelta
+from time import perf_counter
+from contextlib import contextmanager, ExitStack
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Run of the current thread: (run id, spans not saved yet)
+current_run = contextvars.ContextVar("current_run", default=None)
+
+
+def get_run_id() -> str:
+    """ Get correlation id of the current run
+
+    Returns:
+        str: run id (empty outside a run)
+    """
+    run = current_run.get()
+    return run[0] if run else ""
+
+
+def save_spans(spans: list):
+    """ Save spans in the database (errors logged, never raised: tracing
+    can not break the pipeline)
+
+    Args:
+        spans (list): PipelineSpan objects
+    """
+    if not spans:
+        return
+    PipelineSpan = apps.get_model("audio_generator", "PipelineSpan")
+    try:
+        PipelineSpan.objects.bulk_create(spans, batch_size=settings.TRACE_BATCH_SIZE)
+    except Exception as error:
+        logger.warning("spans not saved: %d spans, %r", len(spans), error)
+
+
+@contextmanager
+def trace_run(file_id: int, page_num: int = None):
+    """ Group the spans of a split or a page generation under one
+    correlation id, and save them together at the end
+
+    Args:
+        file_id (int): file processed
+        page_num (int, optional): page processed. Defaults to None.
+    """
+
+    # Nested runs are part of the outer run
+    if current_run.get():
+        yield get_run_id()
+        return
+
+    run_id = uuid.uuid4().hex[:16]
+    spans = []
+    token = current_run.set((run_id, spans))
+    logger.info("run started run=%s file=%s page=%s", run_id, file_id, page_num)
+    try:
+        yield run_id
+    finally:
+        current_run.reset(token)
+        save_spans(spans)
+
+
+def record_span(stage: str, seconds: float, file_id: int,
+                page_num: int = None, failed: bool = False):
+    """ Log a finished pipeline stage and save it (with the run spans,
+    or now if there is no run)
+
+    Args:
+        stage (str): stage name (one of PipelineSpan.STAGES)
+        seconds (float): stage duration
+        file_id (int): file processed
+        page_num (int, optional): page processed. Defaults to None.
+        failed (bool, optional): the stage raised an error. Defaults to False.
+    """
+
+    run_id = get_run_id()
+    logger.info(
+        "span stage=%s run=%s file=%s page=%s seconds=%.3f failed=%s",
+        stage, run_id, file_id, page_num, seconds, failed
+    )
+    if not settings.TRACE_SPANS:
+        return
+
+    PipelineSpan = apps.get_model("audio_generator", "PipelineSpan")
+    span = PipelineSpan(
+        stage=stage,
+        run_id=run_id,
+        file_id=file_id,
+        page_num=page_num,
+        started_at=timezone.now() - timedelta(seconds=seconds),
+        seconds=seconds,
+        failed=failed,
+    )
+
+    run = current_run.get()
+    if not run:
+        save_spans([span])
+        return
+    spans = run[1]
+    spans.append(span)
+    if len(spans) >= settings.TRACE_BATCH_SIZE:
+        save_spans(spans[:])
+        spans.clear()
+
+
+@contextmanager
+def pipeline_span(stage: str, file_id: int, page_num: int = None):
+    """ Measure a pipeline stage
+
+    Args:
+        stage (str): stage name (one of PipelineSpan.STAGES)
+        file_id (int): file processed
+        page_num (int, optional): page processed. Defaults to None.
+    """
+    start = perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record_span(stage, perf_counter() - start, file_id, page_num, failed)
+
+
+class SpanTimer:
+    """ Add up the time of many steps of a stage (like the chunks of a
+    page), saved as a single span """
+
+    def __init__(self, stage: str, file_id: int, page_num: int = None):
+        """ Setup timer
+
+        Args:
+            stage (str): stage name (one of PipelineSpan.STAGES)
+            file_id (int): file processed
+            page_num (int, optional): page processed. Defaults to None.
+        """
+        self.stage = stage
+        self.file_id = file_id
+        self.page_num = page_num
+        self.seconds = 0.0
+        self.steps = 0
+        self.failed = False
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds += perf_counter() - self.start
+        self.steps += 1
+        if exc_type:
+            self.failed = True
+
+    def record(self):
+        """ Save the span (if any step was measured) """
+        if self.steps:
+            record_span(
+                self.stage, self.seconds, self.file_id, self.page_num, self.failed
+            )
+
+
+@contextmanager
+def span_enter(context, stage: str, file_id: int, page_num: int = None):
+    """ Measure only the enter of a context manager (like the download
+    of open_local)
+
+    Args:
+        context (contextmanager): context to enter
+        stage (str): stage name (one of PipelineSpan.STAGES)
+        file_id (int): file processed
+        page_num (int, optional): page processed. Defaults to None.
+    """
+    with ExitStack() as stack:
+        with pipeline_span(stage, file_id, page_num):
+            value = stack.enter_context(context)
+        yield value
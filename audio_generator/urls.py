@@ -1,15 +1,26 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from audio_generator.views import UserViewSet, get_routes
+from audio_generator.views import UserViewSet, FileViewSet, PageViewSet, get_routes
+from audio_generator.views import UploadViewSet
 from .views import (
     CustomTokenObtainPairView,
     CustomTokenRefreshView,
-    ValidateToken
+    ValidateToken,
+    DatabasePoolStats,
+    PipelineStats,
+    PagePlaylist,
+    FileCurrentPage,
+    file_progress,
+    file_progress_stream,
+    page_audio_stream,
 )
 
 router = routers.DefaultRouter()
 router.register(r'users', UserViewSet, basename='users')
+router.register(r'files', FileViewSet, basename='files')
+router.register(r'pages', PageViewSet, basename='pages')
+router.register(r'uploads', UploadViewSet, basename='uploads')
 
 urlpatterns = [
     
@@ -17,10 +28,35 @@ urlpatterns = [
     path('', get_routes, name='get_routes'),
     path('', include(router.urls)),
     
+    # Async endpoints (I/O bound, served without holding a worker with asgi)
+    path('files/<int:pk>/progress/', file_progress, name='file_progress'),
+    path(
+        'files/<int:pk>/progress/stream/',
+        file_progress_stream,
+        name='file_progress_stream'
+    ),
+    path(
+        'pages/<int:pk>/stream/',
+        page_audio_stream,
+        name='page_audio_stream'
+    ),
+    
     # JWT endpoints
     path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
     
     # Custom endpoints
     path('validate-token/', ValidateToken.as_view(), name='validate_token'),
+    path('status/db-pool/', DatabasePoolStats.as_view(), name='db_pool_stats'),
+    path('status/pipeline/', PipelineStats.as_view(), name='pipeline_stats'),
+    path(
+        'files/<int:pk>/current-page/',
+        FileCurrentPage.as_view(),
+        name='file_current_page'
+    ),
+    path(
+        'pages/<int:pk>/playlist.m3u8',
+        PagePlaylist.as_view(),
+        name='page_playlist'
+    ),
 ]
@@ -1,9 +1,32 @@
-from .models import User
-from rest_framework import viewsets
+import os
+import json
+import math
+import asyncio
+from time import sleep, monotonic
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import User, File, Page, Upload, PipelineSpan
+from .pipeline import get_lang_engine
+from .pagination import FilePagination, PagePagination
+from .progress import get_cached_progress, poller
+from .authentication import CachedJWTAuthentication
+from rest_framework import mixins, status, viewsets
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from audio_generator.serializers import UserSerializer
+from audio_generator.serializers import FileSerializer, PageSerializer
+from audio_generator.serializers import UploadSerializer
+from libs.storage import spool_stream
+from misojo.db_pool.base import pool_stats
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import (
     CustomTokenObtainPairSerializer,
@@ -19,7 +42,22 @@ def get_routes(request):
         '/api/token/',
         '/api/token/refresh/',
         '/api/users/',
-        '/api/validate-token/'
+        '/api/validate-token/',
+        '/api/status/db-pool/',
+        '/api/status/pipeline/',
+        '/api/files/',
+        '/api/files/<id>/',
+        '/api/files/<id>/pages/',
+        '/api/files/<id>/progress/',
+        '/api/files/<id>/progress/stream/',
+        '/api/files/<id>/current-page/',
+        '/api/pages/<id>/',
+        '/api/uploads/',
+        '/api/uploads/<id>/',
+        '/api/uploads/<id>/chunk/',
+        '/api/uploads/<id>/complete/',
+        '/api/pages/<id>/stream/',
+        '/api/pages/<id>/playlist.m3u8',
     ]
     
     return Response(routes)
@@ -67,6 +105,8 @@ class UserViewSet(viewsets.ModelViewSet):
         
     
 class ValidateToken(APIView):
+    # Answered from the token claims (no user query)
+    authentication_classes = [JWTStatelessUserAuthentication]
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
@@ -75,4 +115,719 @@ class ValidateToken(APIView):
             'status': 'success',
             'message': 'Token is valid',
             'data': {}
-        })
\ No newline at end of file
+        })
+
+
+class DatabasePoolStats(APIView):
+    """ Connections pool gauges of the process serving the request (admins) """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        
+        if not request.user.is_admin:
+            raise PermissionDenied("API.ADMIN.REQUIRED")
+        
+        return Response({
+            'status': 'success',
+            'message': 'API.STATUS.DB_POOL',
+            'data': {
+                'pid': os.getpid(),
+                'pools': pool_stats(),
+            }
+        })
+
+
+class PipelineStats(APIView):
+    """ Time of the pdf to audio pipeline stages, and slowest files (admins) """
+    permission_classes = [IsAuthenticated]
+    max_days = 3650
+    max_limit = 100
+    
+    def get(self, request):
+        
+        if not request.user.is_admin:
+            raise PermissionDenied("API.ADMIN.REQUIRED")
+        
+        # Spans of the last days (query param "days"), slowest files
+        # (query param "limit")
+        params = {
+            "days": (settings.TRACE_STATS_DAYS, self.max_days),
+            "limit": (10, self.max_limit),
+        }
+        values = {}
+        for name, (default, max_value) in params.items():
+            try:
+                value = int(request.query_params.get(name, default))
+            except ValueError:
+                value = 0
+            if not 1 <= value <= max_value:
+                raise ValidationError({
+                    name: "API.STATUS.INVALID_PARAMS"
+                }, code='invalid_params')
+            values[name] = value
+        days, limit = values["days"], values["limit"]
+        since = timezone.now() - timedelta(days=days)
+        
+        return Response({
+            'status': 'success',
+            'message': 'API.STATUS.PIPELINE',
+            'data': {
+                'days': days,
+                'stages': PipelineSpan.stage_stats(since),
+                'slowest_files': PipelineSpan.slowest_files(since, limit),
+            }
+        })
+
+
+def get_user_file(request, pk: int) -> File:
+    """ Get file of the current user
+    
+    Args:
+        request (Request): request with authenticated user
+        pk (int): file id
+    
+    Returns:
+        File: file object
+    """
+    file = File.objects.filter(id=pk, user=request.user).first()
+    if not file:
+        raise NotFound("API.FILE.NOT_FOUND")
+    return file
+
+
+def get_user_page(request, pk: int) -> Page:
+    """ Get page of a file of the current user
+    
+    Args:
+        request (Request): request with authenticated user
+        pk (int): page id
+    
+    Returns:
+        Page: page object
+    """
+    page = Page.objects.filter(id=pk, file__user=request.user)
+    page = page.select_related('file').first()
+    if not page:
+        raise NotFound("API.PAGE.NOT_FOUND")
+    return page
+
+
+def get_pages_queryset():
+    """ Get pages with only the columns used by PageSerializer
+    (page text not loaded)
+    
+    Returns:
+        QuerySet: pages with their file language
+    """
+    return (
+        Page.objects
+        .select_related('file')
+        .only('id', 'page_num', 'path_pdf', 'path_audio', 'file__id', 'file__lang')
+    )
+
+
+class FileViewSet(viewsets.ReadOnlyModelViewSet):
+    """ Library of the current user, and the pages of each file
+    
+    Query budget (constant, plus 1 query to authenticate the user):
+        list: 1 query
+        retrieve: 1 query
+        pages: 2 queries (file owner and pages)
+        progress: 1 query by file every PROGRESS_CACHE_SECONDS
+    """
+    serializer_class = FileSerializer
+    pagination_class = FilePagination
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return (
+            File.objects
+            .filter(user=self.request.user)
+            .only(
+                'id', 'name', 'lang', 'status', 'pages_num', 'current_page',
+                'uploaded_at', 'last_read_at'
+            )
+            .annotate(
+                pages_ready=Count('tracks', filter=~Q(tracks__path_audio=''))
+            )
+        )
+    
+    def retrieve(self, request, pk=None):
+        
+        file = self.get_queryset().filter(id=pk).first()
+        if not file:
+            raise NotFound("API.FILE.NOT_FOUND")
+        
+        return Response({
+            'status': 'success',
+            'message': 'API.FILE.RETRIEVED',
+            'data': self.get_serializer(file).data
+        })
+    
+    @action(detail=True)
+    def pages(self, request, pk=None):
+        """ Pages of a file, in reading order """
+        
+        file = get_user_file(request, pk)
+        
+        paginator = PagePagination()
+        pages = paginator.paginate_queryset(
+            get_pages_queryset().filter(file=file),
+            request,
+            view=self
+        )
+        serializer = PageSerializer(pages, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class PageViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """ Page of a file of the current user
+    
+    Query budget (plus 1 query to authenticate the user):
+        retrieve: 1 query
+    """
+    serializer_class = PageSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return get_pages_queryset().filter(file__user=self.request.user)
+    
+    def retrieve(self, request, pk=None):
+        
+        page = self.get_queryset().filter(id=pk).first()
+        if not page:
+            raise NotFound("API.PAGE.NOT_FOUND")
+        
+        return Response({
+            'status': 'success',
+            'message': 'API.PAGE.RETRIEVED',
+            'data': self.get_serializer(page).data
+        })
+
+
+class UploadViewSet(viewsets.GenericViewSet):
+    """ Resumable upload of pdf files by chunks:
+    
+    1. POST uploads/ with name, lang and size: returns id and chunk_size
+    2. PUT uploads/<id>/chunk/ with each chunk as body, and headers
+       Upload-Offset (chunk position) and Upload-Checksum (sha256 hex).
+       All chunks have chunk_size bytes, except the last one
+    3. POST uploads/<id>/complete/: creates the file and queues its split
+    
+    To resume, GET uploads/<id>/ returns the offset of the next chunk
+    """
+    serializer_class = UploadSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return Upload.objects.filter(user=self.request.user)
+    
+    def get_upload(self, pk: int) -> Upload:
+        """ Get upload of the current user
+        
+        Args:
+            pk (int): upload id
+        
+        Returns:
+            Upload: upload object
+        """
+        upload = self.get_queryset().filter(id=pk).first()
+        if not upload:
+            raise NotFound("API.UPLOAD.NOT_FOUND")
+        return upload
+    
+    def upload_response(self, upload: Upload, message: str,
+                        status_code: int = status.HTTP_200_OK) -> Response:
+        """ Json response with upload data (and the offset to resume)
+        
+        Args:
+            upload (Upload): upload object
+            message (str): response message
+            status_code (int, optional): http status. Defaults to 200.
+        
+        Returns:
+            Response: api response
+        """
+        return Response({
+            'status': 'success' if status_code < 400 else 'error',
+            'message': message,
+            'data': self.get_serializer(upload).data
+        }, status=status_code)
+    
+    def create(self, request):
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save()
+        return self.upload_response(
+            upload,
+            'API.UPLOAD.CREATED',
+            status.HTTP_201_CREATED
+        )
+    
+    def retrieve(self, request, pk=None):
+        
+        return self.upload_response(self.get_upload(pk), 'API.UPLOAD.RETRIEVED')
+    
+    def destroy(self, request, pk=None):
+        
+        upload = self.get_upload(pk)
+        upload.abort()
+        return self.upload_response(upload, 'API.UPLOAD.ABORTED')
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        """ Save next chunk (body read in pieces, never all in memory) """
+        
+        upload = self.get_upload(pk)
+        
+        # Only the chunk at the current offset is accepted
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            offset = -1
+        if upload.status != Upload.UPLOADING or offset != upload.offset:
+            return self.upload_response(
+                upload,
+                'API.UPLOAD.INVALID_OFFSET',
+                status.HTTP_409_CONFLICT
+            )
+        
+        chunk_file, chunk_size, checksum = spool_stream(
+            request.stream,
+            upload.chunk_size,
+            settings.TEMP_FOLDER
+        )
+        with chunk_file:
+            
+            # Validate chunk size and content
+            if chunk_size != min(upload.chunk_size, upload.size - offset):
+                raise ValidationError({
+                    "chunk": "API.UPLOAD.INVALID_CHUNK"
+                }, code='invalid_chunk')
+            if checksum != request.headers.get('Upload-Checksum', '').lower():
+                raise ValidationError({
+                    "checksum": "API.UPLOAD.INVALID_CHECKSUM"
+                }, code='invalid_checksum')
+            
+            if not upload.write_chunk(offset, chunk_file, chunk_size):
+                upload.refresh_from_db()
+                return self.upload_response(
+                    upload,
+                    'API.UPLOAD.INVALID_OFFSET',
+                    status.HTTP_409_CONFLICT
+                )
+        
+        return self.upload_response(upload, 'API.UPLOAD.CHUNK_SAVED')
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """ Create file from the chunks saved """
+        
+        upload = self.get_upload(pk)
+        if not upload.complete():
+            raise ValidationError({
+                "offset": "API.UPLOAD.INCOMPLETE"
+            }, code='upload_incomplete')
+        
+        return self.upload_response(upload, 'API.UPLOAD.COMPLETED')
+
+
+def read_audio_part(page: Page, extension: str, next_chunk: int,
+                    sent_bytes: int) -> tuple:
+    """ Read the next part of a page audio: next chunk generated,
+    or the rest of the completed audio
+    
+    Args:
+        page (Page): page to stream
+        extension (str): audio extension
+        next_chunk (int): number of the next chunk
+        sent_bytes (int): bytes already sent
+    
+    Returns:
+        tuple:
+            bytes: audio content (None if the next part is not generated yet)
+            bool: True if the audio is completed
+    """
+    
+    page.refresh_from_db(fields=['path_audio', 'audio_chunks'])
+    
+    # Next chunk (chunks are removed a while after the page is completed)
+    storage = page.path_audio.storage
+    chunk_name = page.chunk_name(next_chunk, extension)
+    if next_chunk <= page.audio_chunks and storage.exists(chunk_name):
+        with storage.open(chunk_name, 'rb') as chunk_file:
+            return chunk_file.read(), False
+    
+    # Rest of the completed audio
+    if page.path_audio:
+        with page.path_audio.open('rb') as audio_file:
+            audio_file.seek(sent_bytes)
+            return audio_file.read(), True
+    
+    return None, False
+
+
+def stream_page_audio(page: Page):
+    """ Yield page audio: chunks already generated, then the new chunks
+    until the page is completed (or STREAM_TIMEOUT is reached)
+    
+    Args:
+        page (Page): page to stream
+    
+    Yields:
+        bytes: audio content
+    """
+    
+    extension = get_lang_engine(page.file.lang).extension
+    sent_bytes = 0
+    next_chunk = 1
+    deadline = monotonic() + settings.STREAM_TIMEOUT
+    while True:
+        content, completed = read_audio_part(page, extension, next_chunk, sent_bytes)
+        if content is not None:
+            sent_bytes += len(content)
+            next_chunk += 1
+            yield content
+        if completed:
+            return
+        if content is None:
+            if monotonic() > deadline:
+                return
+            sleep(settings.STREAM_POLL_SECONDS)
+
+
+async def astream_page_audio(page: Page):
+    """ Async version of stream_page_audio (asgi): waits between
+    polls in the event loop, without holding a thread
+    
+    Args:
+        page (Page): page to stream
+    
+    Yields:
+        bytes: audio content
+    """
+    
+    extension = get_lang_engine(page.file.lang).extension
+    sent_bytes = 0
+    next_chunk = 1
+    deadline = monotonic() + settings.STREAM_TIMEOUT
+    while True:
+        content, completed = await sync_to_async(read_audio_part)(
+            page, extension, next_chunk, sent_bytes
+        )
+        if content is not None:
+            sent_bytes += len(content)
+            next_chunk += 1
+            yield content
+        if completed:
+            return
+        if content is None:
+            if monotonic() > deadline:
+                return
+            await asyncio.sleep(settings.STREAM_POLL_SECONDS)
+
+
+def json_error(message: str, status: int) -> JsonResponse:
+    """ Error response of the views without rest framework
+    
+    Args:
+        message (str): error message
+        status (int): http status
+    
+    Returns:
+        JsonResponse: error response
+    """
+    return JsonResponse({
+        'status': 'error',
+        'message': message,
+        'data': {}
+    }, status=status)
+
+
+async def authenticate_async(request) -> JsonResponse:
+    """ Set request.user from the access token (see authenticate_token)
+    
+    Args:
+        request (HttpRequest): django request
+    
+    Returns:
+        JsonResponse: 401 error response, None if the user is authenticated
+    """
+    try:
+        request.user = await sync_to_async(authenticate_token)(request)
+    except AuthenticationFailed as error:
+        detail = error.detail
+        if isinstance(detail, dict):
+            detail = detail.get('detail', '')
+        return json_error(str(detail), 401)
+    return None
+
+
+def open_page_stream(request, pk: int) -> tuple:
+    """ Get page of the current user, and queue its audio if needed
+    
+    Args:
+        request (HttpRequest): request with authenticated user
+        pk (int): page id
+    
+    Returns:
+        tuple:
+            Page: page object
+            str: audio content type
+    """
+    page = get_user_page(request, pk)
+    page.request_audio()
+    extension = get_lang_engine(page.file.lang).extension
+    content_type = "audio/mpeg" if extension == "mp3" else f"audio/{extension}"
+    return page, content_type
+
+
+async def page_audio_stream(request, pk: int):
+    """ Audio of a page, streamed while it is generated (async with
+    asgi: clients waiting for new chunks do not hold a worker) """
+    
+    error_response = await authenticate_async(request)
+    if error_response:
+        return error_response
+    
+    try:
+        page, content_type = await sync_to_async(open_page_stream)(request, pk)
+    except NotFound as error:
+        return json_error(str(error.detail), 404)
+    
+    if isinstance(request, ASGIRequest):
+        audio = astream_page_audio(page)
+    else:
+        audio = stream_page_audio(page)
+    return StreamingHttpResponse(audio, content_type=content_type)
+
+
+class PagePlaylist(APIView):
+    """ HLS playlist with the audio chunks generated of a page, only for
+        streamable engines (constant bitrate mp3, so segment durations can be
+        computed from their sizes)
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk):
+        
+        page = get_user_page(request, pk)
+        engine = get_lang_engine(page.file.lang)
+        if not engine.streamable or not engine.bitrate:
+            raise NotFound("API.PAGE.PLAYLIST_UNAVAILABLE")
+        page.request_audio()
+        bitrate = engine.bitrate
+        
+        # Chunks generated so far, kept after the page is completed (players
+        # already playing them get the same segments, and the end list),
+        # else the full audio as a single segment
+        storage = page.path_audio.storage
+        segments = []
+        for index in range(1, page.audio_chunks + 1):
+            chunk_name = page.chunk_name(index, engine.extension)
+            sizes = page.audio_chunk_sizes
+            size = sizes[index - 1] if index <= len(sizes) else storage.size(chunk_name)
+            segments.append((storage.url(chunk_name), size))
+        if not segments and page.path_audio:
+            segments = [(page.path_audio.url, page.path_audio.size)]
+        
+        durations = [size * 8 / bitrate for _, size in segments]
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=1))}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for (url, _), duration in zip(segments, durations):
+            lines += [f"#EXTINF:{duration:.3f},", request.build_absolute_uri(url)]
+        if page.path_audio:
+            lines.append("#EXT-X-ENDLIST")
+        
+        return HttpResponse(
+            "\n".join(lines) + "\n",
+            content_type="application/vnd.apple.mpegurl"
+        )
+
+
+class FileCurrentPage(APIView):
+    """ Save reader position in a file """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, pk):
+        
+        file = get_user_file(request, pk)
+        
+        # Validate page number
+        try:
+            page_num = int(request.data.get('page', ''))
+        except (TypeError, ValueError):
+            page_num = 0
+        if page_num < 1 or page_num > max(file.pages_num, 1):
+            raise ValidationError({
+                "page": "API.FILE.INVALID_PAGE"
+            }, code='invalid_page')
+        
+        audio_ready = file.read_page(page_num)
+        
+        return Response({
+            'status': 'success',
+            'message': 'API.FILE.PAGE_UPDATED',
+            'data': {
+                'page': page_num,
+                'audio_ready': audio_ready,
+            }
+        })
+
+
+def authenticate_token(request) -> User:
+    """ Get user of the access token of a request, from the Authorization
+    header or the "token" query param (EventSource can not send headers)
+    
+    Args:
+        request (HttpRequest): django request
+    
+    Raises:
+        AuthenticationFailed: missing or invalid token
+    
+    Returns:
+        User: token user
+    """
+    authentication = CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    raw_token = raw_token or request.GET.get('token')
+    if not raw_token:
+        raise AuthenticationFailed("Authentication credentials were not provided.")
+    return authentication.get_user(authentication.get_validated_token(raw_token))
+
+
+def format_event(progress: dict) -> bytes:
+    """ Format progress as a server sent event
+    
+    Args:
+        progress (dict): file progress
+    
+    Returns:
+        bytes: event message
+    """
+    return f"event: progress\ndata: {json.dumps(progress)}\n\n".encode()
+
+
+def progress_events(file_id: int, progress: dict):
+    """ Yield progress events of a file until it is done (or
+    PROGRESS_STREAM_TIMEOUT is reached, clients reconnect), with
+    keepalive comments while nothing changes
+    
+    Args:
+        file_id (int): file id
+        progress (dict): current progress
+    
+    Yields:
+        bytes: server sent events
+    """
+    
+    yield b"retry: 3000\n" + format_event(progress)
+    if progress['done']:
+        return
+    
+    deadline = monotonic() + settings.PROGRESS_STREAM_TIMEOUT
+    keepalive_at = monotonic() + settings.PROGRESS_KEEPALIVE_SECONDS
+    while monotonic() < deadline:
+        sleep(settings.PROGRESS_POLL_SECONDS)
+        _, new_progress = get_cached_progress(file_id)
+        if new_progress is None:
+            return
+        
+        if new_progress != progress:
+            progress = new_progress
+            keepalive_at = monotonic() + settings.PROGRESS_KEEPALIVE_SECONDS
+            yield format_event(progress)
+            if progress['done']:
+                return
+        elif monotonic() >= keepalive_at:
+            keepalive_at = monotonic() + settings.PROGRESS_KEEPALIVE_SECONDS
+            yield b": keepalive\n\n"
+
+
+async def aprogress_events(file_id: int, progress: dict):
+    """ Async version of progress_events (asgi): waits for the changes
+    sent by the shared poller, without holding a thread
+    
+    Args:
+        file_id (int): file id
+        progress (dict): current progress
+    
+    Yields:
+        bytes: server sent events
+    """
+    
+    yield b"retry: 3000\n" + format_event(progress)
+    if progress['done']:
+        return
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.PROGRESS_STREAM_TIMEOUT
+    queue = poller.subscribe(file_id)
+    try:
+        while True:
+            timeout = min(settings.PROGRESS_KEEPALIVE_SECONDS, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                new_progress = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            
+            if new_progress == progress:
+                continue
+            progress = new_progress
+            yield format_event(progress)
+            if progress['done']:
+                return
+    finally:
+        poller.unsubscribe(file_id, queue)
+
+
+async def file_progress(request, pk: int):
+    """ Split and audio progress of a file (cached, cheap to poll) """
+    
+    error_response = await authenticate_async(request)
+    if error_response:
+        return error_response
+    
+    owner_id, progress = await sync_to_async(get_cached_progress)(pk)
+    if owner_id != request.user.id:
+        return json_error('API.FILE.NOT_FOUND', 404)
+    
+    response = JsonResponse({
+        'status': 'success',
+        'message': 'API.FILE.PROGRESS',
+        'data': progress
+    })
+    response['Cache-Control'] = f"private, max-age={settings.PROGRESS_CACHE_SECONDS}"
+    return response
+
+
+async def file_progress_stream(request, pk: int):
+    """ Server sent events with the progress of a file (serve with asgi:
+    idle clients only wait in the event loop, sharing a single poller;
+    with wsgi each client polls and holds a worker) """
+    
+    error_response = await authenticate_async(request)
+    if error_response:
+        return error_response
+    
+    owner_id, progress = await sync_to_async(get_cached_progress)(pk)
+    if owner_id != request.user.id:
+        return json_error('API.FILE.NOT_FOUND', 404)
+    
+    if isinstance(request, ASGIRequest):
+        events = aprogress_events(pk, progress)
+    else:
+        events = progress_events(pk, progress)
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,204 @@
+# Add parent folder to path
+import os
+import sys
+import signal
+import argparse
+import statistics
+import subprocess
+import http.client
+import threading
+from time import perf_counter, sleep
+from urllib.parse import urlsplit
+
+# Setup parent folder and django
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "misojo.settings")
+
+import django
+django.setup()
+
+from rest_framework_simplejwt.tokens import AccessToken
+from audio_generator.models import User, File, Page
+
+
+def create_sample(email: str) -> tuple:
+    """ Create user with a file and a page without audio (its audio
+    stream waits for new chunks until STREAM_TIMEOUT)
+
+    Args:
+        email (str): user email
+
+    Returns:
+        tuple:
+            User: user created
+            File: file of the user
+            Page: page of the file
+    """
+    User.objects.filter(email=email).delete()
+    user = User.objects.create_user(
+        email=email,
+        first_name="load",
+        last_name="test",
+        password="load-test-password",
+    )
+    user.is_active = True
+    user.save()
+    file = File.objects.create(user=user, name="load test", pages_num=1)
+    page = Page.objects.create(file=file, page_num=1)
+    return user, file, page
+
+
+def request(base_url: str, path: str, token: str) -> tuple:
+    """ Send GET request and read the whole response
+
+    Args:
+        base_url (str): server url
+        path (str): request path
+        token (str): access token
+
+    Returns:
+        tuple:
+            int: response status (0 if the request failed)
+            float: seconds until the response was read
+    """
+    url = urlsplit(base_url)
+    start = perf_counter()
+    try:
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=300)
+        connection.request("GET", path, headers={"Authorization": f"Bearer {token}"})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+    return status, perf_counter() - start
+
+
+def run_load(base_url: str, path: str, token: str, clients: int,
+             duration: float, streams: int, stream_path: str) -> dict:
+    """ Request a path from many clients, while other clients keep
+    audio streams open
+
+    Args:
+        base_url (str): server url
+        path (str): path requested by the clients
+        token (str): access token
+        clients (int): concurrent clients requesting the path
+        duration (float): seconds of load
+        streams (int): open audio streams during the load
+        stream_path (str): path of the audio stream
+
+    Returns:
+        dict:
+            requests (int): requests completed
+            errors (int): requests failed
+            rps (float): requests completed per second
+            p50 (float): median latency (ms)
+            p99 (float): 99th percentile latency (ms)
+    """
+
+    for _ in range(streams):
+        threading.Thread(
+            target=request, args=(base_url, stream_path, token), daemon=True
+        ).start()
+    sleep(1)
+
+    results = []
+    lock = threading.Lock()
+    deadline = perf_counter() + duration
+
+    def client():
+        while perf_counter() < deadline:
+            result = request(base_url, path, token)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    times = [seconds for status, seconds in results if status == 200]
+    percentiles = statistics.quantiles(times, n=100) if len(times) > 1 else [0] * 99
+    return {
+        "requests": len(times),
+        "errors": len(results) - len(times),
+        "rps": len(times) / duration,
+        "p50": percentiles[49] * 1000,
+        "p99": percentiles[98] * 1000,
+    }
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    """ Start gunicorn with gunicorn.conf.py in a server mode
+
+    Args:
+        mode (str): "wsgi" or "asgi"
+        port (int): port to listen
+        workers (int): number of workers
+
+    Returns:
+        subprocess.Popen: server process
+    """
+    env = dict(os.environ, SERVER_MODE=mode, WEB_CONCURRENCY=str(workers))
+    server = subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+         "--timeout", "300", "--log-level", "warning"],
+        cwd=PARENT_FOLDER,
+        env=env,
+        start_new_session=True,
+    )
+    sleep(5)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the progress endpoint while audio streams are "
+                    "open, with gunicorn in wsgi and asgi modes"
+    )
+    parser.add_argument("--modes", type=str, default="wsgi,asgi",
+                        help="Server modes to compare (comma separated)")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="Port of the test server")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Gunicorn workers")
+    parser.add_argument("--clients", type=int, default=20,
+                        help="Concurrent clients polling progress")
+    parser.add_argument("--streams", type=int, default=2,
+                        help="Audio streams open during the load")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds of load in each mode")
+    args = parser.parse_args()
+
+    # Sample data in the configured database
+    email = "load-test@misojo.local"
+    user, file, page = create_sample(email)
+    token = str(AccessToken.for_user(user))
+    path = f"/api/files/{file.id}/progress/"
+    stream_path = f"/api/pages/{page.id}/stream/"
+
+    print(f"{'mode':<6} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for mode in args.modes.split(","):
+            server = start_server(mode, args.port, args.workers)
+            try:
+                stats = run_load(
+                    f"http://127.0.0.1:{args.port}", path, token, args.clients,
+                    args.duration, args.streams, stream_path,
+                )
+            finally:
+                os.killpg(server.pid, signal.SIGTERM)
+                server.wait()
+            print(f"{mode:<6} {stats['requests']:>9} {stats['errors']:>7} "
+                  f"{stats['rps']:>8.1f} {stats['p50']:>8.1f} {stats['p99']:>8.1f}")
+    finally:
+        User.objects.filter(email=email).delete()
+
+
+if __name__ == "__main__":
+    main()
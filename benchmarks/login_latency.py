@@ -0,0 +1,109 @@
+# Add parent folder to path
+import os
+import sys
+import argparse
+import statistics
+from time import perf_counter
+
+# Setup parent folder and django
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "misojo.settings")
+
+import django
+django.setup()
+
+from django.db import connection
+from django.contrib.auth.models import update_last_login
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from audio_generator.authentication import save_last_logins
+from audio_generator.models import User
+from audio_generator.serializers import CustomTokenObtainPairSerializer
+from audio_generator.views import CustomTokenObtainPairView
+
+
+class LegacyTokenObtainPairSerializer(CustomTokenObtainPairSerializer):
+    """ Previous login flow: password checked, then authenticated again
+    by simplejwt (second hash), and last login saved before the response """
+
+    def validate(self, attrs):
+        user = User.objects.filter(email=attrs['email']).first()
+        if not user or not user.check_password(attrs['password']):
+            raise ValueError("invalid credentials")
+        data = TokenObtainPairSerializer.validate(self, attrs)
+        update_last_login(None, self.user)
+        data['user_id'] = user.id
+        return {"status": "success", "message": "API.TOKEN.GENERATED",
+                "data": data}
+
+
+class LegacyTokenObtainPairView(CustomTokenObtainPairView):
+    serializer_class = LegacyTokenObtainPairSerializer
+
+
+def bench_login(view, data: dict, runs: int) -> list:
+    """ Request tokens and measure time until the response is ready
+
+    Args:
+        view (function): token view
+        data (dict): login credentials
+        runs (int): number of requests
+
+    Returns:
+        list: seconds of each request
+    """
+
+    factory = APIRequestFactory()
+    times = []
+    for _ in range(runs):
+        request = factory.post("/api/token/", data, format="json")
+        start = perf_counter()
+        response = view(request)
+        times.append(perf_counter() - start)
+        assert response.status_code == 200, response.data
+
+        # Deferred last login (out of the response time)
+        save_last_logins(sender=None)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure token issuance latency, before and after "
+                    "the single hash login flow (uses a test database)"
+    )
+    parser.add_argument("--runs", type=int, default=50,
+                        help="Number of logins per flow")
+    args = parser.parse_args()
+
+    # Temporary database with a single active user
+    test_db = connection.creation.create_test_db(verbosity=0)
+    try:
+        password = "benchmark-password"
+        user = User.objects.create_user(
+            email="benchmark@gmail.com",
+            first_name="benchmark",
+            last_name="benchmark",
+            password=password,
+        )
+        user.is_active = True
+        user.save()
+        data = {"email": user.email, "password": password}
+
+        flows = {
+            "before": LegacyTokenObtainPairView.as_view(),
+            "after": CustomTokenObtainPairView.as_view(),
+        }
+        print(f"{'flow':<8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, view in flows.items():
+            times = bench_login(view, data, args.runs)
+            percentiles = statistics.quantiles(times, n=100)
+            print(f"{name:<8} {percentiles[49] * 1000:>8.1f} "
+                  f"{percentiles[98] * 1000:>8.1f}")
+    finally:
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Add parent folder to path
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import statistics
+from time import perf_counter
+
+# Setup parent folder and django
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "misojo.settings")
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import resolve
+from audio_generator.metrics import MetricsMiddleware, registry
+from audio_generator.models import User
+
+
+def bench_middleware(runs: int) -> list:
+    """ Measure time added by the metrics middleware alone (the view
+    returns a prepared response)
+
+    Args:
+        runs (int): number of requests
+
+    Returns:
+        list: seconds added to each request
+    """
+    request = RequestFactory().post("/api/token/")
+    request.resolver_match = resolve("/api/token/")
+    response = HttpResponse(b"x" * 600, content_type="application/json")
+    middleware = MetricsMiddleware(lambda request: response)
+
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        middleware(request)
+        times.append(perf_counter() - start)
+    return times
+
+
+def bench_login(runs: int) -> list:
+    """ Log in with the django test client and measure time
+
+    Args:
+        runs (int): number of requests
+
+    Returns:
+        list: seconds of each request
+    """
+    client = Client()
+    data = {"email": "benchmark@gmail.com", "password": "benchmark-password"}
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        response = client.post("/api/token/", data)
+        times.append(perf_counter() - start)
+        assert response.status_code == 200, response.content
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure latency added by the metrics middleware to "
+                    "/api/token/ (uses a test database and metrics folder)"
+    )
+    parser.add_argument("--runs", type=int, default=50,
+                        help="Login requests")
+    parser.add_argument("--middleware-runs", type=int, default=100000,
+                        help="Requests through the middleware alone")
+    args = parser.parse_args()
+
+    # Temporary database with a single active user, temporary metrics files
+    test_db = connection.creation.create_test_db(verbosity=0)
+    registry.folder = tempfile.mkdtemp()
+    try:
+        user = User.objects.create_user(
+            email="benchmark@gmail.com",
+            first_name="benchmark",
+            last_name="benchmark",
+            password="benchmark-password",
+        )
+        user.is_active = True
+        user.save()
+
+        print(f"sample rate: {settings.METRICS_SAMPLE_RATE}")
+        for sample_rate in (0, 1):
+            with override_settings(METRICS_SAMPLE_RATE=sample_rate):
+                times = bench_middleware(args.middleware_runs)
+            print(f"middleware (sampled={sample_rate}): "
+                  f"mean {statistics.mean(times) * 1e6:.1f} us, "
+                  f"p50 {statistics.median(times) * 1e6:.1f} us")
+
+        middleware_seconds = statistics.mean(times)
+        login_times = bench_login(args.runs)
+        login_seconds = statistics.median(login_times)
+        print(f"/api/token/ p50: {login_seconds * 1000:.1f} ms "
+              f"(middleware worst case {middleware_seconds / login_seconds:.4%})")
+    finally:
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+        shutil.rmtree(registry.folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
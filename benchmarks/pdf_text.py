@@ -0,0 +1,117 @@
+# Add parent folder to path
+import os
+import sys
+import difflib
+import argparse
+import tracemalloc
+from time import perf_counter
+
+# Setup parent folder
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+
+from libs.pdf import EXTRACTORS, split_pdf
+
+
+def load_corpus(folder: str) -> list:
+    """ Split the pdf files of a folder in single page pdf files
+
+    Args:
+        folder (str): folder with pdf files, and optionally a .txt file
+            with the expected text of each pdf (same name)
+
+    Returns:
+        list: tuples (pages pdf content, expected text or None)
+    """
+
+    corpus = []
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith(".pdf"):
+            continue
+        with open(os.path.join(folder, file_name), "rb") as pdf_file:
+            pages = [page_pdf for _, page_pdf, _ in split_pdf(pdf_file)]
+
+        expected = None
+        text_path = os.path.join(folder, file_name.replace(".pdf", ".txt"))
+        if os.path.exists(text_path):
+            with open(text_path, encoding="utf-8") as text_file:
+                expected = text_file.read()
+        corpus.append((pages, expected))
+    return corpus
+
+
+def words_quality(text: str) -> float:
+    """ Get share of tokens that look like words (broken spacing joins
+    words in long tokens, or splits them in single letters)
+
+    Args:
+        text (str): extracted text
+
+    Returns:
+        float: words / tokens
+    """
+    tokens = text.split()
+    if not tokens:
+        return 0
+    words = [token for token in tokens if 2 <= len(token.strip(".,;:!?()")) <= 20]
+    return len(words) / len(tokens)
+
+
+def bench_engine(extractor, corpus: list) -> dict:
+    """ Extract text of all corpus pages with an engine
+
+    Args:
+        extractor (TextExtractor): engine to test
+        corpus (list): corpus loaded with load_corpus
+
+    Returns:
+        dict: speed, memory and quality of the engine
+    """
+
+    pages_num = 0
+    chars = 0
+    quality = []
+    similarity = []
+    tracemalloc.start()
+    start = perf_counter()
+    for pages, expected in corpus:
+        text = "\n".join(extractor.extract(page_pdf) for page_pdf in pages)
+        pages_num += len(pages)
+        chars += len(text)
+        quality.append(words_quality(text))
+        if expected is not None:
+            matcher = difflib.SequenceMatcher(None, text.split(), expected.split())
+            similarity.append(matcher.ratio())
+    seconds = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pages_per_second": pages_num / seconds if seconds else 0,
+        "peak_mb": peak / 1024 ** 2,
+        "chars": chars,
+        "words_quality": sum(quality) / len(quality) if quality else 0,
+        "similarity": sum(similarity) / len(similarity) if similarity else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare pdf text engines")
+    parser.add_argument("corpus", help="folder with pdf (and .txt) files")
+    parser.add_argument("--engines", nargs="+", default=list(EXTRACTORS))
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(f"{'engine':>9} {'pages/s':>9} {'peak MB':>8} {'chars':>9} "
+          f"{'words':>6} {'similar':>8}")
+    for name in args.engines:
+        extractor = EXTRACTORS[name]()
+        if not extractor.is_available():
+            print(f"{name:>9} not installed ({extractor.module})")
+            continue
+        stats = bench_engine(extractor, corpus)
+        similarity = stats["similarity"]
+        similarity = f"{similarity:.2f}" if similarity is not None else "-"
+        print(f"{name:>9} {stats['pages_per_second']:>9.1f} "
+              f"{stats['peak_mb']:>8.1f} {stats['chars']:>9} "
+              f"{stats['words_quality']:>6.2f} {similarity:>8}")
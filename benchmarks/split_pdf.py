@@ -0,0 +1,84 @@
+# Add parent folder to path
+import io
+import os
+import sys
+import argparse
+import tempfile
+from time import perf_counter
+import PyPDF2
+
+# Setup parent folder
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+
+from libs.pdf import split_pdf
+from libs.sandbox import SandboxPool
+
+
+def make_pdf(pages_num: int) -> bytes:
+    """ Create a sample pdf file in memory
+
+    Args:
+        pages_num (int): number of pages
+
+    Returns:
+        bytes: pdf content
+    """
+
+    pdf_writer = PyPDF2.PdfWriter()
+    for _ in range(pages_num):
+        pdf_writer.add_blank_page(612, 792)
+    pdf_buffer = io.BytesIO()
+    pdf_writer.write(pdf_buffer)
+    return pdf_buffer.getvalue()
+
+
+def bench_split(pdf_path: str, workers: int, pages_per_task: int) -> tuple:
+    """ Split pdf file in memory and measure time
+
+    Args:
+        pdf_path (str): path to pdf file
+        workers (int): sandbox pool processes (0 to split in this process)
+        pages_per_task (int): min pages splitted by each pool task
+
+    Returns:
+        tuple:
+            int: pages splitted
+            float: seconds
+    """
+
+    start = perf_counter()
+    pages_num = 0
+    with SandboxPool(workers) as pool, open(pdf_path, "rb") as pdf_file:
+        for _ in split_pdf(
+            pdf_file,
+            pool=pool if workers else None,
+            pages_per_task=pages_per_task
+        ):
+            pages_num += 1
+    return pages_num, perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF split throughput")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--pages-per-task", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'pages':>8} {'workers':>8} {'seconds':>10} {'pages/s':>10} {'speedup':>8}")
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            pdf_file.write(make_pdf(size))
+            pdf_file.flush()
+
+            base_seconds = None
+            for workers in args.workers:
+                pages_num, seconds = bench_split(
+                    pdf_file.name,
+                    workers,
+                    args.pages_per_task
+                )
+                base_seconds = base_seconds or seconds
+                print(f"{pages_num:>8} {workers:>8} {seconds:>10.3f} "
+                      f"{pages_num / seconds:>10.1f} {base_seconds / seconds:>8.2f}")
@@ -0,0 +1,140 @@
+# Add parent folder to path
+import os
+import sys
+import uuid
+import argparse
+import statistics
+from datetime import timedelta
+from time import perf_counter
+
+# Setup parent folder and django
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "misojo.settings")
+
+import django
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+from audio_generator.blacklist import blacklist_filter
+from audio_generator.models import User
+from audio_generator.views import CustomTokenRefreshView
+
+
+class PlainTokenRefreshSerializer(TokenRefreshSerializer):
+    """ Refresh without the blacklist filter (database lookup only) """
+
+    def validate(self, attrs):
+        return {"status": "success", "message": "", "data": super().validate(attrs)}
+
+
+class PlainTokenRefreshView(CustomTokenRefreshView):
+    serializer_class = PlainTokenRefreshSerializer
+
+
+def fill_blacklist(user: User, rows: int, batch: int = 5000):
+    """ Add blacklisted tokens (half of them expired)
+
+    Args:
+        user (User): tokens owner
+        rows (int): tokens to add
+        batch (int, optional): rows inserted at a time. Defaults to 5000.
+    """
+    now = timezone.now()
+    for start in range(0, rows, batch):
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(
+                user=user,
+                jti=uuid.uuid4().hex,
+                token="",
+                created_at=now,
+                expires_at=now + timedelta(days=1 if index % 2 else -1),
+            )
+            for index in range(start, min(start + batch, rows))
+        ])
+        BlacklistedToken.objects.bulk_create([
+            BlacklistedToken(token=token) for token in tokens
+        ])
+
+
+def bench_refresh(view, user: User, runs: int) -> list:
+    """ Refresh new tokens and measure time
+
+    Args:
+        view (function): refresh view
+        user (User): tokens owner
+        runs (int): number of refreshes
+
+    Returns:
+        list: seconds of each refresh
+    """
+    factory = APIRequestFactory()
+    times = []
+    for _ in range(runs):
+        refresh = str(RefreshToken.for_user(user))
+        request = factory.post("/api/token/refresh/", {"refresh": refresh},
+                               format="json")
+        start = perf_counter()
+        response = view(request)
+        times.append(perf_counter() - start)
+        assert response.status_code == 200, response.data
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure token refresh latency as the blacklist grows, "
+                    "with and without the in memory filter (uses a test database)"
+    )
+    parser.add_argument("--sizes", type=str, default="0,10000,100000,1000000",
+                        help="Blacklisted tokens in each step (comma separated)")
+    parser.add_argument("--runs", type=int, default=100,
+                        help="Refreshes per step and flow")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    # Temporary database with a single active user
+    test_db = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(
+            email="benchmark@gmail.com",
+            first_name="benchmark",
+            last_name="benchmark",
+            password="benchmark-password",
+        )
+        user.is_active = True
+        user.save()
+
+        flows = {
+            "database": PlainTokenRefreshView.as_view(),
+            "filter": CustomTokenRefreshView.as_view(),
+        }
+        print(f"{'rows':>9} {'flow':<9} {'p50 ms':>8} {'p99 ms':>8}")
+        rows = 0
+        for size in sizes:
+            fill_blacklist(user, size - rows)
+            rows = size
+
+            # Filter loaded by each process once
+            blacklist_filter.reset()
+            blacklist_filter.rebuild()
+
+            for name, view in flows.items():
+                times = bench_refresh(view, user, args.runs)
+                percentiles = statistics.quantiles(times, n=100)
+                print(f"{rows:>9} {name:<9} {percentiles[49] * 1000:>8.2f} "
+                      f"{percentiles[98] * 1000:>8.2f}")
+    finally:
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
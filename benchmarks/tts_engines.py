@@ -0,0 +1,82 @@
+# Add parent folder to path
+import os
+import sys
+import argparse
+import resource
+import tempfile
+from time import perf_counter
+
+# Setup parent folder
+PARENT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PARENT_FOLDER)
+
+from libs.audio import ENGINES, generate_audio
+
+SAMPLE_TEXTS = {
+    "en": "The quick brown fox jumps over the lazy dog. " * 10,
+    "es": "El veloz murciélago hindú comía feliz cardillo y kiwi. " * 10,
+}
+
+
+def cpu_seconds() -> float:
+    """ Get cpu time used by this process and its subprocesses
+
+    Returns:
+        float: cpu seconds (user + system)
+    """
+    total = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def bench_engine(engine, lang: str, runs: int, folder: str) -> dict:
+    """ Generate the sample text many times with an engine
+
+    Args:
+        engine (TTSEngine): engine to test
+        lang (str): language of the sample text
+        runs (int): number of audios to generate
+        folder (str): folder to save the audios
+
+    Returns:
+        dict: latency and audio seconds per cpu second
+    """
+
+    latencies = []
+    audio_seconds = 0
+    cpu_start = cpu_seconds()
+    for run in range(runs):
+        file_path = os.path.join(folder, f"{engine.name}-{run}.{engine.extension}")
+        start = perf_counter()
+        generate_audio(SAMPLE_TEXTS[lang], lang, file_path, engine=engine)
+        latencies.append(perf_counter() - start)
+        audio_seconds += engine.duration(file_path)
+    cpu_used = cpu_seconds() - cpu_start
+
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "max": latencies[-1],
+        "audio_per_cpu": audio_seconds / cpu_used if cpu_used else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare tts engines")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES))
+    parser.add_argument("--lang", default="en", choices=SAMPLE_TEXTS.keys())
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'engine':>8} {'p50 (s)':>10} {'max (s)':>10} {'audio s/cpu s':>14}")
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.engines:
+            engine = ENGINES[name]()
+            if not engine.is_available():
+                print(f"{name:>8} not available in this host")
+                continue
+            stats = bench_engine(engine, args.lang, args.runs, folder)
+            print(f"{name:>8} {stats['p50']:>10.3f} {stats['max']:>10.3f} "
+                  f"{stats['audio_per_cpu']:>14.1f}")
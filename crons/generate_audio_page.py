@@ -1,8 +1,9 @@
-
 # Add parent folder to path
 import os
 import sys
+import argparse
 import django
+from time import sleep, monotonic
 
 # Setup parent folder
 parent_folder = os.path.dirname(os.path.dirname(__file__))
@@ -14,19 +15,61 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'misojo.settings')
 django.setup()
 
 # Django imports
+from django.conf import settings
 from audio_generator.models import Page
+from audio_generator.pipeline import AudioPipeline
+from misojo.db_pool.base import pool_stats
+
+file_name = __file__.split("/")[-1]
+
+parser = argparse.ArgumentParser(description="Generate audio of pending pages")
+parser.add_argument(
+    "--batch",
+    type=int,
+    default=settings.TTS_WORKERS * 2,
+    help="pages claimed at a time",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=settings.TTS_WORKERS,
+    help="pages generated at the same time",
+)
+parser.add_argument(
+    "--time-budget",
+    type=int,
+    default=240,
+    help="seconds to keep claiming pages (use less than the cron interval)",
+)
+parser.add_argument(
+    "--forever",
+    action="store_true",
+    help="keep running and waiting for new pages",
+)
+args = parser.parse_args()
 
 # Detect pages with missing audio
-pages = Page.objects.filter(
-    path_audio='',
-).order_by('id')
+pages_pending = Page.objects.filter(path_audio='').count()
+print(f"{file_name}: Pages with missing audio: {pages_pending}")
 
+# Generate audio by batches, until time budget ends or no pages left
+pipeline = AudioPipeline(workers=args.workers)
+start = monotonic()
+pages_generated = 0
+while args.forever or monotonic() - start < args.time_budget:
 
-file_name = __file__.split("/")[-1]
-print(f"{file_name}: Pages with missing audio: {pages.count()}")
+    pages = Page.claim_pending_audio(args.batch)
+    if not pages:
+        if not args.forever:
+            break
+        sleep(settings.JOBS_POLL_INTERVAL)
+        continue
+
+    print(f"{file_name}: Generating audio for {len(pages)} pages")
+    stats = pipeline.run(pages)
+    pages_generated += stats["pages"]
 
-# Generate audio for a single page
-if pages:
-    print(f"{file_name}: Generating audio for page {pages.first()}")
-    page = pages.first()
-    page.generate_audio()
\ No newline at end of file
+seconds = monotonic() - start
+print(f"{file_name}: {pages_generated} pages generated in {seconds:.1f}s "
+      f"({pages_generated / seconds if seconds else 0:.2f} pages/s)")
+print(f"{file_name}: db connections pool: {pool_stats()}")
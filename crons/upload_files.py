@@ -20,6 +20,7 @@ django.setup()
 
 # Django imports
 from audio_generator.models import File, User
+from audio_generator.progress import get_progress_many
 
 # Env variables
 load_dotenv()
@@ -32,6 +33,9 @@ files_folders = {
 
 public_user_obj = User.objects.get(email=PUBLIC_USER)
 
+# Files uploaded by this run (id: name)
+uploaded_files = {}
+
 for lang, folder in files_folders.items():
     for file_name in os.listdir(folder):
         
@@ -57,10 +61,33 @@ for lang, folder in files_folders.items():
             file = django_file(track_file)
             file_obj.path.save(file_name, file, save=True)
             file_obj.save()
-            
-        # Wait until pages are generated
+        
         print(f"file {file_name_clean} uploaded. Generating pages...")
-        while not file_obj.pages_generated:
-            sleep(2)
-            
-        print(f"file {file_name_clean} uploaded")
\ No newline at end of file
+        uploaded_files[file_obj.id] = file_name_clean
+
+# Show split progress of all the uploaded files (single query by check)
+last_progress = {}
+while uploaded_files:
+    sleep(2)
+    progress = get_progress_many(list(uploaded_files))
+    for file_id in list(uploaded_files):
+        file_name_clean = uploaded_files[file_id]
+        file_progress = progress.get(file_id)
+        if file_progress is None:
+            print(f"file {file_name_clean} deleted")
+            uploaded_files.pop(file_id)
+            continue
+        if file_progress == last_progress.get(file_id):
+            continue
+        last_progress[file_id] = file_progress
+        
+        if file_progress["status"] == File.PROCESSING:
+            print(f"file {file_name_clean}: "
+                  f"{file_progress['pages_split']} pages splitted")
+        elif file_progress["status"] == File.ERROR:
+            print(f"file {file_name_clean} quarantined")
+            uploaded_files.pop(file_id)
+        else:
+            print(f"file {file_name_clean} uploaded "
+                  f"({file_progress['pages_num']} pages)")
+            uploaded_files.pop(file_id)
@@ -0,0 +1,21 @@
+# Gunicorn settings (used by the Procfile: "gunicorn -c gunicorn.conf.py")
+import os
+
+# Server mode:
+# "wsgi": sync workers, each request holds a process until it ends
+# "asgi": uvicorn workers, async views (progress, page audio stream) wait
+#   in the event loop, sync views run in threads of each worker
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+
+# Processes (gunicorn default: 1). With DB_POOL on, each one keeps up to
+# DB_POOL_MAX_SIZE connections: raise it within the database max connections
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "misojo.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "misojo.wsgi:application"
+    worker_class = "sync"
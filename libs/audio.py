@@ -1,29 +1,228 @@
 import os
-from time import sleep
-from gtts import gTTS
+import re
+import wave
+import shutil
 import threading
+import subprocess
+from time import sleep, monotonic
+from gtts import gTTS
+
+
+class TokenBucket:
+    """ Thread safe rate limiter: allow "rate" calls per second,
+    with bursts of up to "capacity" calls """
+    
+    def __init__(self, rate: float, capacity: int, clock=monotonic,
+                 wait=sleep):
+        """ Start with a full bucket
+        
+        Args:
+            rate (float): tokens added per second (0 for no limit)
+            capacity (int): max tokens stored
+            clock (callable, optional): time function. Defaults to monotonic.
+            wait (callable, optional): sleep function. Defaults to sleep.
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.wait = wait
+        self.last = clock()
+        self.lock = threading.Lock()
+        
+    def acquire(self):
+        """ Take a token, waiting until one is available """
+        
+        if self.rate <= 0:
+            return
+        
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                missing_time = (1 - self.tokens) / self.rate
+            self.wait(missing_time)
+
+
+class TTSEngine:
+    """ Base text to speech engine """
+    
+    name = ""
+    extension = "mp3"
+    # Engine calls an external service (rate limited)
+    remote = False
+    # Audio files can be concatenated (for streaming by chunks)
+    streamable = False
+    bitrate = None
+    
+    def synthesize(self, text: str, lang: str, file_path: str,
+                   slow: bool = False):
+        """ Save text as audio file
+        
+        Args:
+            text (str): Text to convert to audio
+            lang (str): Language to use
+            file_path (str): Path to save audio to
+            slow (bool, optional): Read text slowly. Defaults to False.
+        """
+        raise NotImplementedError
+    
+    def voice(self, lang: str) -> str:
+        """ Get the voice used for a language
+        
+        Args:
+            lang (str): Language to use
+        
+        Returns:
+            str: voice name
+        """
+        return lang
+    
+    def is_available(self) -> bool:
+        """ Check if the engine can run in this host
+        
+        Returns:
+            bool: True if the engine can be used
+        """
+        return True
+    
+    def duration(self, file_path: str) -> float:
+        """ Get length of generated audio
+        
+        Args:
+            file_path (str): Path to audio file
+        
+        Returns:
+            float: Audio seconds
+        """
+        raise NotImplementedError
+    
+
+class GTTSEngine(TTSEngine):
+    """ Google Translate text to speech (requires network) """
+    
+    name = "gtts"
+    extension = "mp3"
+    remote = True
+    streamable = True
+    # gTTS returns mp3 mono files at 32 kbps
+    bitrate = 32000
+    
+    def synthesize(self, text: str, lang: str, file_path: str,
+                   slow: bool = False):
+        gtts_audio = gTTS(text=text, lang=lang, slow=slow)
+        gtts_audio.save(file_path)
+        
+    def duration(self, file_path: str) -> float:
+        return os.path.getsize(file_path) * 8 / self.bitrate
+        
 
+class EspeakEngine(TTSEngine):
+    """ Local espeak-ng text to speech, run in a subprocess (no network) """
+    
+    name = "espeak"
+    extension = "wav"
+    voices = {
+        "es": "es",
+        "en": "en-us",
+    }
+    
+    def __init__(self, command: str = "espeak-ng"):
+        self.command = command
+    
+    def synthesize(self, text: str, lang: str, file_path: str,
+                   slow: bool = False):
+        words_per_minute = "120" if slow else "170"
+        subprocess.run(
+            [
+                self.command,
+                "-v", self.voice(lang),
+                "-s", words_per_minute,
+                "-w", file_path,
+                "--stdin",
+            ],
+            input=text.encode(),
+            check=True,
+            capture_output=True,
+        )
+        
+    def voice(self, lang: str) -> str:
+        return self.voices.get(lang, lang)
+        
+    def is_available(self) -> bool:
+        return shutil.which(self.command) is not None
+        
+    def duration(self, file_path: str) -> float:
+        with wave.open(file_path, "rb") as audio_file:
+            return audio_file.getnframes() / audio_file.getframerate()
 
-# Create a lock
-lock = threading.Lock()
 
+ENGINES = {
+    GTTSEngine.name: GTTSEngine,
+    EspeakEngine.name: EspeakEngine,
+}
 
-# Decorator to synchronize function execution
-def synchronized(func):
-    def synced_func(*args, **kwargs):
-        with lock:
-            return func(*args, **kwargs)
-    return synced_func
+
+def get_engine(name: str) -> TTSEngine:
+    """ Create engine instance from its name
+    
+    Args:
+        name (str): engine name (one of ENGINES)
+    
+    Returns:
+        TTSEngine: engine instance
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Unknown tts engine: {name}")
+    return ENGINES[name]()
+
+
+def split_sentences(text: str, max_chars: int = 400) -> list:
+    """ Split text in chunks of full sentences
+    
+    Args:
+        text (str): Text to split
+        max_chars (int, optional): Max length of each chunk (longer
+            sentences are kept complete). Defaults to 400.
+    
+    Returns:
+        list: chunks of text
+    """
+    
+    text = " ".join((text or "").split())
+    sentences = re.split(r"(?<=[.!?…;])\s+", text)
+    
+    chunks = []
+    for sentence in sentences:
+        if not sentence:
+            continue
+        if chunks and len(chunks[-1]) + len(sentence) < max_chars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks
 
 
-@synchronized
-def generate_audio(text: str, lang: str, file_path: str, slow: bool = False) -> os.path:
+def generate_audio(text: str, lang: str, file_path: str, slow: bool = False,
+                   rate_limiter: TokenBucket = None,
+                   engine: TTSEngine = None) -> os.path:
     """ Generate audio file from text
     
     Args:
         text (str): Text to convert to audio
         lang (str): Language to use
         file_path (str): Name of file to save audio to
+        slow (bool, optional): Read text slowly. Defaults to False.
+        rate_limiter (TokenBucket, optional): Limit of requests to
+            remote tts engines. Defaults to None.
+        engine (TTSEngine, optional): Engine to use. Defaults to gTTS.
         
     Returns:
         os.path: Path to audio file
@@ -50,9 +249,10 @@ def generate_audio(text: str, lang: str, file_path: str, slow: bool = False) ->
     os.makedirs(file_dir, exist_ok=True)
     
     # Generate audio
-    gtts_audio = gTTS(text=text, lang=lang, slow=slow)
-    gtts_audio.save(file_path)
-    sleep(5)
+    engine = engine or GTTSEngine()
+    if rate_limiter and engine.remote:
+        rate_limiter.acquire()
+    engine.synthesize(text, lang, file_path, slow=slow)
     
     return file_path
 
@@ -0,0 +1,58 @@
+import math
+import hashlib
+
+
+class BloomFilter:
+    """ Set membership in fixed memory: "not in" answers are exact,
+    "in" answers can be false positives (about error_rate of them) """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """ Setup bit array sized for the expected number of items
+
+        Args:
+            capacity (int): expected number of items
+            error_rate (float, optional): false positive rate with capacity
+                items. Defaults to 0.001.
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.bits_num = math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes_num = max(round(self.bits_num / self.capacity * math.log(2)), 1)
+        self.bits = bytearray(math.ceil(self.bits_num / 8))
+        self.count = 0
+
+    def positions(self, item: str):
+        """ Bit positions of an item (double hashing of a single digest)
+
+        Args:
+            item (str): item to hash
+
+        Yields:
+            int: bit position
+        """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        hash_1 = int.from_bytes(digest[:8], 'little')
+        hash_2 = int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hashes_num):
+            yield (hash_1 + index * hash_2) % self.bits_num
+
+    def add(self, item: str):
+        """ Add item to the filter
+
+        Args:
+            item (str): item to add
+        """
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(item)
+        )
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """ Thread safe in memory cache, with a max number of items (least
+    recently used items removed first) and an expiration time """
+
+    def __init__(self, max_size: int, ttl: float):
+        """ Setup cache
+
+        Args:
+            max_size (int): max number of items
+            ttl (float): seconds before an item expires
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Get item if it is not expired
+
+        Args:
+            key (hashable): item key
+            default (any, optional): value of missing items. Defaults to None.
+
+        Returns:
+            any: item value or default
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= monotonic():
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """ Save item, removing the least recently used one if the cache is full
+
+        Args:
+            key (hashable): item key
+            value (any): item value
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.items[key] = (value, monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        """ Remove item (if it exists)
+
+        Args:
+            key (hashable): item key
+        """
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        """ Remove all items """
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
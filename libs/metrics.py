@@ -0,0 +1,389 @@
+import os
+import json
+import uuid
+import fcntl
+import atexit
+import logging
+import tempfile
+import threading
+from time import monotonic
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def pid_alive(pid: int) -> bool:
+    """ Check if a process is running
+
+    Args:
+        pid (int): process id
+
+    Returns:
+        bool: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def escape_label(value) -> str:
+    """ Escape label value for prometheus text format
+
+    Args:
+        value (any): label value
+
+    Returns:
+        str: escaped value
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple, **extra) -> str:
+    """ Format labels in prometheus text format
+
+    Args:
+        labels (tuple): (name, value) pairs
+        **extra: more labels (like "le" of histogram buckets)
+
+    Returns:
+        str: labels between braces (empty if there are no labels)
+    """
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in pairs
+    ) + "}"
+
+
+def add_metrics(totals: dict, data: dict, gauges: bool = True):
+    """ Add metrics of a process file to totals
+
+    Args:
+        totals (dict): counters, histograms and gauges by (name, labels)
+        data (dict): metrics file content
+        gauges (bool, optional): add gauges too. Defaults to True.
+    """
+    for name, labels, value in data["counters"]:
+        key = (name, tuple(map(tuple, labels)))
+        totals["counters"][key] = totals["counters"].get(key, 0) + value
+
+    for name, labels, histogram in data["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        total = totals["histograms"].get(key)
+        if total is None or total["buckets"] != histogram["buckets"]:
+            totals["histograms"][key] = histogram
+            continue
+        total["counts"] = [
+            count + other
+            for count, other in zip(total["counts"], histogram["counts"])
+        ]
+        total["sum"] += histogram["sum"]
+        total["count"] += histogram["count"]
+
+    if gauges:
+        for name, labels, value in data["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            totals["gauges"][key] = totals["gauges"].get(key, 0) + value
+
+
+def write_json(path: str, data: dict):
+    """ Write json file atomically (readers never see a partial file)
+
+    Args:
+        path (str): file path
+        data (dict): file content
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, path)
+
+
+class MetricsRegistry:
+    """ Counters, histograms and gauges of a process, saved in a file by
+    process (in a folder shared by all the processes of the host), so any
+    process can export the totals of all of them.
+
+    Files are named by process start (a reused pid never overwrites the
+    file of a dead process), and the counters and histograms of dead
+    processes are merged in a single aggregate file by the exports.
+    """
+
+    # File with the metrics of the dead processes
+    AGGREGATE_FILE = "metrics-aggregate.json"
+
+    def __init__(self, folder: str = None, flush_seconds: float = 5):
+        """ Setup registry
+
+        Args:
+            folder (str, optional): folder of the metrics files.
+                Defaults to a "misojo-metrics" temp folder.
+            flush_seconds (float, optional): min seconds between writes
+                of the process file. Defaults to 5.
+        """
+        self.folder = folder or os.path.join(tempfile.gettempdir(), "misojo-metrics")
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.collectors = []
+        self.reset()
+        atexit.register(self.flush, force=True)
+
+    def reset(self):
+        """ Forget metrics of this process (and of the parent, after a fork) """
+        self.pid = os.getpid()
+        self.file_name = f"metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json"
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.last_flush = monotonic()
+
+    def check_fork(self):
+        """ Reset metrics copied from the parent process """
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        """ Increase counter
+
+        Args:
+            name (str): metric name
+            labels (tuple, optional): (name, value) pairs. Defaults to ().
+            value (float, optional): increment. Defaults to 1.
+        """
+        with self.lock:
+            self.check_fork()
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = (),
+                buckets: tuple = LATENCY_BUCKETS):
+        """ Add value to histogram
+
+        Args:
+            name (str): metric name
+            value (float): value observed
+            labels (tuple, optional): (name, value) pairs. Defaults to ().
+            buckets (tuple, optional): buckets upper bounds.
+                Defaults to LATENCY_BUCKETS.
+        """
+        with self.lock:
+            self.check_fork()
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {
+                    "buckets": list(buckets),
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+                self.histograms[key] = histogram
+            for index, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def set_gauge(self, name: str, value: float, labels: tuple = ()):
+        """ Set gauge (exported only while this process is alive)
+
+        Args:
+            name (str): metric name
+            value (float): current value
+            labels (tuple, optional): (name, value) pairs. Defaults to ().
+        """
+        with self.lock:
+            self.check_fork()
+            self.gauges[(name, labels)] = value
+
+    def flush(self, force: bool = False):
+        """ Save metrics of this process in its file (at most every
+        flush_seconds, unless forced)
+
+        Args:
+            force (bool, optional): save now. Defaults to False.
+        """
+        if not force and monotonic() - self.last_flush < self.flush_seconds:
+            return
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception:
+                logger.exception("metrics collector error")
+
+        with self.lock:
+            self.check_fork()
+            self.last_flush = monotonic()
+            file_name = self.file_name
+            data = {
+                "pid": self.pid,
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    [name, labels, histogram]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                "gauges": [
+                    [name, labels, value]
+                    for (name, labels), value in self.gauges.items()
+                ],
+            }
+
+        os.makedirs(self.folder, exist_ok=True)
+        write_json(os.path.join(self.folder, file_name), data)
+
+    @contextmanager
+    def folder_lock(self):
+        """ Lock the metrics folder (exports only: flushes write their own
+        file without locking) """
+        with open(os.path.join(self.folder, "metrics.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def read_files(self) -> list:
+        """ Read metrics files of the folder
+
+        Returns:
+            list: (file name, file content) pairs
+        """
+        files = []
+        for file_name in sorted(os.listdir(self.folder)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.folder, file_name)) as metrics_file:
+                    files.append((file_name, json.load(metrics_file)))
+            except (OSError, ValueError):
+                continue
+        return files
+
+    def merge_dead(self, files: list) -> list:
+        """ Add counters and histograms of dead processes to the aggregate
+        file, and remove their files (folder lock held)
+
+        Args:
+            files (list): (file name, file content) pairs
+
+        Returns:
+            list: files after the merge
+        """
+        dead = [
+            (file_name, data) for file_name, data in files
+            if file_name != self.AGGREGATE_FILE
+            and data["pid"] != os.getpid()
+            and not pid_alive(data["pid"])
+        ]
+        if not dead:
+            return files
+
+        aggregate = {"counters": {}, "histograms": {}, "gauges": {}}
+        for file_name, data in files:
+            if file_name == self.AGGREGATE_FILE:
+                add_metrics(aggregate, data, gauges=False)
+        for _, data in dead:
+            add_metrics(aggregate, data, gauges=False)
+        aggregate_data = {
+            "pid": None,
+            "counters": [
+                [name, labels, value]
+                for (name, labels), value in aggregate["counters"].items()
+            ],
+            "histograms": [
+                [name, labels, histogram]
+                for (name, labels), histogram in aggregate["histograms"].items()
+            ],
+            "gauges": [],
+        }
+
+        # Aggregate saved before removing the merged files: a crash
+        # between both counts them twice, never loses them
+        write_json(os.path.join(self.folder, self.AGGREGATE_FILE), aggregate_data)
+        for file_name, _ in dead:
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                pass
+
+        dead_names = {file_name for file_name, _ in dead}
+        return [
+            (file_name, data) for file_name, data in files
+            if file_name not in dead_names and file_name != self.AGGREGATE_FILE
+        ] + [(self.AGGREGATE_FILE, aggregate_data)]
+
+    def collect(self) -> dict:
+        """ Sum metrics of all the processes (gauges of live processes
+        only), merging the files of dead processes first
+
+        Returns:
+            dict:
+                counters (dict): value by (name, labels)
+                histograms (dict): histogram by (name, labels)
+                gauges (dict): value by (name, labels)
+        """
+        totals = {"counters": {}, "histograms": {}, "gauges": {}}
+        if not os.path.isdir(self.folder):
+            return totals
+
+        with self.folder_lock():
+            files = self.merge_dead(self.read_files())
+
+        for file_name, data in files:
+            alive = data["pid"] == os.getpid() or (
+                data["pid"] is not None and pid_alive(data["pid"])
+            )
+            add_metrics(totals, data, gauges=alive)
+        return totals
+
+    def render(self, descriptions: dict = None) -> str:
+        """ Export metrics of all the processes in prometheus text format
+
+        Args:
+            descriptions (dict, optional): help text by metric name.
+                Defaults to None.
+
+        Returns:
+            str: metrics
+        """
+        self.flush(force=True)
+        totals = self.collect()
+        descriptions = descriptions or {}
+
+        # Group samples by metric name
+        metrics = {}
+        for kind in ("counters", "gauges", "histograms"):
+            for (name, labels), value in sorted(totals[kind].items()):
+                metrics.setdefault(name, (kind, []))[1].append((labels, value))
+
+        types = {"counters": "counter", "gauges": "gauge", "histograms": "histogram"}
+        lines = []
+        for name, (kind, samples) in metrics.items():
+            if name in descriptions:
+                lines.append(f"# HELP {name} {descriptions[name]}")
+            lines.append(f"# TYPE {name} {types[kind]}")
+            for labels, value in samples:
+                if kind != "histograms":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(value["buckets"], value["counts"]):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_bucket{format_labels(labels, le='+Inf')} {value['count']}"
+                )
+                lines.append(f"{name}_sum{format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
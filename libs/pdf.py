@@ -1,73 +1,268 @@
+import io
 import os
+import math
+import collections
+import importlib.util
 import PyPDF2
-import requests
-from django.conf import settings
+from typing import Iterator
+from contextlib import contextmanager
+from libs.sandbox import SandboxPool
 
 
-def get_pdf_text(pdf_path: os.path) -> tuple:
-    """ Get text from specific page from PDF file
+class PdfParseError(Exception):
+    """ Pdf file content can not be parsed (bad or malicious file) """
+
+
+@contextmanager
+def parse_errors():
+    """ Raise the errors of the pdf libraries parsing a file as
+    PdfParseError (errors reading the file, like missing files, and
+    memory errors are raised as they are) """
+    try:
+        yield
+    except (OSError, MemoryError):
+        raise
+    except Exception as error:
+        raise PdfParseError(f"{error.__class__.__name__}: {error}") from error
+
+
+class TextExtractor:
+    """ Base pdf text extraction engine """
+    
+    name = ""
+    module = ""
+    
+    def is_available(self) -> bool:
+        """ Check if the engine library is installed
+        
+        Returns:
+            bool: True if the engine can be used
+        """
+        return importlib.util.find_spec(self.module) is not None
+    
+    def extract(self, page_pdf: bytes) -> str:
+        """ Get text from a single page pdf file
+        
+        Args:
+            page_pdf (bytes): PDF content
+        
+        Returns:
+            str: Text from the page
+        """
+        raise NotImplementedError
+    
+    def extract_page(self, page: PyPDF2.PageObject, page_pdf: bytes) -> str:
+        """ Get text from a page while splitting a pdf file
+        
+        Args:
+            page (PyPDF2.PageObject): PDF page already parsed
+            page_pdf (bytes): Single page PDF content
+        
+        Returns:
+            str: Text from the page
+        """
+        return self.extract(page_pdf)
+    
+
+class PyPDF2Extractor(TextExtractor):
+    """ PyPDF2 (default, reuses pages parsed while splitting) """
+    
+    name = "pypdf2"
+    module = "PyPDF2"
+    
+    def extract(self, page_pdf: bytes) -> str:
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(page_pdf))
+        return pdf_reader.pages[0].extract_text()
+    
+    def extract_page(self, page: PyPDF2.PageObject, page_pdf: bytes) -> str:
+        return page.extract_text()
+    
+
+class PypdfExtractor(TextExtractor):
+    """ pypdf (maintained successor of PyPDF2) """
+    
+    name = "pypdf"
+    module = "pypdf"
+    
+    def extract(self, page_pdf: bytes) -> str:
+        import pypdf
+        pdf_reader = pypdf.PdfReader(io.BytesIO(page_pdf))
+        return pdf_reader.pages[0].extract_text()
+
+
+class PdfminerExtractor(TextExtractor):
+    """ pdfminer.six (layout analysis, better word spacing) """
+    
+    name = "pdfminer"
+    module = "pdfminer"
+    
+    def extract(self, page_pdf: bytes) -> str:
+        from pdfminer.high_level import extract_text
+        return extract_text(io.BytesIO(page_pdf))
+
+
+EXTRACTORS = {
+    PyPDF2Extractor.name: PyPDF2Extractor,
+    PypdfExtractor.name: PypdfExtractor,
+    PdfminerExtractor.name: PdfminerExtractor,
+}
+
+
+def get_extractor(name: str) -> TextExtractor:
+    """ Create text extraction engine from its name
     
     Args:
-        pdf_path (os.path): Path to PDF file
+        name (str): engine name (one of EXTRACTORS)
     
     Returns:
-        tuple:
-            str: Text from PDF file
+        TextExtractor: engine instance
     """
-    
-    # Read PDF file
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfFileReader(file)
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown pdf text engine: {name}")
+    extractor = EXTRACTORS[name]()
+    if not extractor.is_available():
+        raise ValueError(f"Pdf text engine not installed: {extractor.module}")
+    return extractor
+
 
-        # Extract text from specific page
-        page = pdf_reader.getPage(0)
-        text = page.extractText()
+def get_pdf_text(pdf_file: io.BufferedIOBase,
+                 extractor: TextExtractor = None) -> str:
+    """ Get text from the first page of PDF file
+    
+    Args:
+        pdf_file (io.BufferedIOBase): PDF file opened in binary mode
+        extractor (TextExtractor, optional): Engine to use.
+            Defaults to PyPDF2.
     
-        return text
+    Returns:
+        str: Text from PDF file
+    """
+    extractor = extractor or PyPDF2Extractor()
+    return extractor.extract(pdf_file.read())
 
 
-def split_pdf(input_path: os.path, output_folder: os.path) -> int:
-    """ Split pdf file into multiple files
+def split_page(page: PyPDF2.PageObject, page_num: int,
+               extractor: TextExtractor) -> tuple:
+    """ Save a parsed page as single page pdf file, and get its text
     
     Args:
-        input_path (os.path): Path to PDF file
-        output_folder (os.path): Path to output folder
-        
+        page (PyPDF2.PageObject): PDF page
+        page_num (int): Page number (starting at 1)
+        extractor (TextExtractor): Engine to get text
+    
     Returns:
-        int: Total number of pages in the PDF file
+        tuple:
+            int: Page number
+            bytes: Single page PDF content
+            str: Text from the page
     """
+    pdf_writer = PyPDF2.PdfWriter()
+    pdf_writer.add_page(page)
+    
+    page_buffer = io.BytesIO()
+    pdf_writer.write(page_buffer)
+    page_pdf = page_buffer.getvalue()
+    return page_num, page_pdf, extractor.extract_page(page, page_pdf)
+
+
+def split_pdf_range(pdf_path: str, start: int, end: int,
+                    extractor: TextExtractor) -> list:
+    """ Split a range of pages of a pdf file (runs in pool processes,
+    each one opening the file by itself)
     
-    # Download file from aws s3
-    if "misojo.s3" in input_path:
-        res = requests.get(input_path)
-        file_base = input_path.split("/")[-1]
-        input_path = os.path.join(settings.MEDIA_ROOT, file_base)
-        with open(input_path, 'wb') as file:
-            file.write(res.content)
+    Args:
+        pdf_path (str): Path to PDF file
+        start (int): First page index (starting at 0)
+        end (int): Last page index (excluded)
+        extractor (TextExtractor): Engine to get text
     
-    # Local file path uploaded from dashboard
-    elif "crons" not in input_path:
-        input_path_parts = input_path.split("/")[2:]
-        input_path = os.path.join(settings.MEDIA_ROOT, *input_path_parts)
+    Returns:
+        list: tuples (page number, page pdf content, page text)
+    """
+    with open(pdf_path, 'rb') as pdf_file, parse_errors():
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        return [
+            split_page(pdf_reader.pages[page_index], page_index + 1, extractor)
+            for page_index in range(start, end)
+        ]
 
-    with open(input_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfFileReader(file)
-        total_pages = pdf_reader.numPages
 
-        for page_number in range(total_pages):
-            pdf_writer = PyPDF2.PdfFileWriter()
-            pdf_writer.addPage(pdf_reader.getPage(page_number))
+def count_pages(pdf_path: str) -> int:
+    """ Get number of pages of a pdf file
+    
+    Args:
+        pdf_path (str): Path to PDF file
+    
+    Returns:
+        int: Number of pages
+    """
+    with open(pdf_path, 'rb') as pdf_file, parse_errors():
+        return len(PyPDF2.PdfReader(pdf_file).pages)
 
-            output_path = f"{output_folder}/{page_number + 1}.pdf"
-            with open(output_path, 'wb') as output_file:
-                pdf_writer.write(output_file)
-                
-    return total_pages
+
+def split_pdf(pdf_file: io.BufferedIOBase, extractor: TextExtractor = None,
+              pool: SandboxPool = None,
+              pages_per_task: int = 50) -> Iterator[tuple]:
+    """ Split pdf file in single page pdf files, in memory, and get
+    the text of each page in the same pass. With a pool, the file is
+    parsed only in its processes, by ranges of pages.
+    
+    Args:
+        pdf_file (io.BufferedIOBase): PDF file opened in binary mode
+            (with a path in disk to use a pool)
+        extractor (TextExtractor, optional): Engine to get text.
+            Defaults to PyPDF2.
+        pool (SandboxPool, optional): Processes to parse the file.
+            Defaults to None (parse in this process).
+        pages_per_task (int, optional): Min pages splitted by each
+            pool task. Defaults to 50.
+        
+    Raises:
+        SandboxError: File could not be parsed in the pool (with
+            PdfParseError as task errors of the pool)
+        
+    Yields:
+        tuple:
+            int: Page number (starting at 1)
+            bytes: Single page PDF content
+            str: Text from the page
+    """
+    
+    extractor = extractor or PyPDF2Extractor()
+    
+    # No pool (trusted or in memory files): split in this process
+    if pool is None:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for page_index, page in enumerate(pdf_reader.pages):
+            yield split_page(page, page_index + 1, extractor)
+        return
+    
+    pdf_path = getattr(pdf_file, 'name', None)
+    if not isinstance(pdf_path, str) or not os.path.isfile(pdf_path):
+        raise ValueError("Pdf file must be in disk to split it in a pool")
+    pool.start(1)
+    total_pages = pool.run(count_pages, pdf_path)
+    
+    # Split ranges in the pool, keeping only a few ranges in memory
+    # (each task parses the whole file, so use at most 2 tasks per worker,
+    # and only the workers needed by the pages of the file)
+    workers = pool.start(max(math.ceil(total_pages / pages_per_task), 1))
+    range_size = max(pages_per_task, math.ceil(total_pages / (workers * 2)))
+    pending = collections.deque()
+    for start in range(0, total_pages, range_size):
+        end = min(start + range_size, total_pages)
+        pending.append(
+            pool.submit(split_pdf_range, pdf_path, start, end, extractor)
+        )
+        if len(pending) >= workers * 2:
+            yield from pool.result(pending.popleft())
+    while pending:
+        yield from pool.result(pending.popleft())
 
 
 if __name__ == "__main__":
     current_folder = os.path.dirname(os.path.abspath(__file__))
     parent_folder = os.path.dirname(current_folder)
-    pdf_file = os.path.join(parent_folder, 'sample.pdf')
-    pdf_text, extracted = get_pdf_text(pdf_file, 1)
-    print(pdf_text)
\ No newline at end of file
+    pdf_path = os.path.join(parent_folder, 'sample.pdf')
+    with open(pdf_path, 'rb') as pdf_file:
+        print(get_pdf_text(pdf_file))
@@ -0,0 +1,212 @@
+import threading
+from time import monotonic
+
+
+class PoolTimeout(Exception):
+    """ No connection released before the checkout timeout """
+    pass
+
+
+class ConnectionPool:
+    """ Thread safe pool of reusable connections (of any kind: the pool
+    only calls the functions received to open, check and close them) """
+
+    def __init__(self, connect, check=None, close=None, max_size: int = 10,
+                 timeout: float = 30, health_check_seconds: float = 30,
+                 max_lifetime: float = 3600):
+        """ Setup pool (connections are opened when needed)
+
+        Args:
+            connect (function): open a new connection
+            check (function, optional): raise if a connection is broken.
+                Defaults to None (no health checks).
+            close (function, optional): close a connection.
+                Defaults to None (connection.close()).
+            max_size (int, optional): max connections open.
+                Defaults to 10.
+            timeout (float, optional): max seconds waiting for a connection.
+                Defaults to 30.
+            health_check_seconds (float, optional): idle seconds before a
+                connection is checked on checkout. Defaults to 30.
+            max_lifetime (float, optional): seconds before a connection is
+                replaced. Defaults to 3600.
+        """
+        self.connect = connect
+        self.check = check
+        self.close = close or (lambda connection: connection.close())
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.max_lifetime = max_lifetime
+
+        self.condition = threading.Condition()
+        self.idle = []
+        self.opened_at = {}
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.checkout_seconds_max = 0.0
+        self.discarded = 0
+
+    def acquire(self):
+        """ Get an idle connection (checked if it was idle for a while),
+        or open a new one if the pool is not full, or wait for one
+
+        Raises:
+            PoolTimeout: no connection available after timeout
+
+        Returns:
+            any: connection
+        """
+
+        start = monotonic()
+        deadline = start + self.timeout
+        with self.condition:
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"no connection available after {self.timeout}s "
+                        f"({self.size} open, {self.waiting} waiting)"
+                    )
+                self.waiting += 1
+                try:
+                    self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            if self.idle:
+                connection, released_at = self.idle.pop()
+            else:
+                connection, released_at = None, None
+                self.size += 1
+            self.in_use += 1
+
+        # Open or check connection outside the lock (a broken connection
+        # is replaced keeping its place in the pool)
+        try:
+            if connection is not None and not self.is_healthy(connection, released_at):
+                self.close_quietly(connection)
+                with self.condition:
+                    self.discarded += 1
+                connection = None
+            if connection is None:
+                connection = self.connect()
+                self.opened_at[id(connection)] = monotonic()
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+        seconds = monotonic() - start
+        with self.condition:
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+        return connection
+
+    def is_healthy(self, connection, released_at: float) -> bool:
+        """ Check connection taken from the idle list
+
+        Args:
+            connection (any): idle connection
+            released_at (float): monotonic time of its release
+
+        Returns:
+            bool: False if the connection is too old or broken
+        """
+        now = monotonic()
+        if now - self.opened_at.get(id(connection), now) > self.max_lifetime:
+            return False
+        if self.check and now - released_at > self.health_check_seconds:
+            try:
+                self.check(connection)
+            except Exception:
+                return False
+        return True
+
+    def release(self, connection, broken: bool = False):
+        """ Return connection to the pool
+
+        Args:
+            connection (any): connection from acquire
+            broken (bool, optional): close it instead of reusing it.
+                Defaults to False.
+        """
+        if broken:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.in_use -= 1
+            self.idle.append((connection, monotonic()))
+            self.condition.notify()
+
+    def close_quietly(self, connection):
+        """ Close connection ignoring errors (it can be broken already)
+
+        Args:
+            connection (any): connection to close
+        """
+        self.opened_at.pop(id(connection), None)
+        try:
+            self.close(connection)
+        except Exception:
+            pass
+
+    def discard(self, connection, in_use: bool = True):
+        """ Close connection and free its place in the pool
+
+        Args:
+            connection (any): connection to close
+            in_use (bool, optional): the connection was checked out.
+                Defaults to True.
+        """
+        self.close_quietly(connection)
+        with self.condition:
+            self.size -= 1
+            if in_use:
+                self.in_use -= 1
+            self.discarded += 1
+            self.condition.notify()
+
+    def close_idle(self):
+        """ Close all the idle connections """
+        with self.condition:
+            idle = self.idle
+            self.idle = []
+        for connection, _ in idle:
+            self.discard(connection, in_use=False)
+
+    def stats(self) -> dict:
+        """ Get pool gauges and counters
+
+        Returns:
+            dict:
+                size (int): connections open
+                in_use (int): connections checked out
+                idle (int): connections ready to reuse
+                waiting (int): threads waiting for a connection
+                max_size (int): max connections open
+                checkouts (int): connections given
+                checkout_seconds_avg (float): average wait for a connection
+                checkout_seconds_max (float): max wait for a connection
+                discarded (int): connections closed (broken or too old)
+        """
+        with self.condition:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "waiting": self.waiting,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "checkout_seconds_avg": (
+                    self.checkout_seconds / self.checkouts if self.checkouts else 0
+                ),
+                "checkout_seconds_max": self.checkout_seconds_max,
+                "discarded": self.discarded,
+            }
@@ -0,0 +1,186 @@
+import math
+import resource
+from time import monotonic
+import multiprocessing
+import multiprocessing.pool
+
+
+class SandboxError(Exception):
+    """ Task failed inside the sandbox: resources limit exceeded,
+    timeout, or error raised by the task (bad input) """
+
+
+def limit_memory(memory_bytes: int):
+    """ Limit address space of the current process (pool initializer)
+
+    Args:
+        memory_bytes (int): max bytes of memory (None for no limit)
+    """
+    if memory_bytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, hard))
+
+
+def run_limited(func, args: tuple, cpu_seconds: int):
+    """ Run a task with a cpu time limit (the process is killed by the
+    system when the task uses more cpu time than allowed)
+
+    Args:
+        func (callable): task function
+        args (tuple): task arguments
+        cpu_seconds (int): max cpu seconds of the task (None for no limit)
+
+    Returns:
+        any: task result
+    """
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = math.ceil(usage.ru_utime + usage.ru_stime)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_seconds, hard))
+    return func(*args)
+
+
+class SandboxPool:
+    """ Pool of child processes to run tasks on untrusted input, with
+    memory, cpu time and wall time limits by task. Limits exceeded and
+    errors caused by the task input are raised as SandboxError, other
+    errors (like files missing or pickling errors) as they are, and the
+    calling process keeps running. """
+
+    # Seconds between checks of dead child processes while waiting a result
+    poll_seconds = 0.2
+
+    def __init__(self, workers: int = 1, cpu_seconds: int = None,
+                 memory_bytes: int = None, timeout: float = None,
+                 task_errors: tuple = (Exception,)):
+        """ Setup limits (processes are started with the first task)
+
+        Args:
+            workers (int, optional): max child processes. Defaults to 1.
+            cpu_seconds (int, optional): max cpu seconds by task.
+                Defaults to None (no limit).
+            memory_bytes (int, optional): max memory of each process.
+                Defaults to None (no limit).
+            timeout (float, optional): max seconds waiting each task result.
+                Defaults to None (no limit).
+            task_errors (tuple, optional): errors of the tasks caused by
+                their input (raised as SandboxError). Defaults to any error.
+        """
+        self.workers = max(workers, 1)
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.timeout = timeout
+        self.task_errors = task_errors
+        self.pool = None
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self, workers: int = None) -> int:
+        """ Start child processes, unless as many are running already
+        (an idle pool with less processes is started again)
+
+        Args:
+            workers (int, optional): processes needed, up to the max
+                workers. Defaults to the max workers.
+
+        Returns:
+            int: processes running
+        """
+        workers = min(max(workers or self.workers, 1), self.workers)
+        if self.pool is not None and len(self.processes) >= workers:
+            return len(self.processes)
+
+        self.close()
+        context = multiprocessing.get_context("spawn")
+        self.pool = context.Pool(
+            workers,
+            initializer=limit_memory,
+            initargs=(self.memory_bytes,)
+        )
+        # Processes started, to detect the ones killed by a limit (the
+        # pool replaces them, but their tasks never finish)
+        self.processes = list(self.pool._pool)
+        return workers
+
+    def submit(self, func, *args) -> multiprocessing.pool.AsyncResult:
+        """ Queue a task in the pool (started with the max workers if
+        not started yet)
+
+        Args:
+            func (callable): task function (importable by child processes)
+            *args: task arguments
+
+        Returns:
+            multiprocessing.pool.AsyncResult: pending result
+        """
+        if self.pool is None:
+            self.start()
+        return self.pool.apply_async(
+            run_limited,
+            (func, args, self.cpu_seconds)
+        )
+
+    def result(self, async_result: multiprocessing.pool.AsyncResult):
+        """ Wait the result of a task
+
+        Args:
+            async_result (multiprocessing.pool.AsyncResult): pending result
+
+        Raises:
+            SandboxError: task failed by its input, a process was killed
+                (like by the cpu limit), or no result in time
+
+        Returns:
+            any: task result
+        """
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        try:
+            while True:
+                wait = self.poll_seconds
+                if deadline is not None:
+                    wait = max(min(wait, deadline - monotonic()), 0)
+                try:
+                    return async_result.get(wait)
+                except multiprocessing.TimeoutError:
+                    pass
+
+                # Stop processes still running tasks (results of the
+                # killed process would never come)
+                if any(process.exitcode is not None for process in self.processes):
+                    self.close()
+                    raise SandboxError("Process killed: resources limit exceeded")
+                if deadline is not None and monotonic() >= deadline:
+                    self.close()
+                    raise SandboxError(f"Timeout: no result in {self.timeout}s")
+        except SandboxError:
+            raise
+        except MemoryError:
+            raise SandboxError("Memory limit exceeded")
+        except self.task_errors as error:
+            raise SandboxError(f"{error.__class__.__name__}: {error}") from error
+
+    def run(self, func, *args):
+        """ Run a task in the pool and wait its result
+
+        Args:
+            func (callable): task function (importable by child processes)
+            *args: task arguments
+
+        Returns:
+            any: task result
+        """
+        return self.result(self.submit(func, *args))
+
+    def close(self):
+        """ Kill child processes (new ones are started by next task) """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.processes = []
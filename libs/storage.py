@@ -0,0 +1,396 @@
+import os
+import fcntl
+import struct
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+from contextlib import contextmanager
+from django.core.files.storage import Storage
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DiskCache:
+    """ Read through cache of storage files in local disk, size limited
+    (least recently used files removed first). Safe to share between
+    the processes of the host: files are written with atomic renames,
+    and eviction and counters use file locks. """
+    
+    def __init__(self, folder: str, max_bytes: int):
+        """ Setup cache (folder is created in the first download)
+        
+        Args:
+            folder (str): folder to save cached files
+            max_bytes (int): max total size of cached files
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.stats_path = os.path.join(folder, "stats")
+        self.lock_path = os.path.join(folder, "lock")
+    
+    @staticmethod
+    def get_etag(storage: Storage, name: str, remote_file) -> str:
+        """ Get version of a storage file
+        
+        Args:
+            storage (Storage): django storage
+            name (str): file name in storage
+            remote_file (file): file opened from storage
+        
+        Returns:
+            str: s3 etag, or size and modified time for other storages
+        """
+        s3_object = getattr(remote_file, 'obj', None)
+        if s3_object is not None:
+            return s3_object.e_tag
+        return f"{storage.size(name)}-{storage.get_modified_time(name).timestamp()}"
+    
+    def get_path(self, storage: Storage, name: str, etag: str) -> str:
+        """ Get local path of a cached file
+        
+        Args:
+            storage (Storage): django storage
+            name (str): file name in storage
+            etag (str): file version
+        
+        Returns:
+            str: path in cache folder
+        """
+        storage_name = ":".join([
+            storage.__class__.__name__,
+            getattr(storage, 'bucket_name', None) or "",
+        ])
+        key = "\0".join([storage_name, name, etag])
+        key = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.folder, key[:2], key)
+    
+    @contextmanager
+    def open(self, storage: Storage, name: str):
+        """ Open storage file from cache, downloading it if missing
+        
+        Args:
+            storage (Storage): django storage
+            name (str): file name in storage
+        
+        Yields:
+            file: binary file opened for reading
+        """
+        
+        with storage.open(name, 'rb') as remote_file:
+            path = self.get_path(
+                storage,
+                name,
+                self.get_etag(storage, name, remote_file)
+            )
+            try:
+                local_file = open(path, 'rb')
+                hit = True
+            except FileNotFoundError:
+                hit = False
+                
+                # Download to temp file and publish it complete
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(path),
+                    delete=False
+                ) as temp_file:
+                    try:
+                        s3_object = getattr(remote_file, 'obj', None)
+                        if s3_object is not None:
+                            s3_object.download_fileobj(temp_file)
+                        else:
+                            shutil.copyfileobj(remote_file, temp_file, CHUNK_SIZE)
+                    except BaseException:
+                        os.remove(temp_file.name)
+                        raise
+                os.replace(temp_file.name, path)
+                local_file = open(path, 'rb')
+        
+        # Mark as recently used (evicted files stay readable while open,
+        # even if other process evicts it before the mark)
+        with local_file:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            self.count(hit)
+            if not hit:
+                self.evict()
+            yield local_file
+    
+    def count(self, hit: bool):
+        """ Add hit or miss to counters shared by all processes
+        
+        Args:
+            hit (bool): True if file was found in cache
+        """
+        with open(self.stats_path, 'a+b') as stats_file:
+            fcntl.flock(stats_file, fcntl.LOCK_EX)
+            stats_file.seek(0)
+            data = stats_file.read(16)
+            hits, misses = struct.unpack("QQ", data) if len(data) == 16 else (0, 0)
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+            stats_file.seek(0)
+            stats_file.truncate()
+            stats_file.write(struct.pack("QQ", hits, misses))
+    
+    def get_files(self) -> list:
+        """ Get cached files
+        
+        Returns:
+            list: tuples (last used time, size, path)
+        """
+        files = []
+        if not os.path.isdir(self.folder):
+            return files
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir():
+                continue
+            for file_entry in os.scandir(entry.path):
+                try:
+                    stat = file_entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_entry.path))
+        return files
+    
+    def evict(self):
+        """ Remove least recently used files until cache fits in max_bytes """
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            files = sorted(self.get_files())
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+    
+    def stats(self) -> dict:
+        """ Get cache usage, of all the processes of the host
+        
+        Returns:
+            dict:
+                hits (int): files found in cache
+                misses (int): files downloaded
+                hit_rate (float): hits / reads
+                files (int): files in cache
+                bytes (int): total size of cached files
+        """
+        hits, misses = 0, 0
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, 'rb') as stats_file:
+                fcntl.flock(stats_file, fcntl.LOCK_SH)
+                data = stats_file.read(16)
+                if len(data) == 16:
+                    hits, misses = struct.unpack("QQ", data)
+        files = self.get_files()
+        reads = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / reads if reads else 0,
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+        }
+
+
+def download(storage: Storage, name: str, local_file):
+    """ Copy storage file to a local file, in chunks
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+        local_file (file): binary file opened for writing
+    """
+
+    with storage.open(name, 'rb') as remote_file:
+
+        # S3 files: multipart streamed download with the storage client
+        s3_object = getattr(remote_file, 'obj', None)
+        if s3_object is not None:
+            s3_object.download_fileobj(local_file)
+        else:
+            shutil.copyfileobj(remote_file, local_file, CHUNK_SIZE)
+
+
+@contextmanager
+def open_local(storage: Storage, name: str, temp_folder: str = None,
+               cache: DiskCache = None):
+    """ Open storage file from local disk: directly for local storages,
+    else from the disk cache, or downloaded to a temp file only used
+    (and removed) by this call
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+        temp_folder (str, optional): folder for temp files.
+            Defaults to system temp folder.
+        cache (DiskCache, optional): cache for remote files.
+            Defaults to None.
+
+    Yields:
+        file: binary file opened for reading
+    """
+
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+
+    if path and os.path.isfile(path):
+        with open(path, 'rb') as local_file:
+            yield local_file
+        return
+
+    if cache:
+        with cache.open(storage, name) as local_file:
+            yield local_file
+        return
+
+    if temp_folder:
+        os.makedirs(temp_folder, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=temp_folder) as local_file:
+        download(storage, name, local_file)
+        local_file.seek(0)
+        yield local_file
+
+
+def get_s3_object(storage: Storage, name: str):
+    """ Get s3 object of a storage file (only for s3 storages)
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+
+    Returns:
+        s3.Object: boto3 object, or None for other storages
+    """
+    if not getattr(storage, 'bucket_name', None):
+        return None
+    from storages.utils import clean_name, safe_join
+    return storage.bucket.Object(safe_join(storage.location, clean_name(name)))
+
+
+def spool_stream(stream, max_bytes: int, temp_folder: str = None) -> tuple:
+    """ Read a request body to a temp file (in memory for small bodies)
+    and get its checksum, without loading it at once
+
+    Args:
+        stream (file): request stream (None for empty bodies)
+        max_bytes (int): max bytes to read (one more is read to detect
+            bigger bodies)
+        temp_folder (str, optional): folder for temp files.
+            Defaults to system temp folder.
+
+    Returns:
+        tuple:
+            SpooledTemporaryFile: body content, at position 0
+            int: body size
+            str: sha256 hex digest of the body
+    """
+
+    if temp_folder:
+        os.makedirs(temp_folder, exist_ok=True)
+    spooled = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE, dir=temp_folder)
+    checksum = hashlib.sha256()
+    size = 0
+    while stream is not None and size <= max_bytes:
+        data = stream.read(min(CHUNK_SIZE, max_bytes + 1 - size))
+        if not data:
+            break
+        spooled.write(data)
+        checksum.update(data)
+        size += len(data)
+    spooled.seek(0)
+    return spooled, size, checksum.hexdigest()
+
+
+def start_upload(storage: Storage, name: str) -> str:
+    """ Start a file upload by chunks: s3 multipart upload, or empty
+    file in local storages
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage (already available)
+
+    Returns:
+        str: s3 upload id ("" for local storages)
+    """
+
+    s3_object = get_s3_object(storage, name)
+    if s3_object is not None:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return s3_object.initiate_multipart_upload(ContentType=content_type).id
+
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return ""
+
+
+def write_chunk(storage: Storage, name: str, upload_id: str, part_number: int,
+                offset: int, chunk_file):
+    """ Save a chunk of a file upload (saving it again replaces it)
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+        upload_id (str): s3 upload id ("" for local storages)
+        part_number (int): chunk number (starting at 1)
+        offset (int): chunk position in the file
+        chunk_file (file): chunk content, at position 0
+    """
+
+    s3_object = get_s3_object(storage, name)
+    if s3_object is not None:
+        s3_object.MultipartUpload(upload_id).Part(part_number).upload(Body=chunk_file)
+        return
+
+    with open(storage.path(name), 'r+b') as local_file:
+        local_file.seek(offset)
+        shutil.copyfileobj(chunk_file, local_file, CHUNK_SIZE)
+        local_file.truncate()
+
+
+def complete_upload(storage: Storage, name: str, upload_id: str):
+    """ Join the chunks of a file upload (s3 only, local files are
+    written in place)
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+        upload_id (str): s3 upload id ("" for local storages)
+    """
+
+    s3_object = get_s3_object(storage, name)
+    if s3_object is not None:
+        multipart_upload = s3_object.MultipartUpload(upload_id)
+        parts = [
+            {"PartNumber": part.part_number, "ETag": part.e_tag}
+            for part in multipart_upload.parts.all()
+        ]
+        multipart_upload.complete(MultipartUpload={"Parts": parts})
+
+
+def abort_upload(storage: Storage, name: str, upload_id: str):
+    """ Remove the chunks of a file upload
+
+    Args:
+        storage (Storage): django storage
+        name (str): file name in storage
+        upload_id (str): s3 upload id ("" for local storages)
+    """
+
+    s3_object = get_s3_object(storage, name)
+    if s3_object is not None:
+        s3_object.MultipartUpload(upload_id).abort()
+    else:
+        storage.delete(name)
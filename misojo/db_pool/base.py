@@ -0,0 +1,118 @@
+import os
+import atexit
+import threading
+from functools import partial
+from django.conf import settings
+from django.db.backends.postgresql import base
+from libs.pool import ConnectionPool
+
+# Pools of the process by database alias and connection params
+# (new pools after a fork, or when the test database replaces the database)
+pools = {}
+pools_lock = threading.Lock()
+
+
+def check_connection(connection):
+    """ Raise if a pooled connection is broken (health check on checkout)
+
+    Args:
+        connection (connection): psycopg connection
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def get_pool(alias: str, conn_params: dict, connect) -> ConnectionPool:
+    """ Get pool of a database in this process
+
+    Args:
+        alias (str): database alias
+        conn_params (dict): connection params
+        connect (function): open a new connection (used by new pools)
+
+    Returns:
+        ConnectionPool: connections pool
+    """
+    database = f"{alias}/{conn_params.get('dbname') or conn_params.get('database')}"
+    params = tuple(sorted((name, str(value)) for name, value in conn_params.items()))
+    key = (os.getpid(), database, params)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                connect,
+                check=check_connection,
+                max_size=settings.DB_POOL_MAX_SIZE,
+                timeout=settings.DB_POOL_TIMEOUT,
+                health_check_seconds=settings.DB_POOL_HEALTH_CHECK_SECONDS,
+                max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+            )
+        return pools[key]
+
+
+def pool_stats() -> dict:
+    """ Get gauges of the pools of this process
+
+    Returns:
+        dict: pool stats (see ConnectionPool.stats) by "alias/database"
+    """
+    pid = os.getpid()
+    with pools_lock:
+        process_pools = {
+            database: pool for (pool_pid, database, _), pool in pools.items()
+            if pool_pid == pid
+        }
+    return {database: pool.stats() for database, pool in process_pools.items()}
+
+
+@atexit.register
+def close_pools():
+    """ Close idle connections when the process ends (crons, workers) """
+    pid = os.getpid()
+    for (pool_pid, _, _), pool in list(pools.items()):
+        if pool_pid == pid:
+            pool.close_idle()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """ Postgres backend taking the connections from a pool shared by
+    all the threads of the process: "closing" a connection (end of
+    request, worker threads) returns it to the pool """
+
+    def get_new_connection(self, conn_params):
+        """ Take connection from the pool (opened if needed) """
+        self.pool = get_pool(
+            self.alias,
+            conn_params,
+            partial(super().get_new_connection, conn_params)
+        )
+        connection = self.pool.acquire()
+
+        # Isolation level of this wrapper (set only for new connections)
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = base.IsolationLevel(
+            options.get("isolation_level", base.IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        """ Return connection to the pool, without an open transaction and
+        with its session state reset: SET, role, temp tables, prepared
+        statements (closed if it is broken) """
+        if self.connection is None:
+            return
+        connection = self.connection
+        broken = bool(connection.closed)
+        if not broken:
+            try:
+                if connection.info.transaction_status != 0:
+                    connection.rollback()
+                
+                # Reset outside a transaction block (the next user sets
+                # autocommit and the time zone again on checkout)
+                if settings.DB_POOL_RESET_QUERY:
+                    connection.autocommit = True
+                    with connection.cursor() as cursor:
+                        cursor.execute(settings.DB_POOL_RESET_QUERY)
+            except self.Database.Error:
+                broken = True
+        self.pool.release(connection, broken=broken)
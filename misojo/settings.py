@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from datetime import timedelta
 
@@ -59,6 +60,17 @@ MIDDLEWARE = [
 if ENV == "dev":
     MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
 
+# Request metrics (first middleware: measures all the others), exported
+# at /metrics/ with the metrics of all the processes of the host
+MIDDLEWARE.insert(0, 'audio_generator.metrics.MetricsMiddleware')
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "misojo-metrics")
+)
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 0.1))
+# Bearer token to read /metrics/ (required, except in dev)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 ROOT_URLCONF = 'misojo.urls'
 
 TEMPLATES = [
@@ -95,6 +107,20 @@ DATABASES = {
     }
 }
 
+# Postgres connections pool by process, shared by its threads (requests,
+# pipeline threads, crons): connections "closed" return to the pool, with
+# their session reset (DB_POOL_RESET_QUERY, empty to skip it).
+# Off by default: enable it after testing it against the real database
+# (max connections: processes * DB_POOL_MAX_SIZE)
+DB_POOL = os.environ.get("DB_POOL", "False") == "True"
+DB_POOL_RESET_QUERY = os.environ.get("DB_POOL_RESET_QUERY", "DISCARD ALL")
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.environ.get("DB_POOL_HEALTH_CHECK_SECONDS", 30))
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600))
+if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['ENGINE'] = 'misojo.db_pool'
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -145,6 +171,14 @@ AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 AWS_S3_FILE_OVERWRITE = os.getenv('AWS_S3_FILE_OVERWRITE')
 AWS_DEFAULT_ACL = None
+# Spool s3 files read through storage to disk above 5 MB
+AWS_S3_MAX_MEMORY_SIZE = int(os.environ.get("AWS_S3_MAX_MEMORY_SIZE", 5 * 1024 ** 2))
+# Local disk cache of s3 files (empty folder to disable)
+STORAGE_CACHE_DIR = os.environ.get(
+    "STORAGE_CACHE_DIR",
+    os.path.join(TEMP_FOLDER, "storage_cache")
+)
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
 
 # Setup storages only in production
 if ENV == "prod":
@@ -172,7 +206,7 @@ HOST = os.environ.get("HOST")
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'audio_generator.authentication.CachedJWTAuthentication',
     ),
     'EXCEPTION_HANDLER': 'audio_generator.exceptions.json_exception_handler',
 }
@@ -184,7 +218,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    # Saved by the token serializer after the response
+    'UPDATE_LAST_LOGIN': False,
 
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
@@ -207,6 +242,18 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Users of authenticated requests cached by each process
+AUTH_USER_CACHE_SIZE = int(os.environ.get("AUTH_USER_CACHE_SIZE", 1024))
+AUTH_USER_CACHE_SECONDS = int(os.environ.get("AUTH_USER_CACHE_SECONDS", 60))
+
+# Refresh tokens blacklist: in memory filter (about 1.8 MB per million
+# tokens), and expired tokens deleted with "python manage.py prune_tokens"
+TOKEN_FILTER_CAPACITY = int(os.environ.get("TOKEN_FILTER_CAPACITY", 1_000_000))
+TOKEN_FILTER_ERROR_RATE = float(os.environ.get("TOKEN_FILTER_ERROR_RATE", 0.001))
+TOKEN_FILTER_GAP_SECONDS = int(os.environ.get("TOKEN_FILTER_GAP_SECONDS", 60))
+TOKEN_FILTER_GAP_IDS = int(os.environ.get("TOKEN_FILTER_GAP_IDS", 10000))
+TOKEN_PRUNE_BATCH = int(os.environ.get("TOKEN_PRUNE_BATCH", 5000))
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.environ.get("EMAIL_HOST")
@@ -214,4 +261,106 @@ EMAIL_PORT = os.environ.get("EMAIL_PORT")
 EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 EMAIL_USE_SSL = os.environ.get("EMAIL_USE_SSL") == "True"
-DEBUG_EMAIL_TO = os.environ.get("DEBUG_EMAIL_TO")
\ No newline at end of file
+DEBUG_EMAIL_TO = os.environ.get("DEBUG_EMAIL_TO")
+# Outbox sender (manage.py send_emails)
+EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", 50))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", 5))
+EMAIL_RETRY_DELAY = int(os.environ.get("EMAIL_RETRY_DELAY", 60))
+EMAIL_LEASE_SECONDS = int(os.environ.get("EMAIL_LEASE_SECONDS", 300))
+EMAIL_POLL_INTERVAL = float(os.environ.get("EMAIL_POLL_INTERVAL", 5))
+
+# Background jobs (processed with "python manage.py run_worker")
+JOBS_CONCURRENCY = int(os.environ.get("JOBS_CONCURRENCY", 4))
+JOBS_LEASE_SECONDS = int(os.environ.get("JOBS_LEASE_SECONDS", 300))
+JOBS_MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", 5))
+JOBS_RETRY_DELAY = int(os.environ.get("JOBS_RETRY_DELAY", 30))
+JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL", 2))
+
+# Pdf text extraction engine: pypdf2, pypdf or pdfminer
+PDF_TEXT_ENGINE = os.environ.get("PDF_TEXT_ENGINE", "pypdf2")
+# Max processes to split a pdf file (by ranges of PDF_PAGES_PER_TASK pages
+# or more: small files use less processes)
+PDF_SPLIT_WORKERS = int(os.environ.get("PDF_SPLIT_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 50))
+# File progress: polling endpoint cache, and server sent events streams
+PROGRESS_CACHE_SECONDS = int(os.environ.get("PROGRESS_CACHE_SECONDS", 2))
+PROGRESS_POLL_SECONDS = float(os.environ.get("PROGRESS_POLL_SECONDS", 1))
+PROGRESS_KEEPALIVE_SECONDS = int(os.environ.get("PROGRESS_KEEPALIVE_SECONDS", 15))
+PROGRESS_STREAM_TIMEOUT = int(os.environ.get("PROGRESS_STREAM_TIMEOUT", 600))
+# Resumable uploads: chunk size (min 5 MB in s3, except the last chunk)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 ** 2))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 1024 ** 3))
+# Uploads without new chunks for this long are aborted by
+# "python manage.py expire_uploads"
+UPLOAD_EXPIRE_HOURS = int(os.environ.get("UPLOAD_EXPIRE_HOURS", 24))
+# Limits of the processes parsing uploaded pdf files (bad files are quarantined)
+PDF_SANDBOX_CPU_SECONDS = int(os.environ.get("PDF_SANDBOX_CPU_SECONDS", 120))
+PDF_SANDBOX_MEMORY_MB = int(os.environ.get("PDF_SANDBOX_MEMORY_MB", 1024))
+PDF_SANDBOX_TIMEOUT = int(os.environ.get("PDF_SANDBOX_TIMEOUT", 300))
+
+# Audio generation (text to speech)
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "gtts")
+# Engine by language, like "es:espeak,en:gtts" (default: TTS_ENGINE)
+TTS_LANG_ENGINES = dict(
+    item.split(":")
+    for item in os.environ.get("TTS_LANG_ENGINES", "").split(",")
+    if item
+)
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", 4))
+TTS_RATE = float(os.environ.get("TTS_RATE", 2))
+TTS_BURST = int(os.environ.get("TTS_BURST", 4))
+# Max pages generated at the same time per language, like "es:2,en:4"
+TTS_LANG_CONCURRENCY = {
+    lang: int(limit)
+    for lang, limit in (
+        item.split(":")
+        for item in os.environ.get("TTS_LANG_CONCURRENCY", "").split(",")
+        if item
+    )
+}
+TTS_LEASE_SECONDS = int(os.environ.get("TTS_LEASE_SECONDS", 600))
+# Pages whose audio failed this many times are not claimed again
+TTS_MAX_ATTEMPTS = int(os.environ.get("TTS_MAX_ATTEMPTS", 5))
+# Max size of the audio reused between pages with the same text
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# Seconds since last use before a cached audio can be evicted
+AUDIO_CACHE_MIN_AGE_SECONDS = int(os.environ.get("AUDIO_CACHE_MIN_AGE_SECONDS", 3600))
+# Audio streaming while the page is generated
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", 0.5))
+STREAM_TIMEOUT = int(os.environ.get("STREAM_TIMEOUT", 120))
+# Hours the chunks of completed pages are kept ("manage.py prune_audio_chunks")
+STREAM_CHUNKS_KEEP_HOURS = int(os.environ.get("STREAM_CHUNKS_KEEP_HOURS", 24))
+# Pages voiced ahead of each active reader
+PREFETCH_WINDOW = int(os.environ.get("PREFETCH_WINDOW", 5))
+READER_ACTIVE_MINUTES = int(os.environ.get("READER_ACTIVE_MINUTES", 30))
+
+# Pipeline tracing: time of each stage by file and page (spans saved in
+# database, admin stats in /api/status/pipeline/)
+TRACE_SPANS = os.environ.get("TRACE_SPANS", "True") == "True"
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", 500))
+TRACE_STATS_DAYS = int(os.environ.get("TRACE_STATS_DAYS", 7))
+TRACE_RETENTION_DAYS = int(os.environ.get("TRACE_RETENTION_DAYS", 30))
+
+# Logs of the app (pipeline spans, jobs and errors) in the console
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "format": "%(asctime)s %(levelname)s %(name)s [%(process)d] %(message)s",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "default",
+        },
+    },
+    "loggers": {
+        "audio_generator": {
+            "handlers": ["console"],
+            "level": LOG_LEVEL,
+        },
+    },
+}
@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.shortcuts import redirect
 from django.conf.urls.static import static
 from django.conf import settings
+from audio_generator.metrics import metrics
 
 urlpatterns = [
     
@@ -12,6 +13,9 @@ urlpatterns = [
     # Django REST Framework endpoints
     path('api/', include('audio_generator.urls')),
     
+    # Prometheus metrics
+    path('metrics/', metrics, name='metrics'),
+    
     # redirect home to api
     path('', lambda request: redirect('api/', permanent=False))
 ]